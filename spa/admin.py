@@ -1,6 +1,6 @@
 from django.contrib import admin
 
-from spa.models import Place, Action, Habit
+from spa.models import Place, Action, Habit, NotificationOutbox
 
 
 @admin.register(Place)
@@ -37,3 +37,17 @@ class HabitAdmin(admin.ModelAdmin):
         "date_time_next_sent",
     )
     list_filter = ("user", "place", "action")
+
+
+@admin.register(NotificationOutbox)
+class NotificationOutboxAdmin(admin.ModelAdmin):
+    list_display = (
+        "habit",
+        "occurrence",
+        "chat_id",
+        "status",
+        "attempts",
+        "available_at",
+        "sent_at",
+    )
+    list_filter = ("status",)
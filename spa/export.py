@@ -0,0 +1,113 @@
+"""
+Выгрузка привычек пользователя с названиями мест и действий в NDJSON
+(объект JSON в строке) или CSV.
+
+Строки читаются через .values() порциями по HABIT_EXPORT_CHUNK_SIZE
+(в PostgreSQL - серверным курсором) и сразу отдаются наружу, поэтому
+память не зависит от количества привычек, а первые строки уходят
+клиенту до того, как прочитана вся выборка.
+"""
+
+import csv
+from datetime import datetime
+
+from django.db.models import F
+from rest_framework.utils.encoders import JSONEncoder
+
+from config.renderers import FastJSONRenderer
+from config.settings import HABIT_EXPORT_CHUNK_SIZE
+from spa.models import Habit
+
+EXPORT_FORMAT_NDJSON = "ndjson"
+EXPORT_FORMAT_CSV = "csv"
+
+EXPORT_CONTENT_TYPES = {
+    EXPORT_FORMAT_NDJSON: "application/x-ndjson",
+    EXPORT_FORMAT_CSV: "text/csv; charset=utf-8",
+}
+
+EXPORT_FIELDS = (
+    "id",
+    "place",
+    "action",
+    "date_time",
+    "is_pleasant",
+    "related_habit",
+    "period",
+    "reward",
+    "time_to_complete",
+    "is_public",
+    "date_time_next_sent",
+)
+
+
+class Echo:
+    """Файл для csv.writer, который возвращает строку, а не пишет её"""
+
+    def write(self, value):
+        return value
+
+
+def get_export_rows(user, chunk_size=HABIT_EXPORT_CHUNK_SIZE):
+    return (
+        Habit.objects.filter(user=user)
+        .order_by("id")
+        .values(
+            "id",
+            "date_time",
+            "is_pleasant",
+            "related_habit",
+            "period",
+            "reward",
+            "time_to_complete",
+            "is_public",
+            "date_time_next_sent",
+            place_name=F("place__name"),
+            action_name=F("action__name"),
+        )
+        .iterator(chunk_size=chunk_size)
+    )
+
+
+def get_export_items(rows):
+    for row in rows:
+        row["place"] = row.pop("place_name")
+        row["action"] = row.pop("action_name")
+        yield {field: row[field] for field in EXPORT_FIELDS}
+
+
+def iter_ndjson(items):
+    renderer = FastJSONRenderer()
+    for item in items:
+        yield renderer.render(item) + b"\n"
+
+
+def get_csv_value(value):
+    # Значения - в том же виде, что и в JSON
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, datetime):
+        return JSONEncoder().default(value)
+    return value
+
+
+def iter_csv(items):
+    writer = csv.writer(Echo())
+    yield writer.writerow(EXPORT_FIELDS).encode()
+    for item in items:
+        yield writer.writerow(
+            [get_csv_value(value) for value in item.values()]
+        ).encode()
+
+
+def export_habits(user, export_format, chunk_size=HABIT_EXPORT_CHUNK_SIZE):
+    """Возвращает генератор строк выгрузки (bytes) в формате
+    export_format. Запрос к БД выполняется при чтении первой строки"""
+    items = get_export_items(get_export_rows(user, chunk_size))
+    if export_format == EXPORT_FORMAT_NDJSON:
+        return iter_ndjson(items)
+    if export_format == EXPORT_FORMAT_CSV:
+        return iter_csv(items)
+    raise ValueError(f"Неизвестный формат выгрузки: {export_format}")
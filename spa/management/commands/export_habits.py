@@ -0,0 +1,41 @@
+from django.core.management import BaseCommand, CommandError
+
+from spa.export import (
+    EXPORT_CONTENT_TYPES,
+    EXPORT_FORMAT_NDJSON,
+    export_habits,
+)
+from users.models import User
+
+
+# Выгружает привычки пользователя в файл или в stdout:
+# python manage.py export_habits user@my.ru --export-format csv -o habits.csv
+class Command(BaseCommand):
+    help = "Выгрузка привычек пользователя в NDJSON или CSV"
+
+    def add_arguments(self, parser):
+        parser.add_argument("email", help="email пользователя")
+        parser.add_argument(
+            "--export-format",
+            choices=list(EXPORT_CONTENT_TYPES),
+            default=EXPORT_FORMAT_NDJSON,
+        )
+        parser.add_argument(
+            "-o", "--output", help="файл выгрузки, по умолчанию stdout"
+        )
+
+    def handle(self, *args, **kwargs):
+        user = User.objects.filter(email=kwargs["email"]).first()
+        if user is None:
+            raise CommandError(f"Пользователь {kwargs['email']} не найден")
+
+        lines = export_habits(user, kwargs["export_format"])
+        if kwargs["output"] is None:
+            for line in lines:
+                self.stdout.write(line.decode(), ending="")
+            return
+
+        with open(kwargs["output"], "wb") as file:
+            for line in lines:
+                file.write(line)
+        self.stdout.write(f"Привычки выгружены в {kwargs['output']}")
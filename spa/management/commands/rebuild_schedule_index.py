@@ -0,0 +1,26 @@
+from django.core.management import BaseCommand, CommandError
+
+from config.settings import HABIT_SCHEDULE_INDEX_BATCH_SIZE
+from spa.models import Habit
+from spa.schedule_index import schedule_index
+
+
+# Пересобирает индекс расписания по БД, например, после первого
+# включения HABIT_SCHEDULE_INDEX_REDIS_URL или правки привычек в админке:
+# python manage.py rebuild_schedule_index
+class Command(BaseCommand):
+    help = "Пересобирает индекс расписания оповещений в Redis"
+
+    def handle(self, *args, **kwargs):
+        if not schedule_index.enabled:
+            raise CommandError("Не задан HABIT_SCHEDULE_INDEX_REDIS_URL")
+
+        habits = (
+            Habit.objects.filter(date_time_next_sent__isnull=False)
+            .exclude(period=Habit.PERIOD_DISABLE)
+            .values_list("id", "date_time_next_sent")
+            .order_by()
+            .iterator(chunk_size=HABIT_SCHEDULE_INDEX_BATCH_SIZE)
+        )
+        count = schedule_index.rebuild(habits)
+        self.stdout.write(f"В индексе расписания привычек: {count}")
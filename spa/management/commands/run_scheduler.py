@@ -0,0 +1,12 @@
+from django.core.management import BaseCommand
+
+from spa.scheduler import HabitScheduler
+
+
+# Запускается вместо периодической задачи send_user_notification_in_telegram
+# (её нужно убрать из CELERY_BEAT_SCHEDULE): python manage.py run_scheduler
+class Command(BaseCommand):
+    help = "Планировщик оповещений с точным временем срабатывания"
+
+    def handle(self, *args, **kwargs):
+        HabitScheduler().run()
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("spa", "0002_initial"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="habit",
+            name="claim_token",
+            field=models.UUIDField(
+                blank=True, null=True, verbose_name="Токен захвата рассылкой"
+            ),
+        ),
+        migrations.AddField(
+            model_name="habit",
+            name="claimed_until",
+            field=models.DateTimeField(
+                blank=True, null=True, verbose_name="Захвачена рассылкой до"
+            ),
+        ),
+    ]
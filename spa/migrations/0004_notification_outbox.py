@@ -0,0 +1,93 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:12
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("spa", "0003_habit_claim"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="NotificationOutbox",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("occurrence", models.DateTimeField(verbose_name="Время оповещения")),
+                ("chat_id", models.BigIntegerField(verbose_name="ID чата в Telegram")),
+                ("message", models.TextField(verbose_name="Текст оповещения")),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("PENDING", "Ожидает отправки"),
+                            ("SENDING", "Отправляется"),
+                            ("SENT", "Отправлено"),
+                            ("FAILED", "Не доставлено"),
+                        ],
+                        default="PENDING",
+                        max_length=10,
+                        verbose_name="Статус",
+                    ),
+                ),
+                (
+                    "attempts",
+                    models.PositiveIntegerField(
+                        default=0, verbose_name="Количество попыток"
+                    ),
+                ),
+                (
+                    "available_at",
+                    models.DateTimeField(
+                        default=django.utils.timezone.now,
+                        verbose_name="Доступно для отправки с",
+                    ),
+                ),
+                (
+                    "claim_token",
+                    models.UUIDField(
+                        blank=True, null=True, verbose_name="Токен захвата доставкой"
+                    ),
+                ),
+                (
+                    "created_at",
+                    models.DateTimeField(auto_now_add=True, verbose_name="Создано"),
+                ),
+                (
+                    "sent_at",
+                    models.DateTimeField(
+                        blank=True, null=True, verbose_name="Отправлено"
+                    ),
+                ),
+                (
+                    "habit",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="notifications",
+                        to="spa.habit",
+                        verbose_name="Привычка",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Оповещение в очереди",
+                "verbose_name_plural": "Очередь оповещений",
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("habit", "occurrence"), name="unique_habit_occurrence"
+                    )
+                ],
+            },
+        ),
+    ]
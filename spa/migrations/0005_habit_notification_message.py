@@ -0,0 +1,20 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("spa", "0004_notification_outbox"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="habit",
+            name="notification_message",
+            field=models.TextField(
+                blank=True, default="", verbose_name="Текст оповещения"
+            ),
+        ),
+    ]
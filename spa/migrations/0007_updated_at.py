@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("spa", "0006_habit_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="action",
+            name="updated_at",
+            field=models.DateTimeField(
+                auto_now=True, verbose_name="Дата и время изменения"
+            ),
+        ),
+        migrations.AddField(
+            model_name="habit",
+            name="updated_at",
+            field=models.DateTimeField(
+                auto_now=True, verbose_name="Дата и время изменения"
+            ),
+        ),
+        migrations.AddField(
+            model_name="place",
+            name="updated_at",
+            field=models.DateTimeField(
+                auto_now=True, verbose_name="Дата и время изменения"
+            ),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("spa", "0008_habit_updated_at_index"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="notificationoutbox",
+            index=models.Index(
+                condition=models.Q(("status__in", ("PENDING", "SENDING"))),
+                fields=["occurrence", "chat_id"],
+                name="spa_outbox_pending_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="notificationoutbox",
+            index=models.Index(
+                condition=models.Q(("status__in", ("SENT", "FAILED"))),
+                fields=["created_at"],
+                name="spa_outbox_done_idx",
+            ),
+        ),
+    ]
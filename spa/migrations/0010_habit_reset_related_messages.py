@@ -0,0 +1,23 @@
+from django.db import migrations
+
+
+def reset_related_messages(apps, schema_editor):
+    # Прежний текст содержал email владельца связанной привычки. Пустой
+    # текст пересобирается при постановке оповещения в очередь
+    Habit = apps.get_model("spa", "Habit")
+    Habit.objects.filter(related_habit__isnull=False).update(
+        notification_message=""
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("spa", "0009_notification_outbox_indexes"),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            reset_related_messages, migrations.RunPython.noop
+        ),
+    ]
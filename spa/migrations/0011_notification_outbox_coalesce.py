@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:23
+
+from django.db import migrations, models
+
+
+def copy_user_setting(apps, schema_editor):
+    # Ещё не доставленные оповещения объединяются по настройке
+    # пользователя, как и до переноса её в очередь
+    NotificationOutbox = apps.get_model("spa", "NotificationOutbox")
+    NotificationOutbox.objects.filter(
+        status__in=("PENDING", "SENDING"),
+        habit__user__tg_coalesce_notifications=False,
+    ).update(coalesce=False)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("spa", "0010_habit_reset_related_messages"),
+        ("users", "0003_user_tg_coalesce_notifications"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="notificationoutbox",
+            name="coalesce",
+            field=models.BooleanField(
+                default=True,
+                verbose_name="Объединять одновременные оповещения",
+            ),
+        ),
+        migrations.RunPython(copy_user_setting, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,128 @@
+"""
+Условные запросы по ETag и Last-Modified для представлений DRF.
+
+Версия объекта - его updated_at, версия списка - количество объектов
+и наибольший updated_at среди них (один агрегатный запрос к БД, общий
+для веб-процессов и задач Celery). Если клиент прислал
+If-None-Match или If-Modified-Since и ресурс не изменился,
+возвращается 304 без сериализации. У списков только ETag. PUT и PATCH
+с If-Match или If-Unmodified-Since к изменённому с тех пор объекту
+получают 412, и чужие изменения не затираются.
+"""
+
+import hashlib
+
+from django.db.models import Count, Max
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from rest_framework.response import Response
+
+
+def get_etag(*parts):
+    digest = hashlib.md5(
+        ":".join(str(part) for part in parts).encode(), usedforsecurity=False
+    )
+    return quote_etag(digest.hexdigest())
+
+
+def set_conditional_headers(response, etag, last_modified=None):
+    response["ETag"] = etag
+    if last_modified is not None:
+        response["Last-Modified"] = http_date(last_modified.timestamp())
+    return response
+
+
+class ConditionalObjectMixin:
+    """ETag и Last-Modified для просмотра и изменения одного объекта"""
+
+    def get_object(self):
+        # Объект нужен и для проверки условия, и для самого запроса,
+        # поэтому читается из БД один раз
+        if not hasattr(self, "_conditional_object"):
+            self._conditional_object = super().get_object()
+        return self._conditional_object
+
+    def get_object_etag(self, instance):
+        return get_etag(instance._meta.label, instance.pk, instance.updated_at)
+
+    def get_conditional_response(self, request, instance):
+        etag = self.get_object_etag(instance)
+        response = get_conditional_response(
+            request,
+            etag=etag,
+            last_modified=int(instance.updated_at.timestamp()),
+        )
+        if response is not None:
+            set_conditional_headers(response, etag, instance.updated_at)
+        return response
+
+    def retrieve(self, request, *args, **kwargs):
+        instance = self.get_object()
+        conditional_response = self.get_conditional_response(request, instance)
+        if conditional_response is not None:
+            return conditional_response
+
+        response = super().retrieve(request, *args, **kwargs)
+        return set_conditional_headers(
+            response, self.get_object_etag(instance), instance.updated_at
+        )
+
+    def update(self, request, *args, **kwargs):
+        instance = self.get_object()
+        conditional_response = self.get_conditional_response(request, instance)
+        if conditional_response is not None:
+            return conditional_response
+
+        response = super().update(request, *args, **kwargs)
+        # Объект уже сохранён, отдаём его новую версию
+        return set_conditional_headers(
+            response, self.get_object_etag(instance), instance.updated_at
+        )
+
+
+class ConditionalListMixin:
+    """ETag для списка объектов: меняется при добавлении, изменении
+    и удалении объектов списка"""
+
+    def get_list_version(self):
+        # Удаление меняет количество, остальное - наибольший updated_at
+        version = (
+            self.filter_queryset(self.get_queryset())
+            .order_by()
+            .aggregate(count=Count("id"), updated_at=Max("updated_at"))
+        )
+        return version["count"], version["updated_at"]
+
+    def get_list_etag(self, request):
+        # Параметры страницы входят в ETag
+        return get_etag(*self.get_list_version(), request.get_full_path())
+
+    def list(self, request, *args, **kwargs):
+        etag = self.get_list_etag(request)
+        conditional_response = get_conditional_response(request, etag=etag)
+        if conditional_response is not None:
+            return set_conditional_headers(conditional_response, etag)
+
+        response = super().list(request, *args, **kwargs)
+        return set_conditional_headers(response, etag)
+
+
+class ValuesListMixin:
+    """Список через быструю сериализацию spa.serializers.ValuesSerializer,
+    если она включена для представления атрибутом values_serializer"""
+
+    values_serializer = None
+
+    def list(self, request, *args, **kwargs):
+        if self.values_serializer is None:
+            return super().list(request, *args, **kwargs)
+
+        queryset = self.values_serializer.get_values(
+            self.filter_queryset(self.get_queryset())
+        )
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(
+                self.values_serializer.to_representation(page)
+            )
+        return Response(self.values_serializer.to_representation(queryset))
@@ -1,18 +1,71 @@
-from django.db import models
+from django.db import connections, models, transaction
+from django.db.models import Case, IntegerField, When
+from django.db.models.sql import UpdateQuery
+from django.dispatch import Signal
 from django.utils import timezone
 
+from config.settings import HABIT_MESSAGE_REFRESH_BATCH_SIZE
 from spa.services import (
     get_next_day_date,
     get_next_week_date,
     get_next_minute_date,
     get_next_hour_date,
+    get_notification_message,
+    NOT_SPECIFIED,
+)
+from spa.services_db import (
+    FromEpochSeconds,
+    get_next_day_date_expression,
+    get_next_hour_date_expression,
+    get_next_minute_date_expression,
+    get_next_week_date_expression,
+    get_start_expression,
 )
 from users.models import User
 
 NULLABLE = {"blank": True, "null": True}
 
+# Отправляется после Habit.bulk_save: bulk_create и bulk_update
+# не отправляют post_save для каждой привычки (см. spa.signals)
+habits_bulk_saved = Signal()
+
+
+class TrackedFieldsMixin:
+    """Запоминает значения полей tracked_fields, прочитанные из БД:
+    сигналы после сохранения по has_tracked_changes() понимают, изменились
+    ли они, без лишнего запроса к БД"""
+
+    tracked_fields = ()
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance.remember_tracked_fields()
+        return instance
+
+    def remember_tracked_fields(self):
+        self._tracked_values = {
+            name: self.__dict__.get(name) for name in self.tracked_fields
+        }
+
+    def has_tracked_changes(self):
+        # Объект не из БД: неизвестно, что в ней было
+        if not hasattr(self, "_tracked_values"):
+            return True
+        return any(
+            self.__dict__.get(name) != value
+            for name, value in self._tracked_values.items()
+        )
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        self.remember_tracked_fields()
+
+
+class Place(TrackedFieldsMixin, models.Model):
+    # Название входит в текст оповещения привычек
+    tracked_fields = ("name",)
 
-class Place(models.Model):
     name = models.CharField(max_length=150, verbose_name="Название места")
     user = models.ForeignKey(
         User,
@@ -21,6 +74,9 @@ class Place(models.Model):
         verbose_name="Пользователь",
         related_name="places",
     )
+    updated_at = models.DateTimeField(
+        verbose_name="Дата и время изменения", auto_now=True
+    )
 
     def __str__(self):
         return self.name
@@ -30,7 +86,9 @@ class Place(models.Model):
         verbose_name_plural = "Места"
 
 
-class Action(models.Model):
+class Action(TrackedFieldsMixin, models.Model):
+    tracked_fields = ("name",)
+
     name = models.CharField(max_length=150, verbose_name="Название действия")
 
     user = models.ForeignKey(
@@ -40,6 +98,9 @@ class Action(models.Model):
         verbose_name="Пользователь",
         related_name="actions",
     )
+    updated_at = models.DateTimeField(
+        verbose_name="Дата и время изменения", auto_now=True
+    )
 
     def __str__(self):
         return self.name
@@ -49,7 +110,10 @@ class Action(models.Model):
         verbose_name_plural = "Действия"
 
 
-class Habit(models.Model):
+class Habit(TrackedFieldsMixin, models.Model):
+    # Из них собрана строка привычки в тексте зависимых привычек
+    tracked_fields = ("user_id", "place_id", "action_id")
+
     PERIOD_DISABLE = "DISABLE"
     PERIOD_EVERY_MINUTE = "EVERY_MINUTE"
     PERIOD_EVERY_HOUR = "EVERY_HOUR"
@@ -123,39 +187,445 @@ class Habit(models.Model):
         verbose_name="Дата и время следующего оповещения", **NULLABLE
     )
 
+    # Захват привычки рассылкой: пока не истёк claimed_until, другие
+    # запуски рассылки эту привычку не берут. Снимается при переносе
+    claim_token = models.UUIDField(
+        verbose_name="Токен захвата рассылкой", **NULLABLE
+    )
+    claimed_until = models.DateTimeField(
+        verbose_name="Захвачена рассылкой до", **NULLABLE
+    )
+
+    # заполняется программно при сохранении привычки и при изменении
+    # того, из чего собран текст (места, действия, связанной привычки)
+    notification_message = models.TextField(
+        verbose_name="Текст оповещения", default="", blank=True
+    )
+
+    # Обновляется при каждом изменении привычки, в том числе при переносе
+    # оповещения и пересборке текста пачкой: по нему считаются ETag
+    # и Last-Modified
+    updated_at = models.DateTimeField(
+        verbose_name="Дата и время изменения", auto_now=True
+    )
+
     def __str__(self):
-        return f"{self.user.email}: {self.place.name}, {self.action.name}"
+        # Пользователь, место и действие у привычки необязательны
+        return (
+            f"{self.user.email if self.user else NOT_SPECIFIED}: "
+            f"{self.place.name if self.place else NOT_SPECIFIED}, "
+            f"{self.action.name if self.action else NOT_SPECIFIED}"
+        )
+
+    @property
+    def title(self):
+        """Место и действие привычки без данных владельца: связанной
+        может быть чужая публичная привычка, а её название уходит
+        в текст оповещения"""
+        return (
+            f"{self.place.name if self.place else NOT_SPECIFIED}, "
+            f"{self.action.name if self.action else NOT_SPECIFIED}"
+        )
+
+    def render_notification_message(self):
+        return get_notification_message(
+            self.place,
+            self.action,
+            self.time_to_complete,
+            self.related_habit.title if self.related_habit else self.reward,
+        )
+
+    def save(self, *args, **kwargs):
+        self.notification_message = self.render_notification_message()
+        if kwargs.get("update_fields") is not None:
+            kwargs["update_fields"] = {
+                *kwargs["update_fields"],
+                "notification_message",
+            }
+        super().save(*args, **kwargs)
+
+    @classmethod
+    def iter_refreshed_notification_messages(
+        cls, habits_queryset, batch_size=HABIT_MESSAGE_REFRESH_BATCH_SIZE
+    ):
+        """Пересобирает текст оповещения для привычек из кверисета
+        порциями по batch_size привычек в порядке id: на порцию один
+        JOIN-запрос (все нужные объекты подтягиваются сразу) и один
+        bulk_update. Отдаёт сохранённые порции привычек."""
+        habits_queryset = habits_queryset.select_related(
+            "place",
+            "action",
+            "related_habit__place",
+            "related_habit__action",
+        ).order_by("id")
+
+        last_id = None
+        while True:
+            chunk = habits_queryset
+            if last_id is not None:
+                chunk = chunk.filter(id__gt=last_id)
+            habits = list(chunk[:batch_size])
+            if not habits:
+                return
+
+            now = timezone.now()
+            for habit in habits:
+                habit.notification_message = (
+                    habit.render_notification_message()
+                )
+                habit.updated_at = now
+            cls.objects.bulk_update(
+                habits, ["notification_message", "updated_at"]
+            )
+            yield habits
+
+            if len(habits) < batch_size:
+                return
+            last_id = habits[-1].pk
+
+    @classmethod
+    def refresh_notification_messages(
+        cls, habits_queryset, batch_size=HABIT_MESSAGE_REFRESH_BATCH_SIZE
+    ):
+        """То же, что iter_refreshed_notification_messages.
+        Возвращает количество привычек."""
+        return sum(
+            len(habits)
+            for habits in cls.iter_refreshed_notification_messages(
+                habits_queryset, batch_size
+            )
+        )
+
+    @classmethod
+    def get_next_execution_time(cls, period, date_time, now_time):
+        """Возвращает дату/время следующего оповещения для периодичности
+        period или None, если оповещения отключены."""
+        date_time_start = date_time.replace(second=0, microsecond=0)
+
+        match period:
+            case cls.PERIOD_EVERY_MINUTE:
+                return get_next_minute_date(date_time_start, now_time)
+
+            case cls.PERIOD_EVERY_HOUR:
+                return get_next_hour_date(date_time_start, now_time)
+
+            case cls.PERIOD_EVERY_DAY:
+                return get_next_day_date(date_time_start, now_time)
+
+            case cls.PERIOD_EVERY_WEEK:
+                return get_next_week_date(date_time_start, now_time)
+
+            case _:
+                return None
 
     def set_next_execution_time(self):
-        date_time_start = self.date_time.replace(second=0, microsecond=0)
         now_time = timezone.now().replace(second=0, microsecond=0)
+        self.date_time_next_sent = self.get_next_execution_time(
+            self.period, self.date_time, now_time
+        )
 
-        match self.period:
-            case self.PERIOD_EVERY_MINUTE:
-                self.date_time_next_sent = get_next_minute_date(
-                    date_time_start, now_time
-                )
+        self.save()
 
-            case self.PERIOD_EVERY_HOUR:
-                self.date_time_next_sent = get_next_hour_date(
-                    date_time_start, now_time
+    @classmethod
+    def bulk_save(cls, habits, batch_size=None):
+        """Сохраняет пачку новых и изменённых привычек: время следующего
+        оповещения и текст считаются в памяти, новые привычки создаются
+        одним bulk_create, изменённые - одним bulk_update. Места, действия
+        и связанные привычки должны быть уже загружены.
+        Возвращает список привычек."""
+        now = timezone.now()
+        now_time = now.replace(second=0, microsecond=0)
+        for habit in habits:
+            habit.date_time_next_sent = cls.get_next_execution_time(
+                habit.period, habit.date_time, now_time
+            )
+            habit.notification_message = habit.render_notification_message()
+            habit.updated_at = now
+
+        created = [habit for habit in habits if habit._state.adding]
+        changed = [habit for habit in habits if not habit._state.adding]
+        # Захват рассылкой не трогаем: привычку могут рассылать прямо
+        # сейчас
+        fields = [
+            field.name
+            for field in cls._meta.concrete_fields
+            if not field.primary_key
+            and field.name not in ("claim_token", "claimed_until")
+        ]
+        with transaction.atomic():
+            # Как и в сигнале remember_was_public: привычку, которую
+            # сделали непубличной, нужно убрать из ленты
+            was_public = cls.objects.filter(
+                pk__in=[habit.pk for habit in changed if not habit.is_public],
+                is_public=True,
+            ).exists()
+            cls.objects.bulk_create(created, batch_size=batch_size)
+            cls.objects.bulk_update(changed, fields, batch_size=batch_size)
+
+        habits_bulk_saved.send(
+            sender=cls, created=created, changed=changed, was_public=was_public
+        )
+        return habits
+
+    @classmethod
+    def get_next_execution_time_after(cls, period, date_time, sent_time):
+        """Возвращает дату/время оповещения, следующего строго после
+        уже отправленного в sent_time"""
+        # Пока привычка не началась, функции spa.services возвращают
+        # её начало, в том числе когда оно совпадает с текущим временем.
+        # Сдвиг на секунду исключает повторную отправку того же оповещения
+        return cls.get_next_execution_time(
+            period, date_time, sent_time + timezone.timedelta(seconds=1)
+        )
+
+    @classmethod
+    def get_next_execution_time_expression(cls, now_time):
+        """Выражение БД, аналог get_next_execution_time для каждой
+        привычки запроса: NULL, если оповещения отключены"""
+        date_time_start = get_start_expression("date_time")
+        return FromEpochSeconds(
+            Case(
+                When(
+                    period=cls.PERIOD_EVERY_MINUTE,
+                    then=get_next_minute_date_expression(
+                        date_time_start, now_time
+                    ),
+                ),
+                When(
+                    period=cls.PERIOD_EVERY_HOUR,
+                    then=get_next_hour_date_expression(
+                        date_time_start, now_time
+                    ),
+                ),
+                When(
+                    period=cls.PERIOD_EVERY_DAY,
+                    then=get_next_day_date_expression(
+                        date_time_start, now_time
+                    ),
+                ),
+                When(
+                    period=cls.PERIOD_EVERY_WEEK,
+                    then=get_next_week_date_expression(
+                        date_time_start, now_time
+                    ),
+                ),
+                default=None,
+                output_field=IntegerField(),
+            )
+        )
+
+    @classmethod
+    def get_next_execution_time_after_expression(cls, sent_time):
+        """Выражение БД, аналог get_next_execution_time_after"""
+        return cls.get_next_execution_time_expression(
+            sent_time + timezone.timedelta(seconds=1)
+        )
+
+    @classmethod
+    def reschedule(
+        cls,
+        habits_queryset,
+        sent_time,
+        returning=("id", "date_time_next_sent"),
+    ):
+        """Одним запросом UPDATE ... RETURNING переносит дату следующего
+        оповещения для привычек из кверисета на время после sent_time
+        (считается в БД), снимает захват рассылкой и обновляет
+        updated_at. Возвращает список кортежей значений полей returning
+        после переноса."""
+        query = habits_queryset.query.chain(UpdateQuery)
+        query.add_update_values(
+            {
+                "date_time_next_sent": (
+                    cls.get_next_execution_time_after_expression(sent_time)
+                ),
+                "claim_token": None,
+                "claimed_until": None,
+                # Время приложения, как у auto_now в save(): изменения
+                # упорядочены по одним часам (spa.scheduler)
+                "updated_at": timezone.now(),
+            }
+        )
+        query.clear_ordering(force=True)
+        query.clear_select_clause()
+
+        connection = connections[habits_queryset.db]
+        compiler = query.get_compiler(connection=connection)
+        compiler.pre_sql_setup()
+        sql, params = compiler.as_sql()
+
+        columns = [
+            cls._meta.get_field(field_name).get_col(cls._meta.db_table)
+            for field_name in returning
+        ]
+        sql += " RETURNING " + ", ".join(
+            connection.ops.quote_name(column.target.column)
+            for column in columns
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            rows = cursor.fetchall()
+
+        # Значения приводятся к типам Python так же, как в обычном SELECT
+        converters = [
+            connection.ops.get_db_converters(column)
+            + column.get_db_converters(connection)
+            for column in columns
+        ]
+        return [
+            tuple(
+                cls._convert(value, column, column_converters, connection)
+                for value, column, column_converters in zip(
+                    row, columns, converters
                 )
+            )
+            for row in rows
+        ]
+
+    @staticmethod
+    def _convert(value, column, converters, connection):
+        for converter in converters:
+            value = converter(value, column, connection)
+        return value
+
+    @classmethod
+    def bulk_reschedule(cls, habits, sent_time, batch_size=None):
+        """Переносит дату/время следующего оповещения для привычек,
+        оповещение по которым отправлено в sent_time, и снимает захват
+        рассылкой. Новое время считается в БД: один UPDATE ... RETURNING
+        на пачку, объекты привычек получают его из ответа.
+        Возвращает количество перенесённых привычек."""
+        habits_by_id = {habit.pk: habit for habit in habits}
+        habit_ids = list(habits_by_id)
+        batch_size = batch_size or len(habit_ids)
+
+        rescheduled = 0
+        for start in range(0, len(habit_ids), batch_size):
+            rows = cls.reschedule(
+                cls.objects.filter(
+                    pk__in=habit_ids[start : start + batch_size]
+                ),
+                sent_time,
+                returning=("id", "date_time_next_sent", "updated_at"),
+            )
+            for habit_id, date_time_next_sent, updated_at in rows:
+                habit = habits_by_id[habit_id]
+                habit.date_time_next_sent = date_time_next_sent
+                habit.updated_at = updated_at
+                habit.claim_token = None
+                habit.claimed_until = None
+            rescheduled += len(rows)
+
+        return rescheduled
 
-            case self.PERIOD_EVERY_DAY:
-                self.date_time_next_sent = get_next_day_date(
-                    date_time_start, now_time
-                )
+    class Meta:
+        verbose_name = "Привычка"
+        verbose_name_plural = "Привычки"
+        indexes = [
+            # Выборка привычек, по которым пора отправить оповещение.
+            # Отключённые привычки рассылка не берёт и в индекс не попадают
+            models.Index(
+                fields=["date_time_next_sent", "id"],
+                condition=~models.Q(period="DISABLE"),
+                name="spa_habit_due_idx",
+            ),
+            # Списки публичных и своих привычек с сортировкой по id.
+            # Публичных привычек немного, поэтому индекс частичный
+            models.Index(
+                fields=["id"],
+                condition=models.Q(is_public=True),
+                name="spa_habit_public_id_idx",
+            ),
+            models.Index(fields=["user", "id"], name="spa_habit_user_id_idx"),
+            # Изменения привычек после уже виденных (spa.scheduler)
+            models.Index(
+                fields=["updated_at", "id"], name="spa_habit_updated_at_idx"
+            ),
+        ]
+
+
+class NotificationOutbox(models.Model):
+    """Оповещение о привычке, ожидающее доставки в Telegram.
+    Создаётся в одной транзакции с переносом привычки, доставляется
+    отдельной задачей deliver_notifications."""
+
+    STATUS_PENDING = "PENDING"
+    STATUS_SENDING = "SENDING"
+    STATUS_SENT = "SENT"
+    STATUS_FAILED = "FAILED"
+
+    STATUS_CHOICES = {
+        STATUS_PENDING: "Ожидает отправки",
+        STATUS_SENDING: "Отправляется",
+        STATUS_SENT: "Отправлено",
+        STATUS_FAILED: "Не доставлено",
+    }
 
-            case self.PERIOD_EVERY_WEEK:
-                self.date_time_next_sent = get_next_week_date(
-                    date_time_start, now_time
-                )
+    habit = models.ForeignKey(
+        Habit,
+        on_delete=models.CASCADE,
+        verbose_name="Привычка",
+        related_name="notifications",
+    )
+    # Время оповещения по расписанию: вместе с привычкой - ключ
+    # дедупликации, одно оповещение не попадёт в очередь дважды
+    occurrence = models.DateTimeField(verbose_name="Время оповещения")
+    chat_id = models.BigIntegerField(verbose_name="ID чата в Telegram")
+    message = models.TextField(verbose_name="Текст оповещения")
+    # Настройка пользователя на момент постановки в очередь: доставке
+    # не нужно ради неё присоединять привычку и пользователя
+    coalesce = models.BooleanField(
+        verbose_name="Объединять одновременные оповещения", default=True
+    )
 
-            case _:
-                pass
+    status = models.CharField(
+        max_length=10,
+        verbose_name="Статус",
+        choices=STATUS_CHOICES,
+        default=STATUS_PENDING,
+    )
+    attempts = models.PositiveIntegerField(
+        verbose_name="Количество попыток", default=0
+    )
+    # Не раньше какого времени оповещение можно (повторно) взять
+    # в доставку. Для взятого в доставку - срок, после которого его
+    # заберёт другой воркер, если этот упал
+    available_at = models.DateTimeField(
+        verbose_name="Доступно для отправки с", default=timezone.now
+    )
+    claim_token = models.UUIDField(
+        verbose_name="Токен захвата доставкой", **NULLABLE
+    )
+    created_at = models.DateTimeField(
+        verbose_name="Создано", auto_now_add=True
+    )
+    sent_at = models.DateTimeField(verbose_name="Отправлено", **NULLABLE)
 
-        self.save()
+    def __str__(self):
+        return f"{self.habit_id}: {self.occurrence} ({self.status})"
 
     class Meta:
-        verbose_name = "Привычка"
-        verbose_name_plural = "Привычки"
+        verbose_name = "Оповещение в очереди"
+        verbose_name_plural = "Очередь оповещений"
+        constraints = [
+            models.UniqueConstraint(
+                fields=["habit", "occurrence"],
+                name="unique_habit_occurrence",
+            )
+        ]
+        indexes = [
+            # Захват в доставку (spa.tasks.claim_notifications): в индексе
+            # только ожидающие оповещения, в порядке выдачи
+            models.Index(
+                fields=["occurrence", "chat_id"],
+                condition=models.Q(status__in=("PENDING", "SENDING")),
+                name="spa_outbox_pending_idx",
+            ),
+            # Очистка доставленных и недоставленных
+            # (spa.tasks.purge_notifications)
+            models.Index(
+                fields=["created_at"],
+                condition=models.Q(status__in=("SENT", "FAILED")),
+                name="spa_outbox_done_idx",
+            ),
+        ]
@@ -1,7 +1,75 @@
-from rest_framework.pagination import PageNumberPagination
+from rest_framework.pagination import (
+    BasePagination,
+    CursorPagination,
+    PageNumberPagination,
+)
 
 
 class CustomPagePagination(PageNumberPagination):
     page_size = 5
     page_size_query_param = "page_size"
     max_page_size = 100
+
+
+class CustomCursorPagination(CursorPagination):
+    """Курсорная пагинация по id: следующая страница выбирается
+    условием id > последнего на странице, без COUNT(*) и OFFSET"""
+
+    page_size = 5
+    page_size_query_param = "page_size"
+    max_page_size = 100
+    ordering = "id"
+
+
+class HabitListPagination(BasePagination):
+    """Постраничная пагинация для старых клиентов (по умолчанию) или
+    курсорная, если передан ?pagination=cursor или уже полученный
+    курсор ?cursor=..."""
+
+    mode_query_param = "pagination"
+    cursor_mode = "cursor"
+
+    def __init__(self):
+        self.page_pagination = CustomPagePagination()
+        self.cursor_pagination = CustomCursorPagination()
+        self.pagination = self.page_pagination
+
+    def is_cursor_mode(self, request):
+        return (
+            request.query_params.get(self.mode_query_param) == self.cursor_mode
+            or self.cursor_pagination.cursor_query_param
+            in request.query_params
+        )
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.is_cursor_mode(request):
+            self.pagination = self.cursor_pagination
+        return self.pagination.paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        return self.pagination.get_paginated_response(data)
+
+    def get_paginated_response_schema(self, schema):
+        return self.pagination.get_paginated_response_schema(schema)
+
+    def get_schema_operation_parameters(self, view):
+        parameters = {
+            parameter["name"]: parameter
+            for pagination in (self.page_pagination, self.cursor_pagination)
+            for parameter in pagination.get_schema_operation_parameters(view)
+        }
+        parameters[self.mode_query_param] = {
+            "name": self.mode_query_param,
+            "required": False,
+            "in": "query",
+            "description": "cursor - курсорная пагинация вместо постраничной",
+            "schema": {"type": "string", "enum": [self.cursor_mode]},
+        }
+        return list(parameters.values())
+
+    @property
+    def display_page_controls(self):
+        return self.pagination.display_page_controls
+
+    def to_html(self):
+        return self.pagination.to_html()
@@ -0,0 +1,93 @@
+"""
+Кэш ленты публичных привычек: страница ответа /spa/habit/list/public/
+одинакова для всех пользователей и хранится в кэше Django целиком.
+
+Ключи страниц содержат версию ленты. При сохранении или удалении
+публичной привычки (сигналы spa.signals) версия меняется, и старые
+страницы просто перестают читаться, а затем истекают.
+
+Чтобы после смены версии страницу не пересобирали одновременно все
+запросы, пересобирает её только тот, кто взял блокировку, а остальные
+ждут результат до HABIT_PUBLIC_FEED_LOCK_WAIT и лишь затем собирают
+страницу сами.
+"""
+
+import hashlib
+import time
+from uuid import uuid4
+
+from django.core.cache import cache
+
+from config.settings import (
+    HABIT_PUBLIC_FEED_CACHE_TIMEOUT,
+    HABIT_PUBLIC_FEED_LOCK_TIMEOUT,
+    HABIT_PUBLIC_FEED_LOCK_WAIT,
+)
+
+PUBLIC_FEED_VERSION_KEY = "spa:public_feed_version"
+
+# Как часто проверять, не собрал ли страницу запрос с блокировкой, с
+LOCK_POLL_INTERVAL = 0.05
+
+
+class PublicFeedCache:
+    def __init__(
+        self,
+        timeout=HABIT_PUBLIC_FEED_CACHE_TIMEOUT,
+        lock_timeout=HABIT_PUBLIC_FEED_LOCK_TIMEOUT,
+        lock_wait=HABIT_PUBLIC_FEED_LOCK_WAIT,
+        sleep=time.sleep,
+    ):
+        self.timeout = timeout
+        self.lock_timeout = lock_timeout
+        self.lock_wait = lock_wait
+        self.sleep = sleep
+
+    def get_version(self):
+        return cache.get_or_set(
+            PUBLIC_FEED_VERSION_KEY, lambda: uuid4().hex, None
+        )
+
+    def bump_version(self):
+        cache.set(PUBLIC_FEED_VERSION_KEY, uuid4().hex, None)
+
+    def get_key(self, url):
+        # В ответе ссылки на соседние страницы, поэтому ключ - полный URL
+        url_hash = hashlib.sha256(url.encode()).hexdigest()
+        return f"spa:public_feed:{self.get_version()}:{url_hash}"
+
+    def get_or_build(self, url, build):
+        """Возвращает страницу ленты по URL из кэша, а если её нет -
+        собирает вызовом build() и кэширует"""
+        key = self.get_key(url)
+        page = cache.get(key)
+        if page is not None:
+            return page
+
+        lock_key = f"{key}:lock"
+        locked = cache.add(lock_key, 1, self.lock_timeout)
+        if not locked:
+            page = self.wait(key)
+            if page is not None:
+                return page
+
+        try:
+            page = build()
+            cache.set(key, page, self.timeout)
+        finally:
+            if locked:
+                cache.delete(lock_key)
+        return page
+
+    def wait(self, key):
+        """Ждёт, пока страницу соберёт запрос, взявший блокировку"""
+        deadline = time.monotonic() + self.lock_wait
+        while time.monotonic() < deadline:
+            self.sleep(LOCK_POLL_INTERVAL)
+            page = cache.get(key)
+            if page is not None:
+                return page
+        return None
+
+
+public_feed_cache = PublicFeedCache()
@@ -0,0 +1,140 @@
+"""
+Связанные объекты привычки: проверка владельца и загрузка пачкой.
+
+Ссылаться можно только на свои объекты или на общие: места и действия
+без пользователя, публичные привычки. Чужой объект для клиента
+неотличим от несуществующего.
+
+Вместо запроса на каждое поле PrimaryKeyRelatedField все объекты,
+на которые ссылаются входные данные, загружаются до валидации полей:
+поля моделей с одинаковыми колонками (места и действия) - одним
+запросом UNION ALL, остальные - запросом на поле. Валидаторы получают
+уже загруженные объекты.
+"""
+
+from collections import defaultdict
+from collections.abc import Mapping
+
+from django.core.exceptions import ValidationError
+from django.db.models import IntegerField, Q, Value
+from rest_framework import serializers
+
+
+class OwnedPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    """Первичный ключ своего объекта или общего (условие shared)"""
+
+    owner_field = "user"
+
+    def __init__(self, shared=None, **kwargs):
+        # Без условия общими считаются объекты без владельца
+        self.shared = (
+            Q(**{self.owner_field: None}) if shared is None else shared
+        )
+        super().__init__(**kwargs)
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        request = self.context.get("request")
+        if request is None or not request.user.is_authenticated:
+            return queryset.none()
+        return queryset.filter(
+            Q(**{self.owner_field: request.user}) | self.shared
+        )
+
+    def to_pk(self, data):
+        if isinstance(data, bool):
+            raise TypeError(data)
+        try:
+            return self.queryset.model._meta.pk.to_python(data)
+        except ValidationError:
+            raise ValueError(data)
+
+    def to_internal_value(self, data):
+        resolved = getattr(self.root, "resolved_objects", None)
+        if resolved is None or self.field_name not in resolved:
+            return super().to_internal_value(data)
+
+        try:
+            pk = self.to_pk(data)
+        except (TypeError, ValueError):
+            self.fail("incorrect_type", data_type=type(data).__name__)
+        obj = resolved[self.field_name].get(pk)
+        if obj is None:
+            self.fail("does_not_exist", pk_value=data)
+        return obj
+
+
+def get_owned_fields(serializer):
+    return [
+        field
+        for field in serializer.fields.values()
+        if isinstance(field, OwnedPrimaryKeyRelatedField)
+        and not field.read_only
+    ]
+
+
+def get_columns(model):
+    return tuple(
+        (field.attname, field.get_internal_type())
+        for field in model._meta.concrete_fields
+    )
+
+
+def resolve_related_objects(fields, items):
+    """Загрузка объектов, на которые ссылаются поля fields во входных
+    данных items. Возвращает {имя поля: {pk: объект}}"""
+    resolved = {}
+    groups = defaultdict(list)
+    for field in fields:
+        pks = set()
+        for item in items:
+            if not isinstance(item, Mapping):
+                continue
+            value = item.get(field.field_name)
+            if value is None or value == "":
+                continue
+            try:
+                pks.add(field.to_pk(value))
+            except (TypeError, ValueError):
+                # Ошибку вернёт само поле при валидации
+                continue
+        resolved[field.field_name] = {}
+        if pks:
+            queryset = field.get_queryset().filter(pk__in=pks).order_by()
+            groups[get_columns(queryset.model)].append((field, queryset))
+
+    for group in groups.values():
+        if len(group) == 1:
+            field, queryset = group[0]
+            resolved[field.field_name] = {obj.pk: obj for obj in queryset}
+            continue
+
+        # Модели с одинаковыми колонками читаются одним запросом,
+        # последняя колонка - номер поля в группе
+        attnames = [
+            field.attname for field in group[0][1].model._meta.concrete_fields
+        ]
+        querysets = [
+            queryset.annotate(
+                resolved_field=Value(number, output_field=IntegerField())
+            ).values_list(*attnames, "resolved_field")
+            for number, (_, queryset) in enumerate(group)
+        ]
+        union = querysets[0].union(*querysets[1:], all=True)
+        for row in union:
+            field, queryset = group[row[-1]]
+            obj = queryset.model.from_db(queryset.db, attnames, row[:-1])
+            resolved[field.field_name][obj.pk] = obj
+    return resolved
+
+
+class ResolveRelatedMixin:
+    """Сериализатор загружает связанные объекты пачкой перед
+    валидацией полей"""
+
+    def to_internal_value(self, data):
+        if self.root is self:
+            self.resolved_objects = resolve_related_objects(
+                get_owned_fields(self), [data]
+            )
+        return super().to_internal_value(data)
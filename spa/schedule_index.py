@@ -0,0 +1,127 @@
+"""
+Индекс расписания оповещений в Redis: sorted set, где элемент - id
+привычки, а score - время следующего оповещения (unix time).
+
+Рассылка забирает наступившие оповещения из индекса и читает из БД
+только их, поэтому, когда отправлять нечего, БД не используется вовсе.
+Индекс обновляется при создании, изменении и удалении привычки и при
+переносе оповещения после отправки. Полностью пересобрать его по БД
+можно командой python manage.py rebuild_schedule_index.
+"""
+
+import redis
+
+from django.utils import timezone
+
+from config.settings import (
+    HABIT_NOTIFICATION_CLAIM_TIMEOUT,
+    HABIT_SCHEDULE_INDEX_BATCH_SIZE,
+    HABIT_SCHEDULE_INDEX_KEY,
+    HABIT_SCHEDULE_INDEX_REDIS_URL,
+)
+
+# Атомарно забирает из индекса не более ARGV[2] привычек со временем
+# оповещения не позже ARGV[1]: два воркера не получат одну привычку.
+# Привычки не удаляются, а получают score ARGV[3] (конец аренды):
+# если рассылка упадёт, не обработав их, по истечении аренды их заберёт
+# следующий запуск
+CLAIM_DUE_SCRIPT = """
+local ids = redis.call(
+    "ZRANGEBYSCORE", KEYS[1], "-inf", ARGV[1], "LIMIT", 0, ARGV[2]
+)
+for _, id in ipairs(ids) do
+    redis.call("ZADD", KEYS[1], "XX", ARGV[3], id)
+end
+return ids
+"""
+
+
+class HabitScheduleIndex:
+    def __init__(
+        self,
+        redis_url=HABIT_SCHEDULE_INDEX_REDIS_URL,
+        key=HABIT_SCHEDULE_INDEX_KEY,
+        batch_size=HABIT_SCHEDULE_INDEX_BATCH_SIZE,
+        redis_client=None,
+    ):
+        if redis_client is None and redis_url:
+            redis_client = redis.Redis.from_url(redis_url)
+
+        self.client = redis_client
+        self.key = key
+        self.batch_size = batch_size
+
+    @property
+    def enabled(self):
+        return self.client is not None
+
+    def add(self, habits):
+        """Добавляет привычки в индекс или обновляет время их оповещения.
+        Привычки без следующего оповещения из индекса убираются."""
+        if not self.enabled:
+            return
+
+        scheduled = {}
+        disabled = []
+        for habit in habits:
+            if habit.date_time_next_sent is None:
+                disabled.append(habit.pk)
+            else:
+                scheduled[habit.pk] = habit.date_time_next_sent.timestamp()
+
+        pipeline = self.client.pipeline()
+        if scheduled:
+            pipeline.zadd(self.key, scheduled)
+        if disabled:
+            pipeline.zrem(self.key, *disabled)
+        pipeline.execute()
+
+    def remove(self, habit_ids):
+        habit_ids = list(habit_ids)
+        if self.enabled and habit_ids:
+            self.client.zrem(self.key, *habit_ids)
+
+    def claim_due(self, now_time, timeout=HABIT_NOTIFICATION_CLAIM_TIMEOUT):
+        """Забирает из индекса id привычек, время оповещения которых
+        наступило к now_time, пачками по batch_size. Привычки остаются
+        в индексе со временем конца аренды (сейчас + timeout), после
+        обработки их время обновляется через add или они удаляются"""
+        script = self.client.register_script(CLAIM_DUE_SCRIPT)
+        claimed_until = (timezone.now() + timeout).timestamp()
+        habit_ids = []
+        while True:
+            batch = script(
+                keys=[self.key],
+                args=[now_time.timestamp(), self.batch_size, claimed_until],
+            )
+            habit_ids.extend(int(habit_id) for habit_id in batch)
+            if len(batch) < self.batch_size:
+                return habit_ids
+
+    def rebuild(self, habits):
+        """Пересобирает индекс по парам (id, время оповещения).
+        Индекс собирается во временном ключе и подменяет старый
+        одной командой RENAME. Возвращает размер индекса."""
+        rebuild_key = f"{self.key}:rebuild"
+        self.client.delete(rebuild_key)
+
+        count = 0
+        batch = {}
+        for habit_id, date_time_next_sent in habits:
+            batch[habit_id] = date_time_next_sent.timestamp()
+            if len(batch) >= self.batch_size:
+                self.client.zadd(rebuild_key, batch)
+                count += len(batch)
+                batch = {}
+        if batch:
+            self.client.zadd(rebuild_key, batch)
+            count += len(batch)
+
+        if count:
+            self.client.rename(rebuild_key, self.key)
+        else:
+            self.client.delete(self.key)
+        return count
+
+
+schedule_index = HabitScheduleIndex()
@@ -0,0 +1,198 @@
+"""
+Планировщик оповещений с точным временем срабатывания - альтернатива
+ежеминутной периодической задаче send_user_notification_in_telegram.
+
+Ближайшие времена оповещений (на HABIT_SCHEDULER_HORIZON вперёд)
+хранятся в min-куче и подгружаются из БД порциями. Планировщик спит
+ровно до ближайшего оповещения, отправляет привычки задачей Celery
+и сразу кладёт в кучу следующее время их срабатывания.
+Изменения привычек планировщик находит сам, читая из БД порциями
+привычки с (updated_at, id) после уже виденных (индекс
+spa_habit_updated_at_idx): так видны и изменения из веб-процессов,
+и переносы в задачах Celery, даже если у процессов разный кэш.
+Переносы после отправленных им же оповещений планировщик пропускает:
+их следующее время уже в куче.
+"""
+
+import heapq
+import time
+
+from django.db.models import Q
+from django.utils import timezone
+
+from config.settings import (
+    HABIT_SCHEDULER_BATCH_SIZE,
+    HABIT_SCHEDULER_HORIZON,
+    HABIT_SCHEDULER_POLL_INTERVAL,
+)
+from spa.models import Habit
+from spa.tasks import get_due_habits, send_user_notification_habits
+
+
+class HabitScheduler:
+    def __init__(
+        self,
+        horizon=HABIT_SCHEDULER_HORIZON,
+        batch_size=HABIT_SCHEDULER_BATCH_SIZE,
+        poll_interval=HABIT_SCHEDULER_POLL_INTERVAL,
+        sleep=time.sleep,
+    ):
+        self.horizon = horizon
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.sleep = sleep
+        self.reset()
+
+    def reset(self):
+        # (время оповещения, id, периодичность, время начала)
+        self.heap = []
+        # До какого времени оповещения привычки уже загружены в кучу
+        self.window_end = None
+        # Следующее время оповещения отправленных привычек:
+        # их перенос в задаче рассылки перечитывать не нужно
+        self.fired = {}
+        # (updated_at, id) последней учтённой в куче изменённой привычки
+        self.last_seen, self.last_id = Habit.objects.order_by(
+            "-updated_at", "-id"
+        ).values_list("updated_at", "id").first() or (timezone.now(), 0)
+
+    def load(self, now):
+        """Догружает в кучу привычки со временем оповещения
+        от конца прошлого окна до now + horizon порциями по batch_size"""
+        window_end = now + self.horizon
+        habits = get_due_habits(window_end)
+        if self.window_end is not None:
+            habits = habits.filter(date_time_next_sent__gt=self.window_end)
+        habits = habits.order_by("date_time_next_sent", "id").values_list(
+            "date_time_next_sent", "id", "period", "date_time"
+        )
+
+        batch = list(habits[: self.batch_size])
+        while batch:
+            for habit in batch:
+                heapq.heappush(self.heap, habit)
+            if len(batch) < self.batch_size:
+                break
+
+            last_time, last_id = batch[-1][:2]
+            batch = list(
+                habits.filter(
+                    Q(date_time_next_sent__gt=last_time)
+                    | Q(date_time_next_sent=last_time, id__gt=last_id)
+                )[: self.batch_size]
+            )
+
+        self.window_end = window_end
+        # Перенос, который так и не пришёл, дальше обрабатывается как
+        # обычное изменение
+        self.fired = {
+            habit_id: next_time
+            for habit_id, next_time in self.fired.items()
+            if next_time > now
+        }
+
+    def get_changes(self):
+        """Следующая порция привычек, изменённых после (last_seen,
+        last_id): (updated_at, id, время оповещения) в порядке изменения"""
+        return list(
+            Habit.objects.filter(
+                Q(updated_at__gt=self.last_seen)
+                | Q(updated_at=self.last_seen, id__gt=self.last_id)
+            )
+            .order_by("updated_at", "id")
+            .values_list("updated_at", "id", "date_time_next_sent")[
+                : self.batch_size
+            ]
+        )
+
+    def apply_changes(self):
+        """Перечитывает в куче изменённые привычки порциями по batch_size"""
+        while True:
+            changes = self.get_changes()
+            if not changes:
+                return
+            self.last_seen, self.last_id = changes[-1][:2]
+
+            habit_ids = set()
+            for _, habit_id, date_time_next_sent in changes:
+                if (
+                    habit_id in self.fired
+                    and self.fired[habit_id] == date_time_next_sent
+                ):
+                    del self.fired[habit_id]
+                else:
+                    habit_ids.add(habit_id)
+            if habit_ids:
+                self.reload(habit_ids)
+
+            if len(changes) < self.batch_size:
+                return
+
+    def reload(self, habit_ids):
+        """Заменяет в куче привычки habit_ids их состоянием из БД"""
+        self.heap = [habit for habit in self.heap if habit[1] not in habit_ids]
+        if self.window_end is not None:
+            self.heap.extend(
+                get_due_habits(self.window_end)
+                .filter(id__in=habit_ids)
+                .values_list(
+                    "date_time_next_sent", "id", "period", "date_time"
+                )
+            )
+        heapq.heapify(self.heap)
+
+    def run_pending(self, now):
+        """Отправляет все привычки, время оповещения которых наступило.
+        Возвращает задержки отправки относительно расписания, мс."""
+        lags = []
+        while self.heap and self.heap[0][0] <= now:
+            fire_time = self.heap[0][0]
+            habits = []
+            while self.heap and self.heap[0][0] == fire_time:
+                habits.append(heapq.heappop(self.heap))
+
+            send_user_notification_habits.delay(
+                [habit_id for _, habit_id, _, _ in habits],
+                fire_time.isoformat(),
+            )
+            lag = (now - fire_time).total_seconds() * 1000
+            lags.append(lag)
+            print(
+                f"Оповещений на {fire_time:%Y-%m-%d %H:%M}: {len(habits)}, "
+                f"задержка {lag:.0f} мс"
+            )
+
+            # Следующее срабатывание считается так же, как при переносе
+            # в задаче рассылки. Если оно попадает в уже загруженное окно,
+            # кладём его в кучу сразу, иначе оно загрузится из БД
+            for _, habit_id, period, date_time in habits:
+                next_time = Habit.get_next_execution_time_after(
+                    period, date_time, fire_time
+                )
+                if next_time is not None:
+                    self.fired[habit_id] = next_time
+                if next_time is not None and next_time <= self.window_end:
+                    heapq.heappush(
+                        self.heap, (next_time, habit_id, period, date_time)
+                    )
+        return lags
+
+    def run(self, iterations=None):
+        while iterations is None or iterations > 0:
+            if iterations is not None:
+                iterations -= 1
+
+            self.apply_changes()
+            now = timezone.now()
+            self.load(now)
+            self.run_pending(now)
+
+            # Спим до ближайшего оповещения, но не дольше poll_interval,
+            # чтобы вовремя заметить изменения привычек
+            wait = self.poll_interval.total_seconds()
+            if self.heap:
+                wait = min(
+                    wait, (self.heap[0][0] - timezone.now()).total_seconds()
+                )
+            if wait > 0:
+                self.sleep(wait)
@@ -1,7 +1,22 @@
+from collections.abc import Mapping
+from functools import cached_property
+
 import spa.validators
-from rest_framework import serializers
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db.models import Q
+from django.utils import timezone
+from rest_framework import ISO_8601, serializers
+from rest_framework.relations import RelatedField
+from rest_framework.settings import api_settings
 
+from config.settings import USE_TZ
 from spa.models import Place, Action, Habit
+from spa.relations import (
+    OwnedPrimaryKeyRelatedField,
+    ResolveRelatedMixin,
+    get_owned_fields,
+    resolve_related_objects,
+)
 
 
 class PlaceSerializer(serializers.ModelSerializer):
@@ -16,10 +31,119 @@ class ActionSerializer(serializers.ModelSerializer):
         fields = "__all__"
 
 
-class HabitSerializer(serializers.ModelSerializer):
+class HabitListSerializer(serializers.ListSerializer):
+    """
+    Пакетное создание и изменение привычек. Элемент с id изменяет
+    привычку из instance (кверисета доступных для изменения привычек),
+    без id - создаёт новую. Связанные объекты и изменяемые привычки
+    загружаются на всю пачку сразу, сохраняется всё через
+    Habit.bulk_save. Ошибки возвращаются по номеру элемента, при любой
+    ошибке ничего не сохраняется.
+    """
+
+    def get_pk(self, item):
+        if not isinstance(item, Mapping) or item.get("id") is None:
+            return None
+        try:
+            return Habit._meta.pk.to_python(item["id"])
+        except DjangoValidationError:
+            raise serializers.ValidationError(
+                {"id": ["Некорректный id привычки"]}
+            )
+
+    def load_instances(self, data):
+        pks = set()
+        for item in data:
+            try:
+                pks.add(self.get_pk(item))
+            except serializers.ValidationError:
+                continue
+        pks.discard(None)
+        if not pks:
+            return {}
+        # Всё, из чего собирается текст оповещения
+        return self.instance.select_related(
+            "place",
+            "action",
+            "related_habit__place",
+            "related_habit__action",
+        ).in_bulk(pks)
+
+    def run_child_validation(self, data):
+        instance = None
+        pk = self.get_pk(data)
+        if pk is not None:
+            instance = self.instances.get(pk)
+            if instance is None:
+                raise serializers.ValidationError(
+                    {"id": [f"Привычка {pk} не найдена"]}
+                )
+
+        self.child.instance = instance
+        try:
+            validated_data = super().run_child_validation(data)
+        finally:
+            self.child.instance = None
+        self.item_instances.append(instance)
+        return validated_data
+
+    def to_internal_value(self, data):
+        self.item_instances = []
+        if isinstance(data, list):
+            self.instances = self.load_instances(data)
+            self.resolved_objects = resolve_related_objects(
+                get_owned_fields(self.child), data
+            )
+
+        try:
+            return super().to_internal_value(data)
+        except serializers.ValidationError as exc:
+            # До DRF 3.17 ошибки элементов - список по всем элементам,
+            # приводим к словарю {номер элемента: ошибки}
+            if isinstance(exc.detail, list):
+                raise serializers.ValidationError(
+                    {
+                        index: errors
+                        for index, errors in enumerate(exc.detail)
+                        if errors
+                    }
+                )
+            raise
+
+    def save(self, **kwargs):
+        habits = []
+        for instance, attrs in zip(self.item_instances, self.validated_data):
+            habit = Habit() if instance is None else instance
+            for attr, value in {**attrs, **kwargs}.items():
+                setattr(habit, attr, value)
+            habits.append(habit)
+
+        self.instance = Habit.bulk_save(habits)
+        return self.instance
+
+
+class HabitSerializer(ResolveRelatedMixin, serializers.ModelSerializer):
+    # Места, действия и связанные привычки - только свои или общие,
+    # загружаются пачкой (см. spa.relations)
+    serializer_related_field = OwnedPrimaryKeyRelatedField
+
     class Meta:
         model = Habit
-        fields = "__all__"
+        # Служебные поля захвата рассылкой наружу не отдаются. Текст
+        # оповещения собирается сам
+        exclude = ("claim_token", "claimed_until", "notification_message")
+        list_serializer_class = HabitListSerializer
+        # Владелец привычки - всегда текущий пользователь
+        read_only_fields = ("user",)
+        extra_kwargs = {
+            # Строка связанной привычки входит в текст оповещения
+            "related_habit": {
+                "queryset": Habit.objects.select_related(
+                    "user", "place", "action"
+                ),
+                "shared": Q(is_public=True),
+            },
+        }
         validators = [
             spa.validators.SelectOnlyRelatedHabitOrRewardValidator(
                 related_habit_field="related_habit", reward_field="reward"
@@ -33,3 +157,111 @@ class HabitSerializer(serializers.ModelSerializer):
             spa.validators.RelatedHabitValidator(field="related_habit"),
             spa.validators.PeriodChoicesValidator(field="period"),
         ]
+
+    # Время следующего оповещения считается до сохранения, поэтому
+    # привычка записывается в БД и текст оповещения собирается один раз
+    def create(self, validated_data):
+        serializers.raise_errors_on_nested_writes(
+            "create", self, validated_data
+        )
+        habit = Habit(**validated_data)
+        habit.set_next_execution_time()
+        return habit
+
+    def update(self, instance, validated_data):
+        serializers.raise_errors_on_nested_writes(
+            "update", self, validated_data
+        )
+        for attr, value in validated_data.items():
+            setattr(instance, attr, value)
+        instance.set_next_execution_time()
+        return instance
+
+
+class ValuesSerializer:
+    """
+    Быстрая сериализация списков только для чтения: строки читаются
+    через .values() без создания моделей и полей сериализатора на каждую
+    строку и преобразуются заранее подготовленными функциями по каждому
+    полю. Результат совпадает с serializer_class(many=True).data.
+    """
+
+    # Значения этих полей из БД уже имеют нужный вид
+    IDENTITY_FIELDS = (
+        serializers.BooleanField,
+        serializers.CharField,
+        serializers.IntegerField,
+    )
+
+    # Метка для дат/времени, которые DRF отдаёт в ISO 8601 в текущем
+    # часовом поясе: он определяется один раз на вызов, а не для
+    # каждого значения, как в DateTimeField.to_representation
+    ISO_DATETIME = object()
+
+    def __init__(self, serializer_class):
+        self.serializer_class = serializer_class
+
+    def is_iso_datetime(self, field):
+        return (
+            isinstance(field, serializers.DateTimeField)
+            and not hasattr(field, "timezone")
+            and getattr(field, "format", api_settings.DATETIME_FORMAT)
+            == ISO_8601
+            and USE_TZ
+        )
+
+    @cached_property
+    def fields(self):
+        """Тройки (имя в ответе, поле в .values(), функция
+        преобразования или None, если значение отдаётся как есть)"""
+        fields = []
+        for name, field in self.serializer_class().fields.items():
+            if field.write_only:
+                continue
+            if isinstance(field, RelatedField):
+                # Первичный ключ связанного объекта - это *_id строки
+                fields.append((name, f"{field.source}_id", None))
+            elif isinstance(field, self.IDENTITY_FIELDS):
+                fields.append((name, field.source, None))
+            elif self.is_iso_datetime(field):
+                fields.append((name, field.source, self.ISO_DATETIME))
+            else:
+                fields.append((name, field.source, field.to_representation))
+        return fields
+
+    def get_values(self, queryset):
+        return queryset.values(*(source for _, source, _ in self.fields))
+
+    def get_converters(self):
+        current_timezone = timezone.get_current_timezone()
+
+        def to_iso_datetime(value):
+            value = value.astimezone(current_timezone).isoformat()
+            if value.endswith("+00:00"):
+                value = value[:-6] + "Z"
+            return value
+
+        return [
+            (
+                name,
+                source,
+                to_iso_datetime if convert is self.ISO_DATETIME else convert,
+            )
+            for name, source, convert in self.fields
+        ]
+
+    def to_representation(self, rows):
+        converters = self.get_converters()
+        data = []
+        for row in rows:
+            item = {}
+            for name, source, convert in converters:
+                value = row[source]
+                if convert is not None and value is not None:
+                    value = convert(value)
+                item[name] = value
+            data.append(item)
+        return data
+
+
+habit_values_serializer = ValuesSerializer(HabitSerializer)
@@ -49,3 +49,23 @@ def get_next_week_date(date_time_start_sent, now_time):
         new_time = date_time_start_sent
 
     return new_time.replace(second=0, microsecond=0)
+
+
+NOTIFICATION_TITLE = "Пора выполнять привычку!"
+
+# Вместо места или действия, которые у привычки не заполнены
+NOT_SPECIFIED = "не указано"
+
+
+def get_notification_message(place, action, time_to_complete, reward):
+    if place is None:
+        place = NOT_SPECIFIED
+    if action is None:
+        action = NOT_SPECIFIED
+    return (
+        f"{NOTIFICATION_TITLE}\n"
+        f"Место: {place}.\n"
+        f"Действие: {action}.\n"
+        f"На выполнение {time_to_complete} секунд.\n"
+        f"А в качестве награды {reward}!"
+    )
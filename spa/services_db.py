@@ -0,0 +1,122 @@
+"""
+Версии функций spa.services в виде выражений БД: следующее время
+оповещения считается прямо в запросе UPDATE, без чтения привычек в Python.
+
+Время внутри выражений - целые секунды unix time. Начало рассылки
+округляется до минуты в БД, текущее время передаётся параметром.
+Как и функции spa.services, результат округлён до минуты и совпадает
+с ними для каждой привычки. Поддерживаются PostgreSQL и SQLite.
+"""
+
+from datetime import timezone as dt_timezone
+
+from django.db.models import (
+    Case,
+    DateTimeField,
+    Func,
+    IntegerField,
+    Value,
+    When,
+)
+from django.db.models.functions import TruncMinute
+from django.db.models.lookups import GreaterThan
+from django.utils import timezone
+
+EPOCH = timezone.datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+SECOND = timezone.timedelta(seconds=1)
+HOUR = 60 * 60
+DAY = 24 * HOUR
+WEEK = 7 * DAY
+
+
+class EpochSeconds(Func):
+    """Дата/время без долей секунды в целые секунды unix time"""
+
+    template = "CAST(EXTRACT(EPOCH FROM %(expressions)s) AS bigint)"
+    output_field = IntegerField()
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        return self.as_sql(
+            compiler,
+            connection,
+            template=(
+                "CAST(ROUND((julianday(%(expressions)s) - 2440587.5) * 86400)"
+                " AS INTEGER)"
+            ),
+            **extra_context,
+        )
+
+
+class FromEpochSeconds(Func):
+    """Секунды unix time в дату/время"""
+
+    function = "TO_TIMESTAMP"
+    output_field = DateTimeField()
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        return self.as_sql(
+            compiler,
+            connection,
+            template="datetime(%(expressions)s, 'unixepoch')",
+            **extra_context,
+        )
+
+
+def get_start_expression(field_name):
+    """Начало рассылки: поле field_name, округлённое до минуты,
+    в секундах unix time"""
+    return EpochSeconds(TruncMinute(field_name, tzinfo=dt_timezone.utc))
+
+
+def _integer(value):
+    return Value(value, output_field=IntegerField())
+
+
+def _started(date_time_start_sent, now_time):
+    # now_time > начала рассылки. Начало - целое число секунд,
+    # поэтому достаточно сравнить с now_time, округлённым вверх
+    now_ceil = -((EPOCH - now_time) // SECOND)
+    return GreaterThan(_integer(now_ceil), date_time_start_sent)
+
+
+def _get_next_period_date(date_time_start_sent, now_time, period):
+    # К началу рассылки прибавляется целое число периодов, прошедших
+    # к текущему времени, плюс один период на следующую рассылку.
+    # Разница неотрицательна, поэтому целочисленное деление в БД
+    # округляет вниз, как // в Python
+    now_floor = (now_time - EPOCH) // SECOND
+    elapsed = _integer(now_floor) - date_time_start_sent
+    return Case(
+        When(
+            _started(date_time_start_sent, now_time),
+            then=date_time_start_sent
+            + (elapsed / _integer(period) + _integer(1)) * _integer(period),
+        ),
+        default=date_time_start_sent,
+    )
+
+
+def get_next_minute_date_expression(date_time_start_sent, now_time):
+    next_minute = (now_time + timezone.timedelta(minutes=1)).replace(
+        second=0, microsecond=0
+    )
+    return Case(
+        When(
+            _started(date_time_start_sent, now_time),
+            then=_integer((next_minute - EPOCH) // SECOND),
+        ),
+        default=date_time_start_sent,
+    )
+
+
+def get_next_hour_date_expression(date_time_start_sent, now_time):
+    return _get_next_period_date(date_time_start_sent, now_time, HOUR)
+
+
+def get_next_day_date_expression(date_time_start_sent, now_time):
+    return _get_next_period_date(date_time_start_sent, now_time, DAY)
+
+
+def get_next_week_date_expression(date_time_start_sent, now_time):
+    # Число дней до следующей недели d + (7 - d % 7) равно 7 * (d // 7 + 1)
+    return _get_next_period_date(date_time_start_sent, now_time, WEEK)
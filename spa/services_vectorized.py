@@ -0,0 +1,97 @@
+"""
+Векторные версии функций spa.services для массовых операций (перенос
+оповещений после простоя, миграции, моделирование расписания).
+
+Работают с массивами datetime64[us] времён начала рассылки (в UTC,
+без часового пояса) и общим текущим временем и возвращают массивы
+datetime64[us], совпадающие до микросекунды с результатами функций
+spa.services для каждого элемента. Вычисления ведутся в целых
+микросекундах, а там, где скалярная функция считает через float
+(get_next_hour_date), - повторяют её вычисления во float64.
+Совпадение гарантируется, пока разница между началом рассылки и текущим
+временем меньше 2**53 мкс (~285 лет): до этого предела float64 точен.
+"""
+
+from datetime import timezone as dt_timezone
+
+import numpy as np
+
+MINUTE_US = 60 * 10**6
+HOUR_US = 60 * MINUTE_US
+DAY_US = 24 * HOUR_US
+
+
+def to_datetime64(date_times):
+    """Список datetime (с часовым поясом или наивных в UTC)
+    в массив datetime64[us] в UTC"""
+    return np.array(
+        [
+            (
+                date_time.astimezone(dt_timezone.utc).replace(tzinfo=None)
+                if date_time.tzinfo
+                else date_time
+            )
+            for date_time in date_times
+        ],
+        dtype="datetime64[us]",
+    )
+
+
+def from_datetime64(array):
+    """Массив datetime64 в список datetime в UTC"""
+    return [
+        date_time.replace(tzinfo=dt_timezone.utc)
+        for date_time in array.astype("datetime64[us]").tolist()
+    ]
+
+
+def _prepare(date_times_start_sent, now_time):
+    starts = np.asarray(date_times_start_sent, dtype="datetime64[us]")
+    if isinstance(now_time, np.datetime64):
+        now = now_time.astype("datetime64[us]")
+    else:
+        now = to_datetime64([now_time])[0]
+    starts_us = starts.astype(np.int64)
+    now_us = now.astype(np.int64)
+    # Разница now - start в микросекундах и маска "рассылка уже началась"
+    return starts_us, now_us - starts_us, now_us > starts_us
+
+
+def _truncate_to_minute(times_us):
+    # Аналог .replace(second=0, microsecond=0): округление вниз до минуты,
+    # в том числе для дат до 1970 года (np.mod берёт знак делителя)
+    return (times_us - np.mod(times_us, MINUTE_US)).astype("datetime64[us]")
+
+
+def get_next_minute_dates(date_times_start_sent, now_time):
+    starts_us, diff_us, started = _prepare(date_times_start_sent, now_time)
+    return _truncate_to_minute(
+        np.where(started, starts_us + diff_us + MINUTE_US, starts_us)
+    )
+
+
+def get_next_hour_dates(date_times_start_sent, now_time):
+    starts_us, diff_us, started = _prepare(date_times_start_sent, now_time)
+    # Как timedelta.total_seconds() // 3600 + 1 в скалярной функции
+    hours = np.floor_divide(diff_us.astype(np.float64) / 10**6, 60 * 60) + 1
+    delta_us = hours.astype(np.int64) * HOUR_US
+    return _truncate_to_minute(
+        np.where(started, starts_us + delta_us, starts_us)
+    )
+
+
+def get_next_day_dates(date_times_start_sent, now_time):
+    starts_us, diff_us, started = _prepare(date_times_start_sent, now_time)
+    days = np.floor_divide(diff_us, DAY_US) + 1
+    return _truncate_to_minute(
+        np.where(started, starts_us + days * DAY_US, starts_us)
+    )
+
+
+def get_next_week_dates(date_times_start_sent, now_time):
+    starts_us, diff_us, started = _prepare(date_times_start_sent, now_time)
+    now_start_delta = np.floor_divide(diff_us, DAY_US)
+    days = now_start_delta + (7 - np.mod(now_start_delta, 7))
+    return _truncate_to_minute(
+        np.where(started, starts_us + days * DAY_US, starts_us)
+    )
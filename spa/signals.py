@@ -0,0 +1,103 @@
+from django.db.models import Q
+from django.db.models.signals import (
+    post_delete,
+    post_save,
+    pre_delete,
+    pre_save,
+)
+from django.dispatch import receiver
+
+from spa.models import Action, Habit, Place, habits_bulk_saved
+from spa.public_feed import public_feed_cache
+
+
+@receiver(pre_save, sender=Habit)
+def remember_was_public(sender, instance, **kwargs):
+    # Привычка, которую сделали непубличной, должна пропасть из ленты.
+    # Для публичной привычки лента сбросится и так, поэтому БД читаем
+    # только при изменении непубличной
+    instance.was_public = (
+        not instance.is_public
+        and not instance._state.adding
+        and Habit.objects.filter(pk=instance.pk, is_public=True).exists()
+    )
+
+
+@receiver(post_save, sender=Habit)
+@receiver(post_delete, sender=Habit)
+def bump_public_feed_version(sender, instance, **kwargs):
+    """Сбрасывает кэш ленты публичных привычек, если она изменилась"""
+    if instance.is_public or getattr(instance, "was_public", False):
+        public_feed_cache.bump_version()
+
+
+# Текст оповещения привычки включает название места и действия,
+# а вместо награды - место и действие связанной привычки.
+# При их изменении тексты зависимых привычек пересобираются пачкой
+
+
+@receiver(post_save, sender=Place)
+def refresh_messages_on_place_change(sender, instance, created, **kwargs):
+    # Новое место ещё нигде не используется, а без смены названия
+    # тексты не меняются
+    if not created and instance.has_tracked_changes():
+        Habit.refresh_notification_messages(
+            Habit.objects.filter(
+                Q(place=instance) | Q(related_habit__place=instance)
+            )
+        )
+
+
+@receiver(post_save, sender=Action)
+def refresh_messages_on_action_change(sender, instance, created, **kwargs):
+    if not created and instance.has_tracked_changes():
+        Habit.refresh_notification_messages(
+            Habit.objects.filter(
+                Q(action=instance) | Q(related_habit__action=instance)
+            )
+        )
+
+
+@receiver(post_save, sender=Habit)
+def refresh_messages_on_related_habit_change(
+    sender, instance, created, **kwargs
+):
+    # У новой привычки зависимых нет. Строка привычки меняется только
+    # вместе с пользователем, местом или действием (их переименование
+    # отслеживают сигналы выше)
+    if not created and instance.has_tracked_changes():
+        Habit.refresh_notification_messages(
+            Habit.objects.filter(related_habit=instance)
+        )
+
+
+@receiver(pre_delete, sender=Habit)
+def remember_dependent_habits(sender, instance, **kwargs):
+    # После удаления связанная привычка обнулится (SET_NULL),
+    # и найти зависимые привычки будет уже нельзя
+    instance.dependent_habit_ids = list(
+        Habit.objects.filter(related_habit=instance).values_list(
+            "id", flat=True
+        )
+    )
+
+
+@receiver(post_delete, sender=Habit)
+def refresh_messages_on_related_habit_delete(sender, instance, **kwargs):
+    if instance.dependent_habit_ids:
+        Habit.refresh_notification_messages(
+            Habit.objects.filter(id__in=instance.dependent_habit_ids)
+        )
+
+
+@receiver(habits_bulk_saved, sender=Habit)
+def habits_bulk_saved_handler(sender, created, changed, was_public, **kwargs):
+    """То же, что post_save для каждой привычки, но на всю пачку"""
+    habits = [*created, *changed]
+    if was_public or any(habit.is_public for habit in habits):
+        public_feed_cache.bump_version()
+    # У новых привычек зависимых ещё нет
+    if changed:
+        Habit.refresh_notification_messages(
+            Habit.objects.filter(related_habit__in=changed)
+        )
@@ -1,32 +1,484 @@
-from celery import shared_task
+import math
+import time
+from collections import defaultdict
+from uuid import uuid4
+
+from celery import chord, shared_task
+from django.db import transaction
+from django.db.models import Count, Max, Min, Q
 from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from config.settings import (
+    HABIT_NOTIFICATION_CHUNK_SIZE,
+    HABIT_NOTIFICATION_CLAIM_TIMEOUT,
+    HABIT_NOTIFICATION_SHARD_SIZE,
+    HABIT_RESCHEDULE_BATCH_SIZE,
+    NOTIFICATION_DELIVERY_BATCH_SIZE,
+    NOTIFICATION_DELIVERY_CLAIM_TIMEOUT,
+    NOTIFICATION_MAX_ATTEMPTS,
+    NOTIFICATION_PURGE_BATCH_SIZE,
+    NOTIFICATION_RETENTION,
+    NOTIFICATION_RETRY_DELAY,
+    TELEGRAM_MESSAGE_MAX_LENGTH,
+)
+from spa.models import Habit, NotificationOutbox
+from spa.schedule_index import schedule_index
+from spa.services import NOTIFICATION_TITLE
+from users.services_telegram import telegram_client, update_chat_ids
 
-from spa.models import Habit
-from users.services_telegram import (
-    sent_notification_in_telegram,
-    update_chat_id,
+# Только те колонки, которые нужны для оповещения и переноса. Текст
+# оповещения собран заранее, поэтому место, действие и связанная
+# привычка не нужны, а пользователь - только ради ID чата
+# и настройки объединения оповещений
+NOTIFICATION_FIELDS = (
+    "id",
+    "date_time",
+    "date_time_next_sent",
+    "period",
+    "notification_message",
+    "user__tg_name",
+    "user__tg_chat_id",
+    "user__tg_coalesce_notifications",
 )
 
 
+def get_due_habits(now_time):
+    """Кверисет привычек, по которым пора отправить оповещение.
+    Пользователи без чата и без имени в Telegram пропускаются сразу."""
+    return (
+        Habit.objects.filter(
+            date_time_next_sent__lte=now_time, user__isnull=False
+        )
+        # Условие частичного индекса spa_habit_due_idx: без него
+        # планировщик БД индекс не использует
+        .exclude(period=Habit.PERIOD_DISABLE)
+        .exclude(user__tg_chat_id=0, user__tg_name="")
+        .select_related("user")
+        .only(*NOTIFICATION_FIELDS)
+        .order_by()
+    )
+
+
+def claim_chunks(habits_queryset, chunk_size):
+    """Захватывает привычки из кверисета порциями не длиннее chunk_size
+    и отдаёт их списками. Захват - один UPDATE по подзапросу
+    SELECT ... FOR UPDATE SKIP LOCKED: строки, которые прямо сейчас
+    захватывает параллельный запуск рассылки, пропускаются без ожидания,
+    а уже захваченные до истечения claimed_until не берутся вовсе.
+    Поэтому параллельные запуски делят привычки без пересечений."""
+    while True:
+        now = timezone.now()
+        claimable = Q(claimed_until__isnull=True) | Q(claimed_until__lt=now)
+        claim_token = uuid4()
+
+        # Один запрос - точка сохранения не нужна
+        with transaction.atomic(savepoint=False):
+            # Блокируются только строки привычек, без присоединённых
+            # к выборке пользователей
+            claimed = Habit.objects.filter(
+                claimable,
+                id__in=Habit.objects.filter(
+                    claimable, id__in=habits_queryset.values("id")
+                )
+                .select_for_update(skip_locked=True)
+                .values("id")[:chunk_size],
+            ).update(
+                claim_token=claim_token,
+                claimed_until=now + HABIT_NOTIFICATION_CLAIM_TIMEOUT,
+            )
+        if not claimed:
+            return
+
+        yield list(habits_queryset.filter(claim_token=claim_token))
+        if claimed < chunk_size:
+            return
+
+
+def get_notification_shards(now_time, shard_size):
+    """Делит привычки, по которым пора отправить оповещение, на шарды
+    по непрерывным диапазонам user_id, в среднем по shard_size привычек.
+    Возвращает список пар (user_id_from, user_id_to) включительно."""
+    stats = get_due_habits(now_time).aggregate(
+        count=Count("id"),
+        user_id_min=Min("user_id"),
+        user_id_max=Max("user_id"),
+    )
+    if not stats["count"]:
+        return []
+
+    user_id_min = stats["user_id_min"]
+    users_span = stats["user_id_max"] - user_id_min + 1
+    shards_count = min(math.ceil(stats["count"] / shard_size), users_span)
+    bounds = [
+        user_id_min + users_span * shard // shards_count
+        for shard in range(shards_count + 1)
+    ]
+    return [
+        (user_id_from, user_id_to - 1)
+        for user_id_from, user_id_to in zip(bounds, bounds[1:])
+    ]
+
+
+def enqueue_due_habits(habits_queryset, now_time):
+    """Захватывает привычки из кверисета порциями и для каждой порции
+    в одной транзакции ставит оповещения в очередь NotificationOutbox
+    и переносит дату следующего оповещения на время после now_time.
+    Сообщения отправляет отдельная задача deliver_notifications,
+    поэтому падение посередине не оставит привычку отправленной,
+    но не перенесённой, или перенесённой, но не отправленной."""
+    queued = 0
+    rescheduled = 0
+    elapsed = 0
+    for habits in claim_chunks(habits_queryset, HABIT_NOTIFICATION_CHUNK_SIZE):
+        update_chat_ids(habit.user for habit in habits)
+
+        # Текст ещё не собран, например, у привычек, созданных
+        # до его появления или через bulk_create
+        messages = {habit.pk: habit.notification_message for habit in habits}
+        missing = [pk for pk, message in messages.items() if not message]
+        if missing:
+            for refreshed in Habit.iter_refreshed_notification_messages(
+                Habit.objects.filter(pk__in=missing)
+            ):
+                messages.update(
+                    (habit.pk, habit.notification_message)
+                    for habit in refreshed
+                )
+
+        notifications = [
+            NotificationOutbox(
+                habit=habit,
+                occurrence=habit.date_time_next_sent,
+                chat_id=habit.user.tg_chat_id,
+                message=messages[habit.pk],
+                coalesce=habit.user.tg_coalesce_notifications,
+            )
+            for habit in habits
+            if habit.user.tg_chat_id
+        ]
+
+        start = time.perf_counter()
+        with transaction.atomic():
+            NotificationOutbox.objects.bulk_create(
+                notifications,
+                batch_size=HABIT_RESCHEDULE_BATCH_SIZE,
+                ignore_conflicts=True,
+            )
+            rescheduled += Habit.bulk_reschedule(
+                habits, now_time, batch_size=HABIT_RESCHEDULE_BATCH_SIZE
+            )
+        elapsed += time.perf_counter() - start
+        queued += len(notifications)
+        schedule_index.add(habits)
+
+    if queued:
+        transaction.on_commit(deliver_notifications.delay)
+    return {"queued": queued, "rescheduled": rescheduled, "elapsed": elapsed}
+
+
+def claim_notifications(batch_size):
+    """Захватывает для доставки до batch_size оповещений из очереди,
+    так же как claim_chunks захватывает привычки: параллельные воркеры
+    доставки делят очередь без пересечений. Оповещения, захваченные
+    упавшим воркером, освобождаются по истечении available_at."""
+    now = timezone.now()
+    available = Q(
+        status__in=(
+            NotificationOutbox.STATUS_PENDING,
+            NotificationOutbox.STATUS_SENDING,
+        ),
+        available_at__lte=now,
+    )
+    claim_token = uuid4()
+
+    # Один запрос - точка сохранения не нужна
+    with transaction.atomic(savepoint=False):
+        claimed = NotificationOutbox.objects.filter(
+            available,
+            # Одновременные оповещения одного чата - в одну пачку,
+            # чтобы их можно было объединить
+            id__in=NotificationOutbox.objects.filter(available)
+            .order_by("occurrence", "chat_id")
+            .select_for_update(skip_locked=True)
+            .values("id")[:batch_size],
+        ).update(
+            status=NotificationOutbox.STATUS_SENDING,
+            claim_token=claim_token,
+            available_at=now + NOTIFICATION_DELIVERY_CLAIM_TIMEOUT,
+        )
+    if not claimed:
+        return []
+    return list(
+        NotificationOutbox.objects.filter(claim_token=claim_token).order_by(
+            "chat_id", "occurrence", "habit_id"
+        )
+    )
+
+
+def split_message(title, blocks, max_length):
+    """Собирает блоки текста под общим заголовком в сообщения
+    не длиннее max_length, не разрывая блоки. Возвращает список
+    (текст, индексы блоков в этом тексте)."""
+    parts = []
+    part = title
+    indexes = []
+    for index, block in enumerate(blocks):
+        if len(part) + 2 + len(block) > max_length and indexes:
+            parts.append((part, indexes))
+            part = block
+            indexes = [index]
+        else:
+            part = f"{part}\n\n{block}"
+            indexes.append(index)
+    parts.append((part, indexes))
+    # Блок длиннее лимита сам по себе (на практике не бывает:
+    # поля привычки ограничены по длине) режем как есть
+    return [
+        (part[start : start + max_length], indexes)
+        for part, indexes in parts
+        for start in range(0, len(part), max_length)
+    ]
+
+
+def coalesce_notifications(notifications):
+    """Объединяет оповещения одного чата на одно и то же время
+    (если пользователь этого не отключил) в одно сообщение, при
+    необходимости разбитое на части по лимиту длины Telegram.
+    Возвращает список (chat_id, текст, оповещения в этом тексте):
+    оповещения из доставленной части не зависят от остальных частей
+    и при повторе не отправляются снова."""
+    groups = {}
+    for notification in notifications:
+        if notification.coalesce:
+            key = (notification.chat_id, notification.occurrence)
+        else:
+            key = notification.pk
+        groups.setdefault(key, []).append(notification)
+
+    result = []
+    for group in groups.values():
+        chat_id = group[0].chat_id
+        if len(group) == 1:
+            result.append((chat_id, group[0].message, group))
+            continue
+
+        title = f"Пора выполнять привычки ({len(group)})!"
+        blocks = [
+            notification.message.removeprefix(f"{NOTIFICATION_TITLE}\n")
+            for notification in group
+        ]
+        for text, indexes in split_message(
+            title, blocks, TELEGRAM_MESSAGE_MAX_LENGTH
+        ):
+            result.append((chat_id, text, [group[i] for i in indexes]))
+    return result
+
+
+@shared_task
+def deliver_notifications():
+    """Доставляет оповещения из очереди NotificationOutbox пачками,
+    объединяя одновременные оповещения одного пользователя.
+    Упёршиеся в лимиты Telegram оповещения откладываются на retry_after,
+    прочие неудачи повторяются с растущим интервалом, пока не кончатся
+    попытки."""
+    totals = {"messages": 0, "sent": 0, "retried": 0, "failed": 0}
+    while True:
+        notifications = claim_notifications(NOTIFICATION_DELIVERY_BATCH_SIZE)
+        if not notifications:
+            break
+
+        messages = coalesce_notifications(notifications)
+        results = telegram_client.send_messages(
+            (chat_id, text) for chat_id, text, _ in messages
+        )
+        totals["messages"] += len(messages)
+
+        # Оповещение доставлено, если доставлены все части сообщения
+        # с его текстом
+        outcomes = defaultdict(list)
+        for (_, _, group), result in zip(messages, results):
+            for notification in group:
+                outcomes[notification.pk].append(result)
+
+        now = timezone.now()
+        for notification in notifications:
+            notification.claim_token = None
+            results = outcomes[notification.pk]
+            if all(result.ok for result in results):
+                notification.status = NotificationOutbox.STATUS_SENT
+                notification.sent_at = now
+                totals["sent"] += 1
+                continue
+
+            retry_after = max(result.retry_after or 0 for result in results)
+            # Ответ 429 - не ошибка доставки, попытку не засчитываем
+            if retry_after:
+                delay = timezone.timedelta(seconds=retry_after)
+            else:
+                notification.attempts += 1
+                delay = NOTIFICATION_RETRY_DELAY * 2 ** (
+                    notification.attempts - 1
+                )
+
+            if notification.attempts >= NOTIFICATION_MAX_ATTEMPTS:
+                notification.status = NotificationOutbox.STATUS_FAILED
+                totals["failed"] += 1
+            else:
+                notification.status = NotificationOutbox.STATUS_PENDING
+                notification.available_at = now + delay
+                totals["retried"] += 1
+
+        NotificationOutbox.objects.bulk_update(
+            notifications,
+            ["status", "attempts", "available_at", "claim_token", "sent_at"],
+        )
+        if len(notifications) < NOTIFICATION_DELIVERY_BATCH_SIZE:
+            break
+
+    print(
+        f"Сообщений: {totals['messages']}, "
+        f"доставлено оповещений: {totals['sent']}, "
+        f"отложено: {totals['retried']}, "
+        f"не доставлено: {totals['failed']}"
+    )
+    return totals
+
+
+@shared_task
+def purge_notifications():
+    """Удаляет из очереди доставленные и недоставленные оповещения
+    старше NOTIFICATION_RETENTION пачками по
+    NOTIFICATION_PURGE_BATCH_SIZE. Возвращает количество удалённых."""
+    done = NotificationOutbox.objects.filter(
+        status__in=(
+            NotificationOutbox.STATUS_SENT,
+            NotificationOutbox.STATUS_FAILED,
+        ),
+        created_at__lt=timezone.now() - NOTIFICATION_RETENTION,
+    )
+    purged = 0
+    while True:
+        ids = list(
+            done.order_by().values_list("id", flat=True)[
+                :NOTIFICATION_PURGE_BATCH_SIZE
+            ]
+        )
+        if not ids:
+            return purged
+        purged += NotificationOutbox.objects.filter(id__in=ids).delete()[0]
+
+
 @shared_task
 def send_user_notification_in_telegram():
-    habits = Habit.objects.filter(
-        date_time_next_sent__lte=timezone.now().replace(
-            second=0, microsecond=0
+    """Координатор рассылки: делит привычки, по которым пора отправить
+    оповещение, на шарды и запускает их параллельно группой задач"""
+    now_time = timezone.now().replace(second=0, microsecond=0)
+
+    if schedule_index.enabled:
+        return send_user_notification_from_index(now_time)
+
+    shards = get_notification_shards(now_time, HABIT_NOTIFICATION_SHARD_SIZE)
+    if not shards:
+        return {"shards": 0}
+
+    chord(
+        send_user_notification_shard.s(
+            user_id_from, user_id_to, now_time.isoformat()
         )
+        for user_id_from, user_id_to in shards
+    )(summarize_user_notifications.s())
+    return {"shards": len(shards)}
+
+
+def send_user_notification_from_index(now_time):
+    """Рассылка по индексу расписания: наступившие оповещения забираются
+    из Redis, и только эти привычки читаются из БД шардами по id"""
+    habit_ids = sorted(schedule_index.claim_due(now_time))
+    if not habit_ids:
+        return {"shards": 0}
+
+    shards = [
+        habit_ids[start : start + HABIT_NOTIFICATION_SHARD_SIZE]
+        for start in range(0, len(habit_ids), HABIT_NOTIFICATION_SHARD_SIZE)
+    ]
+    chord(
+        send_user_notification_habits.s(shard, now_time.isoformat())
+        for shard in shards
+    )(summarize_user_notifications.s())
+    return {"shards": len(shards)}
+
+
+@shared_task
+def send_user_notification_shard(user_id_from, user_id_to, now_time):
+    """Рассылка по одному шарду пользователей"""
+    now_time = parse_datetime(now_time)
+    return enqueue_due_habits(
+        get_due_habits(now_time).filter(
+            user_id__gte=user_id_from, user_id__lte=user_id_to
+        ),
+        now_time,
     )
-    for habit in habits:
-        message = (
-            f"Пора выполнять привычку!\n"
-            f"Место: {habit.place}.\n"
-            f"Действие: {habit.action}.\n"
-            f"На выполнение {habit.time_to_complete} секунд.\n"
-            f"А в качестве награды "
-            f"{habit.related_habit if habit.related_habit else habit.reward}!"
+
+
+@shared_task
+def send_user_notification_habits(habit_ids, now_time):
+    """Рассылка по конкретным привычкам (для планировщика spa.scheduler
+    и индекса расписания spa.schedule_index).
+    Привычки, перенесённые или удалённые с момента планирования,
+    отфильтровываются по времени оповещения."""
+    now_time = parse_datetime(now_time)
+    result = enqueue_due_habits(
+        get_due_habits(now_time).filter(id__in=habit_ids), now_time
+    )
+
+    # Снимаем аренду с привычек, забранных из индекса: необработанные
+    # (перенесённые в обход индекса, без чата в Telegram) получают
+    # время оповещения из БД, удалённые и отключённые удаляются
+    if schedule_index.enabled:
+        habits = list(
+            Habit.objects.filter(id__in=habit_ids)
+            .exclude(period=Habit.PERIOD_DISABLE)
+            .only("date_time_next_sent", "period", "date_time")
         )
-        update_chat_id(habit.user)
-        chat_id = habit.user.tg_chat_id
+        for habit in habits:
+            # Привычки пользователей без чата и без имени в Telegram
+            # рассылка пропускает, и с прошлым временем их забирал бы
+            # каждый запуск: в индексе они ждут следующего оповещения
+            # по расписанию (в БД время не меняется)
+            if (
+                habit.date_time_next_sent is not None
+                and habit.date_time_next_sent <= now_time
+            ):
+                habit.date_time_next_sent = (
+                    Habit.get_next_execution_time_after(
+                        habit.period, habit.date_time, now_time
+                    )
+                )
+        schedule_index.add(habits)
+        schedule_index.remove(set(habit_ids) - {habit.pk for habit in habits})
+    return result
 
-        sent_notification_in_telegram(message, chat_id)
 
-        habit.set_next_execution_time()
+@shared_task
+def summarize_user_notifications(results):
+    """Итог рассылки по всем шардам"""
+    totals = {
+        "shards": len(results),
+        "queued": sum(result["queued"] for result in results),
+        "rescheduled": sum(result["rescheduled"] for result in results),
+    }
+    # Шарды выполняются параллельно, поэтому скорость переноса считаем
+    # по суммарному времени, затраченному на запись в БД
+    elapsed = sum(result["elapsed"] for result in results)
+    totals["rescheduled_per_second"] = (
+        totals["rescheduled"] / elapsed if elapsed else 0
+    )
+
+    print(
+        f"Шардов: {totals['shards']}, "
+        f"оповещений в очереди: {totals['queued']}, "
+        f"перенесено привычек: {totals['rescheduled']} "
+        f"({totals['rescheduled_per_second']:.0f} строк/с)"
+    )
+    return totals
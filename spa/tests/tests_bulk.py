@@ -0,0 +1,221 @@
+import os
+import time
+from unittest import skipUnless
+from unittest.mock import patch
+
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from freezegun import freeze_time
+from rest_framework import status
+from rest_framework.reverse import reverse
+from rest_framework.test import APITestCase
+
+from spa.models import Action, Habit, Place
+from spa.public_feed import public_feed_cache
+from users.models import User
+
+# python manage.py test - запуск тестов
+# python manage.py test spa.tests.tests_bulk - запуск конкретного файла
+# coverage run --source='.' manage.py test - запуск проверки покрытия
+# coverage report -m - получение отчета с пропущенными строками
+
+
+def get_item(place, action, number=0, **kwargs):
+    item = {
+        "place": place.pk,
+        "action": action.pk,
+        "date_time": "2024-01-14 03:21:00",
+        "period": Habit.PERIOD_EVERY_DAY,
+        "reward": f"Награда {number}",
+        "time_to_complete": 60,
+        **kwargs,
+    }
+    # reward=None - без награды
+    return {key: value for key, value in item.items() if value is not None}
+
+
+class HabitBulkTestCase(APITestCase):
+    """Данные тесты описывают пакетное создание и изменение привычек"""
+
+    def setUp(self) -> None:
+        cache.clear()
+        self.user = User.objects.create(email="user@my.ru")
+        self.other_user = User.objects.create(email="user1@my.ru")
+        self.place = Place.objects.create(name="Дом")
+        self.action = Action.objects.create(name="Пробежка", user=self.user)
+        self.habit = Habit.objects.create(
+            user=self.user,
+            place=self.place,
+            action=self.action,
+            date_time=timezone.datetime(
+                2024, 1, 14, 3, 21, tzinfo=timezone.timezone.utc
+            ),
+            is_pleasant=True,
+        )
+        self.url = reverse("spa:habit-bulk")
+        self.client.force_authenticate(user=self.user)
+
+    def post(self, data):
+        return self.client.post(self.url, data=data, format="json")
+
+    @freeze_time("2024-01-14 10:00:00")
+    def test_create(self):
+        response = self.post(
+            [
+                get_item(self.place, self.action, 1),
+                get_item(
+                    self.place,
+                    self.action,
+                    reward=None,
+                    related_habit=self.habit.pk,
+                    is_public=True,
+                ),
+            ]
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = response.json()
+        self.assertEqual(len(data), 2)
+
+        habits = Habit.objects.filter(pk__in=[item["id"] for item in data])
+        self.assertEqual(len(habits), 2)
+        for habit in habits:
+            self.assertEqual(habit.user, self.user)
+            self.assertEqual(
+                habit.date_time_next_sent,
+                timezone.datetime(
+                    2024, 1, 15, 3, 21, tzinfo=timezone.timezone.utc
+                ),
+            )
+            # Текст тот же, что собирает save()
+            self.assertEqual(
+                habit.notification_message,
+                habit.render_notification_message(),
+            )
+        self.assertEqual(data[1]["related_habit"], self.habit.pk)
+
+    def test_update(self):
+        dependent_habit = Habit.objects.create(
+            user=self.user,
+            place=self.place,
+            action=self.action,
+            date_time=timezone.now(),
+            related_habit=self.habit,
+        )
+        other_place = Place.objects.create(name="Парк", user=self.user)
+        public_feed_version = public_feed_cache.get_version()
+
+        response = self.post(
+            [
+                get_item(
+                    other_place,
+                    self.action,
+                    id=self.habit.pk,
+                    reward=None,
+                    is_pleasant=True,
+                    is_public=True,
+                ),
+                get_item(self.place, self.action, 1),
+            ]
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()[0]["id"], self.habit.pk)
+        self.assertEqual(Habit.objects.count(), 3)
+
+        self.habit.refresh_from_db()
+        self.assertEqual(self.habit.place, other_place)
+        self.assertTrue(self.habit.is_public)
+        self.assertNotEqual(
+            public_feed_cache.get_version(), public_feed_version
+        )
+
+        # Текст зависимой привычки включает новое место
+        dependent_habit.refresh_from_db()
+        self.assertIn("Парк", dependent_habit.notification_message)
+
+    def test_item_errors(self):
+        other_habit = Habit.objects.create(
+            user=self.other_user,
+            date_time=timezone.now(),
+        )
+        response = self.post(
+            [
+                get_item(self.place, self.action, 1),
+                get_item(self.place, self.action, id=other_habit.pk),
+                get_item(self.place, self.action, time_to_complete=121),
+                get_item(self.place, self.action, id="одна"),
+            ]
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        errors = response.json()
+        self.assertEqual(set(errors), {"1", "2", "3"})
+        self.assertIn("id", errors["1"])
+        self.assertIn("non_field_errors", errors["2"])
+        self.assertIn("id", errors["3"])
+
+        # При ошибке ничего не сохраняется
+        self.assertEqual(Habit.objects.filter(user=self.user).count(), 1)
+
+    def test_list_errors(self):
+        response = self.post(get_item(self.place, self.action))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        with patch("spa.views.HABIT_BULK_MAX_SIZE", 2):
+            response = self.post([get_item(self.place, self.action)] * 3)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("non_field_errors", response.json())
+
+    def test_queries(self):
+        # Количество запросов не зависит от размера пачки
+        counts = []
+        for size in (2, 20):
+            items = [
+                get_item(self.place, self.action, number)
+                for number in range(size)
+            ]
+            items[0] = get_item(
+                self.place, self.action, id=self.habit.pk, reward=None
+            )
+            with CaptureQueriesContext(connection) as context:
+                response = self.post(items)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            counts.append(len(context.captured_queries))
+
+        self.assertEqual(counts[0], counts[1])
+
+
+@skipUnless(os.getenv("RUN_BENCHMARKS"), "RUN_BENCHMARKS не задан")
+class HabitBulkBenchmark(APITestCase):
+    """Сравнение создания 1000 привычек по одной и одним запросом
+    (RUN_BENCHMARKS=1 python manage.py test
+    spa.tests.tests_bulk.HabitBulkBenchmark)"""
+
+    def test_speedup(self):
+        user = User.objects.create(email="user@my.ru")
+        place = Place.objects.create(name="Дом", user=user)
+        action = Action.objects.create(name="Пробежка", user=user)
+        self.client.force_authenticate(user=user)
+        items = [get_item(place, action, number) for number in range(1000)]
+
+        start = time.perf_counter()
+        for item in items:
+            self.client.post(
+                reverse("spa:habit-create"), data=item, format="json"
+            )
+        single_elapsed = time.perf_counter() - start
+
+        start = time.perf_counter()
+        response = self.client.post(
+            reverse("spa:habit-bulk"), data=items, format="json"
+        )
+        bulk_elapsed = time.perf_counter() - start
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(Habit.objects.count(), 2000)
+        print(
+            f"\n1000 привычек: по одной {single_elapsed:.2f} с "
+            f"({1000 / single_elapsed:.0f} в с), одним запросом "
+            f"{bulk_elapsed:.2f} с ({1000 / bulk_elapsed:.0f} в с), "
+            f"x{single_elapsed / bulk_elapsed:.1f}"
+        )
@@ -0,0 +1,160 @@
+from django.core.cache import cache
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.reverse import reverse
+from rest_framework.test import APITestCase
+
+from spa.models import Action, Habit, Place
+from users.models import User
+
+# python manage.py test - запуск тестов
+# python manage.py test spa.tests.tests_conditional - запуск конкретного файла
+# coverage run --source='.' manage.py test - запуск проверки покрытия
+# coverage report -m - получение отчета с пропущенными строками
+
+
+class ConditionalRequestTestCase(APITestCase):
+    """Данные тесты описывают ETag, Last-Modified и условные запросы
+    к привычкам, местам и действиям"""
+
+    def setUp(self) -> None:
+        cache.clear()
+        self.user = User.objects.create(email="user@my.ru")
+        self.other_user = User.objects.create(email="user1@my.ru")
+        self.place = Place.objects.create(name="Дом", user=self.user)
+        self.action = Action.objects.create(name="Пробежка", user=self.user)
+        self.habit = self.add_habit(self.user)
+        self.client.force_authenticate(user=self.user)
+
+    def add_habit(self, user):
+        return Habit.objects.create(
+            user=user,
+            place=self.place,
+            action=self.action,
+            date_time=timezone.datetime(
+                1997, 10, 19, 12, 0, tzinfo=timezone.timezone.utc
+            ),
+            period=Habit.PERIOD_EVERY_DAY,
+            reward="Бургер",
+        )
+
+    def get(self, url, etag=None):
+        if etag is None:
+            return self.client.get(url)
+        return self.client.get(url, headers={"If-None-Match": etag})
+
+    def test_habit_retrieve(self):
+        url = reverse("spa:habit-retrieve", args=(self.habit.pk,))
+        response = self.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        etag = response["ETag"]
+        self.assertIn("Last-Modified", response)
+
+        response = self.get(url, etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response["ETag"], etag)
+        self.assertEqual(response.content, b"")
+
+        response = self.client.get(
+            url, headers={"If-Modified-Since": response["Last-Modified"]}
+        )
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        # Перенос оповещения пачкой тоже меняет версию привычки
+        Habit.bulk_reschedule([self.habit], timezone.now())
+        response = self.get(url, etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_if_match(self):
+        url = reverse("spa:habit-update", args=(self.habit.pk,))
+        response = self.get(
+            reverse("spa:habit-retrieve", args=(self.habit.pk,))
+        )
+        etag = response["ETag"]
+
+        response = self.client.patch(
+            url, data={"reward": "Кофе"}, headers={"If-Match": etag}
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response["ETag"], etag)
+
+        # Клиент со старой версией не затирает чужое изменение
+        response = self.client.patch(
+            url, data={"reward": "Торт"}, headers={"If-Match": etag}
+        )
+        self.assertEqual(
+            response.status_code, status.HTTP_412_PRECONDITION_FAILED
+        )
+        self.habit.refresh_from_db()
+        self.assertEqual(self.habit.reward, "Кофе")
+
+    def test_habit_list(self):
+        url = reverse("spa:habit-list-my")
+        etag = self.get(url)["ETag"]
+
+        # Неизменившийся список - один агрегатный запрос, версия не
+        # хранится в кэше (у каждого процесса он может быть свой)
+        cache.clear()
+        with self.assertNumQueries(1):
+            response = self.get(url, etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        # Привычки другого пользователя список не меняют
+        self.add_habit(self.other_user)
+        self.assertEqual(
+            self.get(url, etag).status_code, status.HTTP_304_NOT_MODIFIED
+        )
+
+        # Другая страница - другой ETag
+        self.assertNotEqual(self.get(f"{url}?page_size=1")["ETag"], etag)
+
+        # Перенос пачкой в задаче Celery меняет updated_at
+        Habit.bulk_reschedule([self.habit], timezone.now())
+        response = self.get(url, etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        etag = response["ETag"]
+
+        # Удаление не меняет updated_at оставшихся привычек
+        other_habit = self.add_habit(self.user)
+        etag = self.get(url)["ETag"]
+        self.habit.delete()
+        self.assertEqual(self.get(url, etag).status_code, status.HTTP_200_OK)
+
+        # Количество то же, но новая привычка изменена позже
+        etag = self.get(url)["ETag"]
+        other_habit.delete()
+        self.add_habit(self.user)
+        self.assertEqual(self.get(url, etag).status_code, status.HTTP_200_OK)
+
+    def test_place_and_action(self):
+        for url, obj in (
+            (reverse("spa:places-list"), self.place),
+            (reverse("spa:actions-list"), self.action),
+        ):
+            with self.subTest(url=url):
+                detail_url = f"{url}{obj.pk}/"
+                list_etag = self.get(url)["ETag"]
+                etag = self.get(detail_url)["ETag"]
+                self.assertEqual(
+                    self.get(url, list_etag).status_code,
+                    status.HTTP_304_NOT_MODIFIED,
+                )
+                self.assertEqual(
+                    self.get(detail_url, etag).status_code,
+                    status.HTTP_304_NOT_MODIFIED,
+                )
+
+                response = self.client.patch(
+                    detail_url,
+                    data={"name": "Парк"},
+                    headers={"If-Match": etag},
+                )
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+                self.assertEqual(
+                    self.get(url, list_etag).status_code, status.HTTP_200_OK
+                )
+                self.assertEqual(
+                    self.get(detail_url, etag).status_code, status.HTTP_200_OK
+                )
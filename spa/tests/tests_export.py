@@ -0,0 +1,120 @@
+import csv
+import json
+import os
+import tempfile
+from io import StringIO
+
+from django.core.management import CommandError, call_command
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.reverse import reverse
+from rest_framework.test import APITestCase
+
+from spa.export import EXPORT_FIELDS, export_habits
+from spa.models import Action, Habit, Place
+from users.models import User
+
+# python manage.py test - запуск тестов
+# python manage.py test spa.tests.tests_export - запуск конкретного файла
+# coverage run --source='.' manage.py test - запуск проверки покрытия
+# coverage report -m - получение отчета с пропущенными строками
+
+
+class HabitExportTestCase(APITestCase):
+    """Данные тесты описывают потоковую выгрузку привычек
+    в NDJSON и CSV"""
+
+    def setUp(self) -> None:
+        self.user = User.objects.create(email="user@my.ru")
+        self.other_user = User.objects.create(email="user1@my.ru")
+        self.place = Place.objects.create(name="Дом, кухня")
+        self.action = Action.objects.create(
+            name='Выпить "воды"', user=self.user
+        )
+        self.habits = [
+            Habit.objects.create(
+                user=self.user,
+                place=self.place if number % 2 else None,
+                action=self.action,
+                date_time=timezone.datetime(
+                    2024, 1, 14, 3, 21, tzinfo=timezone.timezone.utc
+                ),
+                period=Habit.PERIOD_EVERY_DAY,
+                reward=f"Награда\n{number}",
+                is_public=bool(number % 2),
+            )
+            for number in range(5)
+        ]
+        Habit.objects.create(user=self.other_user, date_time=timezone.now())
+        self.url = reverse("spa:habit-export")
+        self.client.force_authenticate(user=self.user)
+
+    def get_content(self, response):
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        return b"".join(response.streaming_content).decode()
+
+    def test_ndjson(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        lines = self.get_content(response).splitlines()
+
+        # Значения те же, что в API
+        self.assertEqual(len(lines), 5)
+        item = json.loads(lines[1])
+        self.assertEqual(list(item), list(EXPORT_FIELDS))
+        self.assertEqual(item["id"], self.habits[1].pk)
+        self.assertEqual(item["place"], "Дом, кухня")
+        self.assertEqual(item["action"], 'Выпить "воды"')
+        self.assertEqual(item["date_time"], "2024-01-14T03:21:00Z")
+        self.assertIsNone(json.loads(lines[0])["place"])
+
+    def test_csv(self):
+        response = self.client.get(self.url, {"export_format": "csv"})
+        self.assertIn('filename="habits.csv"', response["Content-Disposition"])
+        rows = list(csv.reader(StringIO(self.get_content(response))))
+
+        self.assertEqual(rows[0], list(EXPORT_FIELDS))
+        self.assertEqual(len(rows), 6)
+        row = dict(zip(rows[0], rows[2]))
+        self.assertEqual(row["place"], "Дом, кухня")
+        self.assertEqual(row["reward"], "Награда\n1")
+        self.assertEqual(row["is_public"], "true")
+        self.assertEqual(row["date_time"], "2024-01-14T03:21:00Z")
+        self.assertEqual(dict(zip(rows[0], rows[1]))["place"], "")
+
+    def test_unknown_format(self):
+        response = self.client.get(self.url, {"export_format": "xml"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_lazy(self):
+        # Запрос к БД - только при чтении первой строки, строки
+        # читаются порциями
+        with self.assertNumQueries(0):
+            lines = export_habits(self.user, "ndjson", chunk_size=2)
+        with self.assertNumQueries(1):
+            first_line = next(lines)
+        self.assertEqual(json.loads(first_line)["id"], self.habits[0].pk)
+        self.assertEqual(len(list(lines)), 4)
+
+    def test_command(self):
+        out = StringIO()
+        call_command("export_habits", "user@my.ru", stdout=out)
+        self.assertEqual(len(out.getvalue().splitlines()), 5)
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "habits.csv")
+            call_command(
+                "export_habits",
+                "user@my.ru",
+                "--export-format",
+                "csv",
+                "-o",
+                path,
+                stdout=StringIO(),
+            )
+            with open(path, encoding="utf-8", newline="") as file:
+                self.assertEqual(len(list(csv.reader(file))), 6)
+
+        with self.assertRaises(CommandError):
+            call_command("export_habits", "nobody@my.ru")
@@ -1,3 +1,7 @@
+from unittest.mock import patch
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
 from freezegun import freeze_time
 from rest_framework import status
@@ -570,3 +574,264 @@ class HabitTestCaseCreateWithAnyPeriod(APITestCase):
                 2024, 1, 21, 12, 0, tzinfo=timezone.timezone.utc
             ),
         )
+
+
+class HabitNotificationMessageTestCase(APITestCase):
+    """Данные тесты описывают заранее собранный текст оповещения"""
+
+    def setUp(self) -> None:
+        self.user = User.objects.create(email="user@my.ru")
+        self.place = Place.objects.create(name="Дом", user=self.user)
+        self.action = Action.objects.create(name="Пробежка", user=self.user)
+        self.related_habit = self.add_habit(is_pleasant=True)
+        self.habit = self.add_habit(
+            related_habit=self.related_habit, reward="Бургер"
+        )
+        self.client.force_authenticate(user=self.user)
+
+    def add_habit(self, **kwargs) -> Habit:
+        return Habit.objects.create(
+            user=self.user,
+            place=self.place,
+            action=self.action,
+            date_time=timezone.datetime(
+                1997, 10, 19, 12, 0, 0, tzinfo=timezone.timezone.utc
+            ),
+            period=Habit.PERIOD_EVERY_DAY,
+            **kwargs,
+        )
+
+    def get_message(self, habit):
+        habit.refresh_from_db()
+        return habit.notification_message
+
+    def test_render_on_save(self):
+        self.assertEqual(
+            self.habit.notification_message,
+            "Пора выполнять привычку!\n"
+            "Место: Дом.\n"
+            "Действие: Пробежка.\n"
+            "На выполнение 120 секунд.\n"
+            "А в качестве награды Дом, Пробежка!",
+        )
+
+    def test_refresh_on_place_and_action_rename(self):
+        self.client.patch(
+            reverse("spa:places-detail", args=(self.place.pk,)),
+            data={"name": "Парк"},
+        )
+        self.client.patch(
+            reverse("spa:actions-detail", args=(self.action.pk,)),
+            data={"name": "Зарядка"},
+        )
+
+        message = self.get_message(self.habit)
+        self.assertIn("Место: Парк.", message)
+        self.assertIn("Действие: Зарядка.", message)
+        # Связанная привычка использует те же место и действие
+        self.assertIn("награды Парк, Зарядка!", message)
+
+    def test_refresh_on_related_habit_change(self):
+        # Данные владельца связанной привычки в текст не попадают
+        self.user.email = "new@my.ru"
+        self.user.save()
+        self.assertNotIn("@my.ru", self.get_message(self.habit))
+
+        # Без связанной привычки в тексте снова награда
+        self.related_habit.delete()
+        self.assertIn("награды Бургер!", self.get_message(self.habit))
+
+    def test_refresh_only_on_change(self):
+        place = Place.objects.get(pk=self.place.pk)
+        place.user = None
+        with patch.object(Habit, "refresh_notification_messages") as mock:
+            # Название не изменилось
+            place.save()
+            self.related_habit.time_to_complete = 60
+            self.related_habit.save()
+            mock.assert_not_called()
+
+            place.name = "Парк"
+            place.save()
+            mock.assert_called_once()
+
+    def test_refresh_by_chunks(self):
+        for _ in range(4):
+            self.add_habit(related_habit=self.related_habit)
+        Place.objects.filter(pk=self.place.pk).update(name="Парк")
+
+        # 6 привычек: по SELECT и UPDATE на порцию из 4 и из 2 привычек
+        with CaptureQueriesContext(connection) as context:
+            refreshed = Habit.refresh_notification_messages(
+                Habit.objects.filter(place=self.place), batch_size=4
+            )
+        self.assertEqual(refreshed, 6)
+        queries = [query["sql"] for query in context.captured_queries]
+        self.assertEqual(
+            len([q for q in queries if q.startswith("SELECT")]), 2
+        )
+        self.assertEqual(
+            len([q for q in queries if q.startswith("UPDATE")]), 2
+        )
+        self.assertFalse(
+            Habit.objects.exclude(
+                notification_message__contains="Место: Парк."
+            ).exists()
+        )
+
+    def test_create_single_insert(self):
+        data = {
+            "place": self.place.pk,
+            "action": self.action.pk,
+            "date_time": "1997-10-19 12:00:00",
+            "period": Habit.PERIOD_EVERY_DAY,
+            "reward": "Бургер",
+        }
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.post(reverse("spa:habit-create"), data)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        # Текст и время оповещения собраны до INSERT, других записей нет
+        queries = [query["sql"] for query in context.captured_queries]
+        self.assertEqual(
+            len([q for q in queries if q.startswith("INSERT")]), 1
+        )
+        self.assertFalse([q for q in queries if q.startswith("UPDATE")])
+        habit = Habit.objects.get(pk=response.json()["id"])
+        self.assertIn("Место: Дом.", habit.notification_message)
+        self.assertIsNotNone(habit.date_time_next_sent)
+
+    def test_not_in_api(self):
+        # В тексте email владельца связанной привычки
+        self.habit.is_public = True
+        self.habit.save()
+        for url in (
+            reverse("spa:habit-list-public"),
+            reverse("spa:habit-retrieve", args=(self.habit.pk,)),
+        ):
+            response = self.client.get(url)
+            self.assertNotIn("notification_message", response.json())
+            self.assertNotIn("user@my.ru", response.content.decode())
+
+        response = self.client.patch(
+            reverse("spa:habit-update", args=(self.habit.pk,)),
+            data={"notification_message": "Свой текст"},
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(self.get_message(self.habit), "Свой текст")
+
+    def test_without_place_and_action(self):
+        # Место и действие необязательны, в том числе у связанной привычки
+        response = self.client.post(
+            reverse("spa:habit-create"),
+            data={"date_time": "1997-10-19 12:00:00", "is_pleasant": True},
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        related_habit = Habit.objects.get(pk=response.json()["id"])
+        self.assertEqual(
+            str(related_habit), "user@my.ru: не указано, не указано"
+        )
+
+        response = self.client.post(
+            reverse("spa:habit-create"),
+            data={
+                "date_time": "1997-10-19 12:00:00",
+                "related_habit": related_habit.pk,
+            },
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(
+            self.get_message(Habit.objects.get(pk=response.json()["id"])),
+            "Пора выполнять привычку!\n"
+            "Место: не указано.\n"
+            "Действие: не указано.\n"
+            "На выполнение 120 секунд.\n"
+            "А в качестве награды не указано, не указано!",
+        )
+
+
+class HabitListPaginationTestCase(APITestCase):
+    """Данные тесты описывают постраничную и курсорную пагинацию
+    списков привычек"""
+
+    def setUp(self) -> None:
+        self.user = User.objects.create(email="user@my.ru")
+        self.other_user = User.objects.create(email="user1@my.ru")
+        habits = [
+            Habit(
+                user=user,
+                date_time=timezone.datetime(
+                    1997, 10, 19, 12, 0, tzinfo=timezone.timezone.utc
+                ),
+                is_public=is_public,
+            )
+            for _ in range(6)
+            for user, is_public in (
+                (self.user, False),
+                (self.other_user, True),
+            )
+        ]
+        Habit.objects.bulk_create(habits)
+        self.client.force_authenticate(user=self.user)
+
+    def get_all_pages(self, url, data, num_queries=1):
+        habit_ids = []
+        while url:
+            # Курсорная страница - один запрос, без COUNT(*)
+            with self.assertNumQueries(num_queries):
+                response = self.client.get(url, data=data)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            page = response.json()
+            self.assertNotIn("count", page)
+            habit_ids.extend(habit["id"] for habit in page["results"])
+            # Параметры уже есть в ссылке на следующую страницу
+            url, data = page["next"], None
+        return habit_ids
+
+    def test_cursor_public_list(self):
+        habit_ids = self.get_all_pages(
+            reverse("spa:habit-list-public"),
+            {"pagination": "cursor", "page_size": 4},
+        )
+
+        self.assertEqual(
+            habit_ids,
+            list(
+                Habit.objects.filter(is_public=True)
+                .order_by("id")
+                .values_list("id", flat=True)
+            ),
+        )
+
+    def test_cursor_my_list(self):
+        habit_ids = self.get_all_pages(
+            reverse("spa:habit-list-my"),
+            {"pagination": "cursor"},
+            # + версия списка для ETag
+            num_queries=2,
+        )
+
+        self.assertEqual(
+            habit_ids,
+            list(
+                self.user.habits.order_by("id").values_list("id", flat=True)
+            ),
+        )
+
+    def test_page_number_by_default(self):
+        with self.assertNumQueries(2):
+            response = self.client.get(
+                reverse("spa:habit-list-public"), data={"page": 2}
+            )
+        page = response.json()
+
+        self.assertEqual(page["count"], 6)
+        self.assertEqual(len(page["results"]), 1)
+        self.assertIsNone(page["next"])
+
+    def test_invalid_cursor(self):
+        response = self.client.get(
+            reverse("spa:habit-list-public"), data={"cursor": "bad"}
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
@@ -0,0 +1,116 @@
+from unittest.mock import patch
+
+from django.core.cache import cache
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.reverse import reverse
+from rest_framework.test import APITestCase
+
+from spa.models import Habit
+from spa.public_feed import public_feed_cache
+from users.models import User
+
+# python manage.py test - запуск тестов
+# python manage.py test spa.tests.tests_public_feed - запуск конкретного файла
+# coverage run --source='.' manage.py test - запуск проверки покрытия
+# coverage report -m - получение отчета с пропущенными строками
+
+
+class PublicFeedCacheTestCase(APITestCase):
+    """Данные тесты описывают кэш ленты публичных привычек"""
+
+    def setUp(self) -> None:
+        cache.clear()
+        self.user = User.objects.create(email="user@my.ru")
+        self.public_habit = self.add_habit(is_public=True)
+        self.private_habit = self.add_habit(is_public=False)
+        self.client.force_authenticate(user=self.user)
+        self.url = reverse("spa:habit-list-public")
+
+    def add_habit(self, **kwargs):
+        return Habit.objects.create(
+            user=self.user,
+            date_time=timezone.datetime(
+                1997, 10, 19, 12, 0, tzinfo=timezone.timezone.utc
+            ),
+            **kwargs,
+        )
+
+    def get_feed_ids(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [habit["id"] for habit in response.json()["results"]]
+
+    def test_cached(self):
+        self.assertEqual(self.get_feed_ids(), [self.public_habit.pk])
+
+        # Повторный запрос и запрос другого пользователя - без БД
+        with self.assertNumQueries(0):
+            self.assertEqual(self.get_feed_ids(), [self.public_habit.pk])
+        self.client.force_authenticate(
+            user=User.objects.create(email="user1@my.ru")
+        )
+        with self.assertNumQueries(0):
+            self.get_feed_ids()
+
+        # Другая страница кэшируется отдельно
+        response = self.client.get(self.url, data={"page_size": 1})
+        self.assertEqual(response.json()["count"], 1)
+
+    def test_invalidate_on_public_changes(self):
+        self.get_feed_ids()
+
+        habit = self.add_habit(is_public=True)
+        self.assertEqual(self.get_feed_ids(), [self.public_habit.pk, habit.pk])
+
+        habit.is_public = False
+        habit.save()
+        self.assertEqual(self.get_feed_ids(), [self.public_habit.pk])
+
+        self.private_habit.is_public = True
+        self.private_habit.save()
+        self.assertEqual(
+            self.get_feed_ids(),
+            [self.public_habit.pk, self.private_habit.pk],
+        )
+
+        self.public_habit.delete()
+        self.assertEqual(self.get_feed_ids(), [self.private_habit.pk])
+
+    def test_private_changes_keep_cache(self):
+        self.get_feed_ids()
+        version = public_feed_cache.get_version()
+
+        self.private_habit.reward = "Бургер"
+        self.private_habit.save()
+        self.add_habit(is_public=False).delete()
+
+        self.assertEqual(public_feed_cache.get_version(), version)
+        with self.assertNumQueries(0):
+            self.get_feed_ids()
+
+    def test_stampede_wait(self):
+        # Страницу уже собирает другой запрос: ждём его результат
+        # и в БД не идём
+        key = public_feed_cache.get_key(f"http://testserver{self.url}")
+        cache.add(f"{key}:lock", 1)
+        page = {"count": 0, "next": None, "previous": None, "results": []}
+
+        def sleep(seconds):
+            cache.set(key, page)
+
+        with patch.object(public_feed_cache, "sleep", side_effect=sleep):
+            with self.assertNumQueries(0):
+                response = self.client.get(self.url)
+
+        self.assertEqual(response.json(), page)
+
+    @patch.object(public_feed_cache, "lock_wait", 0)
+    def test_stampede_lock_expired(self):
+        # Запрос с блокировкой так и не собрал страницу: собираем сами
+        key = public_feed_cache.get_key(f"http://testserver{self.url}")
+        cache.add(f"{key}:lock", 1)
+
+        self.assertEqual(self.get_feed_ids(), [self.public_habit.pk])
+        # Чужую блокировку не снимаем
+        self.assertEqual(cache.get(f"{key}:lock"), 1)
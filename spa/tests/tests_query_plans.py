@@ -0,0 +1,100 @@
+import random
+import re
+
+from django.db import connection
+from django.utils import timezone
+from rest_framework.test import APITestCase
+
+from spa.models import Habit
+from spa.tasks import get_due_habits
+from spa.views import HabitListAPIView, HabitPublicListAPIView
+from users.models import User
+
+# python manage.py test - запуск тестов
+# python manage.py test spa.tests.tests_query_plans - запуск конкретного файла
+# coverage run --source='.' manage.py test - запуск проверки покрытия
+# coverage report -m - получение отчета с пропущенными строками
+
+USERS_COUNT = 500
+HABITS_COUNT = 20000
+PUBLIC_SHARE = 0.05
+
+
+def utc(*args):
+    return timezone.datetime(*args, tzinfo=timezone.timezone.utc)
+
+
+class QueryPlanTestCase(APITestCase):
+    """Данные тесты проверяют по EXPLAIN, что частые запросы к привычкам
+    на реалистичном объёме данных используют индексы, а не полный
+    просмотр таблицы с сортировкой"""
+
+    @classmethod
+    def setUpTestData(cls):
+        rng = random.Random(1)
+        cls.now = utc(2024, 1, 14, 3, 21)
+
+        User.objects.bulk_create(
+            User(email=f"user{number}@my.ru", tg_chat_id=number + 1)
+            for number in range(USERS_COUNT)
+        )
+        cls.users = list(User.objects.all())
+
+        # Оповещения расписаны на неделю вперёд, наступили - у немногих
+        habits = []
+        for _ in range(HABITS_COUNT):
+            period = rng.choice(list(Habit.PERIOD_CHOICES))
+            if period == Habit.PERIOD_DISABLE:
+                date_time_next_sent = None
+            else:
+                date_time_next_sent = cls.now + timezone.timedelta(
+                    minutes=rng.randint(-5, 7 * 24 * 60)
+                )
+            habits.append(
+                Habit(
+                    user=rng.choice(cls.users),
+                    date_time=cls.now,
+                    period=period,
+                    is_public=rng.random() < PUBLIC_SHARE,
+                    date_time_next_sent=date_time_next_sent,
+                )
+            )
+        Habit.objects.bulk_create(habits, batch_size=1000)
+
+        # Статистика для планировщика БД
+        with connection.cursor() as cursor:
+            if connection.vendor == "postgresql":
+                cursor.execute("ANALYZE spa_habit")
+            else:
+                cursor.execute("ANALYZE")
+
+    def assertUsesIndex(self, queryset, index_name):
+        plan = queryset.explain()
+        self.assertIn(index_name, plan)
+        # Полный просмотр таблицы: "Seq Scan on spa_habit" в PostgreSQL,
+        # "SCAN spa_habit" без "USING ... INDEX" в SQLite
+        self.assertIsNone(
+            re.search(r"Seq Scan on spa_habit|SCAN spa_habit(?! USING)", plan),
+            plan,
+        )
+        return plan
+
+    def test_due_habits(self):
+        self.assertUsesIndex(get_due_habits(self.now), "spa_habit_due_idx")
+
+    def test_public_list(self):
+        queryset = HabitPublicListAPIView.queryset
+
+        self.assertUsesIndex(queryset[:5], "spa_habit_public_id_idx")
+        # Число публичных привычек для пагинации
+        self.assertUsesIndex(
+            queryset.order_by().values("id"), "spa_habit_public_id_idx"
+        )
+
+    def test_user_list(self):
+        queryset = HabitListAPIView.queryset.filter(user=self.users[0])
+
+        plan = self.assertUsesIndex(queryset[:5], "spa_habit_user_id_idx")
+        # Сортировка по id берётся из индекса
+        self.assertNotIn("TEMP B-TREE", plan)
+        self.assertNotIn("Sort", plan)
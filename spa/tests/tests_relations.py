@@ -0,0 +1,151 @@
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.relations import PrimaryKeyRelatedField
+from rest_framework.reverse import reverse
+from rest_framework.test import APIRequestFactory, APITestCase
+
+from spa.models import Action, Habit, Place
+from spa.serializers import HabitSerializer
+from users.models import User
+
+# python manage.py test - запуск тестов
+# python manage.py test spa.tests.tests_relations - запуск конкретного файла
+# coverage run --source='.' manage.py test - запуск проверки покрытия
+# coverage report -m - получение отчета с пропущенными строками
+
+
+class RelatedObjectsTestCase(APITestCase):
+    """Данные тесты описывают загрузку связанных объектов привычки
+    пачкой и проверку их владельца"""
+
+    def setUp(self) -> None:
+        self.user = User.objects.create(email="user@my.ru")
+        self.other_user = User.objects.create(email="user1@my.ru")
+        self.place = Place.objects.create(name="Дом")
+        self.action = Action.objects.create(name="Пробежка", user=self.user)
+        self.related_habit = self.add_habit(self.user, is_pleasant=True)
+        self.client.force_authenticate(user=self.user)
+
+    def add_habit(self, user, **kwargs):
+        return Habit.objects.create(
+            user=user,
+            place=self.place,
+            action=self.action,
+            date_time=timezone.datetime(
+                1997, 10, 19, 12, 0, tzinfo=timezone.timezone.utc
+            ),
+            **kwargs,
+        )
+
+    def create(self, **kwargs):
+        data = {
+            "place": self.place.pk,
+            "action": self.action.pk,
+            "related_habit": self.related_habit.pk,
+            "date_time": "1997-10-19 12:00:00",
+            "period": Habit.PERIOD_EVERY_DAY,
+            **kwargs,
+        }
+        return self.client.post(
+            reverse("spa:habit-create"), data=data, format="json"
+        )
+
+    def get_serializer(self, *args, **kwargs):
+        request = APIRequestFactory().post(reverse("spa:habit-create"))
+        request.user = self.user
+        return HabitSerializer(*args, context={"request": request}, **kwargs)
+
+    def test_create_queries(self):
+        serializer = self.get_serializer(
+            data={
+                "place": self.place.pk,
+                "action": self.action.pk,
+                "related_habit": self.related_habit.pk,
+                "date_time": "1997-10-19 12:00:00",
+            }
+        )
+        # Место и действие - одним запросом, связанная привычка - вторым
+        with CaptureQueriesContext(connection) as context:
+            self.assertTrue(serializer.is_valid())
+        self.assertEqual(len(context.captured_queries), 2)
+        self.assertIn("UNION ALL", context.captured_queries[0]["sql"])
+
+        # Для текста оповещения всё уже загружено
+        habit = Habit(user=self.user, **serializer.validated_data)
+        with self.assertNumQueries(0):
+            habit.render_notification_message()
+
+    def test_update_queries(self):
+        habit = self.add_habit(self.user, reward="Бургер")
+        serializer = self.get_serializer(
+            habit,
+            data={"place": self.place.pk, "action": self.action.pk},
+            partial=True,
+        )
+        with self.assertNumQueries(1):
+            self.assertTrue(serializer.is_valid())
+
+        response = self.client.patch(
+            reverse("spa:habit-update", args=(habit.pk,)),
+            data={"place": self.place.pk, "action": self.action.pk},
+            format="json",
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_other_user_objects(self):
+        other_place = Place.objects.create(name="Офис", user=self.other_user)
+        other_action = Action.objects.create(
+            name="Зарядка", user=self.other_user
+        )
+        other_habit = self.add_habit(self.other_user, is_pleasant=True)
+
+        response = self.create(
+            place=other_place.pk,
+            action=other_action.pk,
+            related_habit=other_habit.pk,
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        errors = response.json()
+        self.assertEqual(set(errors), {"place", "action", "related_habit"})
+        # Чужой объект неотличим от несуществующего
+        self.assertEqual(
+            errors["place"],
+            [
+                PrimaryKeyRelatedField.default_error_messages[
+                    "does_not_exist"
+                ].format(pk_value=other_place.pk)
+            ],
+        )
+
+        # Публичную приятную привычку другого пользователя связать можно
+        other_habit.is_public = True
+        other_habit.save()
+        response = self.create(related_habit=other_habit.pk)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+    def test_related_habit_validator(self):
+        habit = self.add_habit(self.user)
+        response = self.create(related_habit=habit.pk)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(
+            response.json()["non_field_errors"],
+            ["Связанная привычка должна быть приятной"],
+        )
+
+    def test_incorrect_type(self):
+        response = self.create(place="дом", action=True, related_habit=None)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(set(response.json()), {"place", "action"})
+
+    def test_user_read_only(self):
+        habit = self.add_habit(self.user)
+        response = self.client.patch(
+            reverse("spa:habit-update", args=(habit.pk,)),
+            data={"user": self.other_user.pk},
+            format="json",
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        habit.refresh_from_db()
+        self.assertEqual(habit.user, self.user)
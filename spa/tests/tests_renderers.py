@@ -0,0 +1,153 @@
+import io
+import os
+import time
+import uuid
+from datetime import date, datetime, time as dt_time, timedelta, timezone
+from decimal import Decimal
+from unittest import skipUnless
+from unittest.mock import patch
+
+from django.utils.translation import gettext_lazy
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.reverse import reverse
+from rest_framework.test import APITestCase
+
+from config.parsers import FastJSONParser
+from config.renderers import FastJSONRenderer
+from spa.models import Action, Habit, Place
+from users.models import User
+
+# python manage.py test - запуск тестов
+# python manage.py test spa.tests.tests_renderers - запуск конкретного файла
+# coverage run --source='.' manage.py test - запуск проверки покрытия
+# coverage report -m - получение отчета с пропущенными строками
+
+DATA = {
+    "id": 1,
+    "name": "Пробежка по парку",
+    "lazy": gettext_lazy("Привычка"),
+    "errors": {"period": [gettext_lazy("Выберите правильный вариант.")]},
+    "date_time": datetime(2024, 1, 14, 3, 21, tzinfo=timezone.utc),
+    "date_time_us": datetime(2024, 1, 14, 3, 21, 0, 123456),
+    "date_time_msk": datetime(
+        2024, 1, 14, 6, 21, tzinfo=timezone(timedelta(hours=3))
+    ),
+    "date": date(2024, 1, 14),
+    "time": dt_time(3, 21, 15),
+    "duration": timedelta(minutes=2),
+    "price": Decimal("12.50"),
+    "uuid": uuid.UUID("12345678-1234-5678-1234-567812345678"),
+    "separators": "строка строка ",
+    1: [None, True, 1.5, []],
+}
+
+
+class FastJSONTestCase(APITestCase):
+    """Данные тесты описывают JSON-рендерер и парсер на orjson:
+    результат должен совпадать со стандартными классами DRF"""
+
+    def test_render_same_as_drf(self):
+        self.assertEqual(
+            FastJSONRenderer().render(DATA), JSONRenderer().render(DATA)
+        )
+        self.assertEqual(FastJSONRenderer().render(None), b"")
+
+    def test_render_indent(self):
+        media_type = "application/json; indent=4"
+        self.assertEqual(
+            FastJSONRenderer().render(DATA, media_type),
+            JSONRenderer().render(DATA, media_type),
+        )
+
+    @patch("config.renderers.orjson", None)
+    def test_render_without_orjson(self):
+        self.assertEqual(
+            FastJSONRenderer().render(DATA), JSONRenderer().render(DATA)
+        )
+
+    def test_parse(self):
+        body = '{"name": "Пробежка", "items": [1, 2.5, null, true]}'.encode()
+        for parser in (FastJSONParser(), JSONParser()):
+            with self.subTest(parser=parser):
+                self.assertEqual(
+                    parser.parse(io.BytesIO(body)),
+                    {"name": "Пробежка", "items": [1, 2.5, None, True]},
+                )
+                with self.assertRaises(ParseError):
+                    parser.parse(io.BytesIO(b'{"name": NaN}'))
+
+    @patch("config.parsers.orjson", None)
+    def test_parse_without_orjson(self):
+        self.assertEqual(
+            FastJSONParser().parse(io.BytesIO('{"a": "б"}'.encode())),
+            {"a": "б"},
+        )
+
+    def test_api(self):
+        user = User.objects.create(email="user@my.ru")
+        self.client.force_authenticate(user=user)
+
+        # Русские сообщения валидации - ленивые строки перевода
+        response = self.client.post(
+            reverse("spa:habit-create"),
+            data={"date_time": "1997-10-19 12:00:00", "period": "НИКОГДА"},
+            format="json",
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(
+            response.content, JSONRenderer().render(response.data)
+        )
+        self.assertIn("НИКОГДА", response.content.decode())
+
+
+@skipUnless(os.getenv("RUN_BENCHMARKS"), "RUN_BENCHMARKS не задан")
+class FastJSONBenchmark(APITestCase):
+    """Сравнение скорости стандартного и быстрого JSON на ответах
+    привычек, мест, действий и пользователей
+    (RUN_BENCHMARKS=1 python manage.py test
+    spa.tests.tests_renderers.FastJSONBenchmark)"""
+
+    def test_speedup(self):
+        user = User.objects.create(email="user@my.ru")
+        for number in range(100):
+            User.objects.create(email=f"user{number}@my.ru")
+            place = Place.objects.create(name=f"Место {number}", user=user)
+            action = Action.objects.create(
+                name=f"Действие {number}", user=user
+            )
+            Habit.objects.create(
+                user=user,
+                place=place,
+                action=action,
+                date_time=datetime(1997, 10, 19, 12, 0, tzinfo=timezone.utc),
+                period=Habit.PERIOD_EVERY_DAY,
+                reward="Бургер",
+            )
+        self.client.force_authenticate(user=user)
+
+        for url in (
+            reverse("spa:habit-list-my") + "?page_size=100",
+            reverse("spa:places-list"),
+            reverse("spa:actions-list"),
+            reverse("users:users-list"),
+        ):
+            data = self.client.get(url).data
+            body = JSONRenderer().render(data)
+            timings = []
+            for renderer, parser in (
+                (JSONRenderer(), JSONParser()),
+                (FastJSONRenderer(), FastJSONParser()),
+            ):
+                start = time.perf_counter()
+                for _ in range(100):
+                    renderer.render(data)
+                    parser.parse(io.BytesIO(body))
+                timings.append((time.perf_counter() - start) * 10)
+
+            print(
+                f"\n{url}, {len(body)} байт, рендер + разбор: "
+                f"{timings[0]:.2f} мс -> {timings[1]:.2f} мс "
+                f"(x{timings[0] / timings[1]:.1f})"
+            )
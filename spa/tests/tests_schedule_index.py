@@ -0,0 +1,208 @@
+from io import StringIO
+from unittest.mock import patch
+
+import fakeredis
+from django.core.cache import cache
+from django.core.management import call_command
+from django.utils import timezone
+from freezegun import freeze_time
+from rest_framework import status
+from rest_framework.reverse import reverse
+from rest_framework.test import APITestCase
+
+from config.celery import app as celery_app
+from spa.models import Habit, Place, Action
+from spa.schedule_index import schedule_index
+from spa.tasks import (
+    send_user_notification_habits,
+    send_user_notification_in_telegram,
+)
+from users.models import User
+from users.services_telegram import TelegramClient, TelegramSendResult
+
+
+# python manage.py test - запуск тестов
+# python manage.py test spa.tests.tests_schedule_index - запуск конкретного файла
+# coverage run --source='.' manage.py test - запуск проверки покрытия
+# coverage report -m - получение отчета с пропущенными строками
+
+
+def utc(*args):
+    return timezone.datetime(*args, tzinfo=timezone.timezone.utc)
+
+
+def send_message(chat_id, text):
+    return TelegramSendResult(chat_id=chat_id, ok=True)
+
+
+@freeze_time("2024-01-14 03:21:34", tz_offset=0)
+@patch.object(TelegramClient, "send_message", side_effect=send_message)
+class HabitScheduleIndexTestCase(APITestCase):
+    """Данные тесты описывают индекс расписания оповещений в Redis"""
+
+    def setUp(self) -> None:
+        cache.clear()
+        patcher = patch.object(schedule_index, "client", fakeredis.FakeRedis())
+        self.redis = patcher.start()
+        self.addCleanup(patcher.stop)
+
+        celery_app.conf.task_always_eager = True
+        self.addCleanup(setattr, celery_app.conf, "task_always_eager", False)
+
+        self.user = User.objects.create(
+            email="user@my.ru", tg_chat_id=1, tg_coalesce_notifications=False
+        )
+        self.place = Place.objects.create(name="Дом")
+        self.action = Action.objects.create(name="Пробежка")
+
+    def add_habit(self, date_time_next_sent, **kwargs):
+        habit = Habit.objects.create(
+            user=self.user,
+            place=self.place,
+            action=self.action,
+            date_time=utc(1997, 10, 19, 12, 0),
+            period=Habit.PERIOD_EVERY_DAY,
+            reward="Бургер",
+            date_time_next_sent=date_time_next_sent,
+            **kwargs,
+        )
+        schedule_index.add([habit])
+        return habit
+
+    def get_score(self, habit):
+        return self.redis.zscore(schedule_index.key, habit.pk)
+
+    def test_sync_with_views(self, mock_send):
+        self.client.force_authenticate(user=self.user)
+        data = {
+            "place": self.place.pk,
+            "action": self.action.pk,
+            "date_time": "1997-10-19 12:00:00",
+            "period": Habit.PERIOD_EVERY_DAY,
+            "reward": "Бургер",
+            "time_to_complete": 120,
+        }
+
+        response = self.client.post(reverse("spa:habit-create"), data=data)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        habit = Habit.objects.get()
+        self.assertEqual(
+            self.get_score(habit), utc(2024, 1, 14, 12, 0).timestamp()
+        )
+
+        data["date_time"] = "1997-10-19 15:00:00"
+        response = self.client.put(
+            reverse("spa:habit-update", args=(habit.pk,)), data=data
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            self.get_score(habit), utc(2024, 1, 14, 15, 0).timestamp()
+        )
+
+        data["period"] = Habit.PERIOD_DISABLE
+        self.client.put(
+            reverse("spa:habit-update", args=(habit.pk,)), data=data
+        )
+        self.assertIsNone(self.get_score(habit))
+
+        habit = self.add_habit(utc(2024, 1, 14, 3, 21))
+        response = self.client.delete(
+            reverse("spa:habit-delete", args=(habit.pk,))
+        )
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(self.redis.zcard(schedule_index.key), 0)
+
+    @patch("spa.schedule_index.schedule_index.batch_size", 2)
+    def test_claim_due(self, mock_send):
+        due = [self.add_habit(utc(2024, 1, 14, 3, 21)) for _ in range(3)]
+        later = self.add_habit(utc(2024, 1, 14, 3, 22))
+
+        habit_ids = schedule_index.claim_due(utc(2024, 1, 14, 3, 21))
+
+        self.assertEqual(sorted(habit_ids), [habit.pk for habit in due])
+        # Забранные привычки остались в индексе до конца аренды
+        claimed_until = utc(2024, 1, 14, 3, 26, 34).timestamp()
+        for habit in due:
+            self.assertEqual(self.get_score(habit), claimed_until)
+        self.assertEqual(
+            self.get_score(later), utc(2024, 1, 14, 3, 22).timestamp()
+        )
+        self.assertEqual(schedule_index.claim_due(utc(2024, 1, 14, 3, 21)), [])
+
+    def test_claim_lease(self, mock_send):
+        habit = self.add_habit(utc(2024, 1, 14, 3, 21))
+        deleted = self.add_habit(utc(2024, 1, 14, 3, 21))
+        self.assertEqual(
+            schedule_index.claim_due(utc(2024, 1, 14, 3, 21)),
+            [habit.pk, deleted.pk],
+        )
+
+        # Рассылка упала, не обработав привычки: после аренды
+        # их забирает следующий запуск
+        with freeze_time("2024-01-14 03:27:00"):
+            habit_ids = schedule_index.claim_due(utc(2024, 1, 14, 3, 27))
+            self.assertEqual(habit_ids, [habit.pk, deleted.pk])
+
+            deleted.delete()
+            with self.captureOnCommitCallbacks(execute=True):
+                send_user_notification_habits(
+                    habit_ids, utc(2024, 1, 14, 3, 27).isoformat()
+                )
+
+        # После обработки аренда снята, удалённая привычка убрана
+        self.assertEqual(
+            self.redis.zrange(schedule_index.key, 0, -1, withscores=True),
+            [(str(habit.pk).encode(), utc(2024, 1, 14, 12, 0).timestamp())],
+        )
+
+    def test_nothing_due_without_db(self, mock_send):
+        self.add_habit(utc(2024, 1, 14, 3, 22))
+
+        with self.assertNumQueries(0):
+            result = send_user_notification_in_telegram()
+
+        self.assertEqual(result, {"shards": 0})
+        mock_send.assert_not_called()
+
+    @patch("spa.tasks.HABIT_NOTIFICATION_SHARD_SIZE", 2)
+    def test_send_from_index(self, mock_send):
+        habits = [self.add_habit(utc(2024, 1, 14, 3, 21)) for _ in range(3)]
+        # Пользователь без Telegram: оповещение не отправить,
+        # но привычка должна остаться в индексе, не забираясь каждый раз
+        self.user = User.objects.create(email="user1@my.ru")
+        skipped = self.add_habit(utc(2024, 1, 14, 3, 21))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            result = send_user_notification_in_telegram()
+
+        self.assertEqual(result, {"shards": 2})
+        self.assertEqual(mock_send.call_count, 3)
+        for habit in habits:
+            self.assertEqual(
+                self.get_score(habit), utc(2024, 1, 14, 12, 0).timestamp()
+            )
+        self.assertEqual(
+            self.get_score(skipped), utc(2024, 1, 14, 12, 0).timestamp()
+        )
+        self.assertEqual(schedule_index.claim_due(utc(2024, 1, 14, 3, 22)), [])
+
+    def test_rebuild(self, mock_send):
+        habit = self.add_habit(utc(2024, 1, 14, 3, 21))
+        Habit.objects.create(
+            user=self.user,
+            place=self.place,
+            action=self.action,
+            date_time=utc(1997, 10, 19, 12, 0),
+            period=Habit.PERIOD_DISABLE,
+        )
+        # Мусор в индексе, которого нет в БД
+        self.redis.zadd(schedule_index.key, {999999: 0})
+
+        out = StringIO()
+        call_command("rebuild_schedule_index", stdout=out)
+
+        self.assertIn("В индексе расписания привычек: 1", out.getvalue())
+        self.assertEqual(
+            self.redis.zrange(schedule_index.key, 0, -1, withscores=True),
+            [(str(habit.pk).encode(), utc(2024, 1, 14, 3, 21).timestamp())],
+        )
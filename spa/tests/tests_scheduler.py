@@ -0,0 +1,189 @@
+from unittest.mock import Mock, patch
+
+from django.core.cache import cache
+from django.utils import timezone
+from freezegun import freeze_time
+from rest_framework.test import APITestCase
+
+from spa.models import Habit, Place, Action
+from spa.scheduler import HabitScheduler
+from users.models import User
+
+# python manage.py test - запуск тестов
+# python manage.py test spa.tests.tests_scheduler - запуск конкретного файла
+# coverage run --source='.' manage.py test - запуск проверки покрытия
+# coverage report -m - получение отчета с пропущенными строками
+
+
+def utc(*args):
+    return timezone.datetime(*args, tzinfo=timezone.timezone.utc)
+
+
+@patch("spa.scheduler.send_user_notification_habits.delay")
+class HabitSchedulerTestCase(APITestCase):
+    """Данные тесты описывают планировщик оповещений"""
+
+    @freeze_time("2024-01-14 09:50:00")
+    def setUp(self) -> None:
+        cache.clear()
+        self.user = User.objects.create(email="user@my.ru", tg_chat_id=1)
+        self.place = Place.objects.create(name="Дом")
+        self.action = Action.objects.create(name="Пробежка")
+
+        self.habit_minute = self.add_habit(
+            Habit.PERIOD_EVERY_MINUTE, utc(2024, 1, 14, 10, 0)
+        )
+        self.habit_day = self.add_habit(
+            Habit.PERIOD_EVERY_DAY, utc(2024, 1, 14, 10, 5)
+        )
+        # За горизонтом планирования
+        self.habit_later = self.add_habit(
+            Habit.PERIOD_EVERY_DAY, utc(2024, 1, 14, 11, 0)
+        )
+
+    def add_habit(self, period, date_time):
+        return Habit.objects.create(
+            user=self.user,
+            place=self.place,
+            action=self.action,
+            date_time=date_time,
+            period=period,
+            date_time_next_sent=date_time,
+        )
+
+    def test_sleep_until_next(self, mock_delay):
+        sleep = Mock()
+        scheduler = HabitScheduler(sleep=sleep)
+
+        with freeze_time("2024-01-14 09:59:58"):
+            scheduler.run(iterations=1)
+
+        mock_delay.assert_not_called()
+        sleep.assert_called_once_with(2)
+        self.assertEqual(
+            sorted(habit_id for _, habit_id, _, _ in scheduler.heap),
+            [self.habit_minute.pk, self.habit_day.pk],
+        )
+
+    def test_run_pending(self, mock_delay):
+        scheduler = HabitScheduler(sleep=Mock())
+
+        with freeze_time("2024-01-14 09:59:58") as frozen_time:
+            scheduler.run(iterations=1)
+
+            frozen_time.move_to("2024-01-14 10:00:00.250")
+            scheduler.load(timezone.now())
+            lags = scheduler.run_pending(timezone.now())
+
+        # Задержка считается от времени по расписанию
+        self.assertEqual(lags, [250])
+        mock_delay.assert_called_once_with(
+            [self.habit_minute.pk], "2024-01-14T10:00:00+00:00"
+        )
+        # Следующее срабатывание сразу попало в кучу
+        self.assertEqual(
+            scheduler.heap[0],
+            (
+                utc(2024, 1, 14, 10, 1),
+                self.habit_minute.pk,
+                Habit.PERIOD_EVERY_MINUTE,
+                utc(2024, 1, 14, 10, 0),
+            ),
+        )
+
+    def test_load_incrementally(self, mock_delay):
+        scheduler = HabitScheduler(batch_size=1)
+
+        with self.assertNumQueries(3):
+            scheduler.load(utc(2024, 1, 14, 9, 59))
+        self.assertEqual(len(scheduler.heap), 2)
+
+        # Следующая загрузка читает только новое окно
+        scheduler.load(utc(2024, 1, 14, 10, 55))
+        self.assertEqual(len(scheduler.heap), 3)
+        self.assertEqual(
+            len({habit_id for _, habit_id, _, _ in scheduler.heap}), 3
+        )
+
+    def test_refresh_on_habit_change(self, mock_delay):
+        scheduler = HabitScheduler(sleep=Mock())
+
+        with freeze_time("2024-01-14 09:59:58") as frozen_time:
+            scheduler.run(iterations=1)
+            frozen_time.tick(60)
+
+            # Изменения видны без общего кэша: планировщик читает их из БД
+            cache.clear()
+            self.habit_later.date_time_next_sent = utc(2024, 1, 14, 10, 1)
+            self.habit_later.save()
+            # Перенос пачкой, как в задаче рассылки
+            Habit.bulk_reschedule([self.habit_day], utc(2024, 1, 14, 10, 5))
+            with self.assertNumQueries(2):
+                scheduler.apply_changes()
+
+        self.assertEqual(
+            sorted(scheduler.heap),
+            [
+                (
+                    utc(2024, 1, 14, 10, 0),
+                    self.habit_minute.pk,
+                    Habit.PERIOD_EVERY_MINUTE,
+                    utc(2024, 1, 14, 10, 0),
+                ),
+                (
+                    utc(2024, 1, 14, 10, 1),
+                    self.habit_later.pk,
+                    Habit.PERIOD_EVERY_DAY,
+                    utc(2024, 1, 14, 11, 0),
+                ),
+            ],
+        )
+
+    def test_page_changes(self, mock_delay):
+        scheduler = HabitScheduler(batch_size=1, sleep=Mock())
+
+        with freeze_time("2024-01-14 09:59:58") as frozen_time:
+            scheduler.run(iterations=1)
+            frozen_time.tick(60)
+            # Все строки переноса получают одно updated_at
+            Habit.bulk_reschedule(
+                [self.habit_minute, self.habit_day, self.habit_later],
+                timezone.now(),
+            )
+            scheduler.apply_changes()
+            self.assertEqual(
+                (scheduler.last_seen, scheduler.last_id),
+                Habit.objects.filter(pk=self.habit_later.pk)
+                .values_list("updated_at", "id")
+                .get(),
+            )
+
+            # Изменения прочитаны порциями один раз, кучу заново
+            # не собираем
+            with self.assertNumQueries(1):
+                scheduler.apply_changes()
+        self.assertIsNotNone(scheduler.window_end)
+        self.assertEqual(
+            sorted(habit_id for _, habit_id, _, _ in scheduler.heap),
+            [self.habit_minute.pk, self.habit_day.pk],
+        )
+
+    def test_skip_own_reschedule(self, mock_delay):
+        scheduler = HabitScheduler(sleep=Mock())
+
+        with freeze_time("2024-01-14 09:59:58") as frozen_time:
+            scheduler.run(iterations=1)
+            frozen_time.move_to("2024-01-14 10:00:00")
+            scheduler.run(iterations=1)
+            mock_delay.assert_called_once()
+
+            # Задача рассылки переносит отправленную привычку на то же
+            # время, что уже в куче: перечитывать её не нужно
+            Habit.bulk_reschedule([self.habit_minute], timezone.now())
+            with self.assertNumQueries(1):
+                scheduler.apply_changes()
+        self.assertEqual(scheduler.fired, {})
+        self.assertEqual(
+            scheduler.heap[0][:2],
+            (utc(2024, 1, 14, 10, 1), self.habit_minute.pk),
+        )
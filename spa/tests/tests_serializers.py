@@ -0,0 +1,148 @@
+import os
+import time
+from unittest import skipUnless
+from unittest.mock import patch
+
+from django.core.cache import cache
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework.reverse import reverse
+from rest_framework.test import APITestCase
+
+from spa.models import Action, Habit, Place
+from spa.serializers import HabitSerializer, habit_values_serializer
+from spa.views import HabitListAPIView, HabitPublicListAPIView
+from users.models import User
+
+# python manage.py test - запуск тестов
+# python manage.py test spa.tests.tests_serializers - запуск конкретного файла
+# coverage run --source='.' manage.py test - запуск проверки покрытия
+# coverage report -m - получение отчета с пропущенными строками
+
+
+def add_habits(user, count):
+    place = Place.objects.create(name="Дом", user=user)
+    action = Action.objects.create(name="Пробежка", user=user)
+    related_habit = Habit.objects.create(
+        user=user,
+        place=place,
+        action=action,
+        date_time=timezone.datetime(
+            1997, 10, 19, 12, 0, tzinfo=timezone.timezone.utc
+        ),
+        is_pleasant=True,
+        is_public=True,
+    )
+    habits = []
+    for number in range(count):
+        # Пустые связи и время оповещения, микросекунды, разные
+        # периоды и награды
+        habits.append(
+            Habit(
+                user=user,
+                place=place if number % 2 else None,
+                action=action,
+                related_habit=related_habit if number % 3 == 0 else None,
+                date_time=timezone.datetime(
+                    1997,
+                    10,
+                    19,
+                    12,
+                    0,
+                    15,
+                    number,
+                    tzinfo=timezone.timezone.utc,
+                ),
+                period=list(Habit.PERIOD_CHOICES)[number % 5],
+                reward="" if number % 3 == 0 else f"Награда «{number}»",
+                time_to_complete=number % 120 + 1,
+                is_public=bool(number % 2),
+                date_time_next_sent=(
+                    timezone.datetime(
+                        2024,
+                        1,
+                        14,
+                        3,
+                        number % 60,
+                        tzinfo=timezone.timezone.utc,
+                    )
+                    if number % 4
+                    else None
+                ),
+                notification_message=f"Текст\n{number}",
+            )
+        )
+    Habit.objects.bulk_create(habits)
+
+
+class HabitValuesSerializerTestCase(APITestCase):
+    """Данные тесты описывают быструю сериализацию списков привычек:
+    ответ должен совпадать с HabitSerializer байт в байт"""
+
+    def setUp(self) -> None:
+        cache.clear()
+        self.user = User.objects.create(email="user@my.ru")
+        add_habits(self.user, 30)
+        self.client.force_authenticate(user=self.user)
+
+    def test_same_as_serializer(self):
+        queryset = Habit.objects.order_by("id")
+
+        self.assertEqual(
+            JSONRenderer().render(
+                habit_values_serializer.to_representation(
+                    habit_values_serializer.get_values(queryset)
+                )
+            ),
+            JSONRenderer().render(HabitSerializer(queryset, many=True).data),
+        )
+
+    def test_same_response(self):
+        for view, url in (
+            (HabitListAPIView, reverse("spa:habit-list-my")),
+            (HabitPublicListAPIView, reverse("spa:habit-list-public")),
+        ):
+            for data in ({"page_size": 100}, {"pagination": "cursor"}):
+                with self.subTest(url=url, data=data):
+                    cache.clear()
+                    fast = self.client.get(url, data=data)
+                    cache.clear()
+                    with patch.object(view, "values_serializer", None):
+                        slow = self.client.get(url, data=data)
+
+                    self.assertEqual(fast.content, slow.content)
+
+
+@skipUnless(os.getenv("RUN_BENCHMARKS"), "RUN_BENCHMARKS не задан")
+class HabitValuesSerializerBenchmark(APITestCase):
+    """Сравнение скорости HabitSerializer и быстрой сериализации
+    (RUN_BENCHMARKS=1 python manage.py test
+    spa.tests.tests_serializers.HabitValuesSerializerBenchmark)"""
+
+    def test_speedup(self):
+        user = User.objects.create(email="user@my.ru")
+        add_habits(user, 1000)
+        queryset = Habit.objects.order_by("id")
+
+        for page_size in (10, 100, 1000):
+            page = queryset[:page_size]
+
+            start = time.perf_counter()
+            for _ in range(10):
+                expected = HabitSerializer(page, many=True).data
+            serializer_elapsed = (time.perf_counter() - start) / 10
+
+            start = time.perf_counter()
+            for _ in range(10):
+                result = habit_values_serializer.to_representation(
+                    habit_values_serializer.get_values(page)
+                )
+            values_elapsed = (time.perf_counter() - start) / 10
+
+            self.assertEqual(result, expected)
+            print(
+                f"\nСтраница {page_size}: "
+                f"{serializer_elapsed * 1000:.1f} мс -> "
+                f"{values_elapsed * 1000:.1f} мс "
+                f"(x{serializer_elapsed / values_elapsed:.1f})"
+            )
@@ -0,0 +1,116 @@
+from django.db.models import F
+from django.utils import timezone
+from rest_framework.test import APITestCase
+
+from spa.models import Habit
+
+# python manage.py test - запуск тестов
+# python manage.py test spa.tests.tests_services_db - запуск конкретного файла
+# coverage run --source='.' manage.py test - запуск проверки покрытия
+# coverage report -m - получение отчета с пропущенными строками
+
+
+def utc(*args):
+    return timezone.datetime(*args, tzinfo=timezone.timezone.utc)
+
+
+SENT_TIMES = (
+    utc(2024, 1, 14, 3, 21),
+    utc(2024, 2, 29, 23, 59),
+    utc(1997, 10, 19, 12, 0),
+)
+
+# Начала рассылки до, в момент и после отправленных оповещений,
+# с секундами и микросекундами, на границах часов, суток и недель
+DATE_TIMES = (
+    utc(1965, 3, 1, 8, 30, 15, 500000),
+    utc(1997, 10, 19, 12, 0),
+    utc(1997, 10, 19, 12, 0, 59, 999999),
+    utc(1997, 10, 19, 11, 59, 1),
+    utc(1997, 10, 12, 12, 0),
+    utc(2023, 12, 31, 23, 59, 59),
+    utc(2024, 1, 7, 3, 21),
+    utc(2024, 1, 14, 3, 20, 30),
+    utc(2024, 1, 14, 3, 21),
+    utc(2024, 1, 14, 3, 21, 0, 1),
+    utc(2024, 1, 14, 3, 22),
+    utc(2024, 2, 22, 23, 59, 30),
+    utc(2024, 3, 1, 0, 0),
+    utc(2030, 6, 1, 10, 45, 10),
+)
+
+
+class NextExecutionTimeExpressionTestCase(APITestCase):
+    """Данные тесты описывают расчёт следующего оповещения в БД:
+    результат должен совпадать с Habit.get_next_execution_time_after"""
+
+    def setUp(self) -> None:
+        Habit.objects.bulk_create(
+            Habit(date_time=date_time, period=period)
+            for period in Habit.PERIOD_CHOICES
+            for date_time in DATE_TIMES
+        )
+
+    def assertMatchesPython(self, sent_time, habits):
+        for habit_id, period, date_time, date_time_next_sent in habits:
+            with self.subTest(
+                sent_time=sent_time, period=period, date_time=date_time
+            ):
+                self.assertEqual(
+                    date_time_next_sent,
+                    Habit.get_next_execution_time_after(
+                        period, date_time, sent_time
+                    ),
+                )
+
+    def test_annotate(self):
+        for sent_time in SENT_TIMES:
+            habits = Habit.objects.annotate(
+                next_sent=Habit.get_next_execution_time_after_expression(
+                    sent_time
+                )
+            ).values_list("id", "period", "date_time", "next_sent")
+
+            self.assertMatchesPython(sent_time, habits)
+
+    def test_reschedule(self):
+        for sent_time in SENT_TIMES:
+            Habit.objects.update(claimed_until=sent_time)
+
+            with self.assertNumQueries(1):
+                rows = Habit.reschedule(Habit.objects.all(), sent_time)
+
+            self.assertEqual(len(rows), Habit.objects.count())
+            self.assertEqual(
+                dict(rows),
+                dict(Habit.objects.values_list("id", "date_time_next_sent")),
+            )
+            self.assertFalse(
+                Habit.objects.filter(claimed_until__isnull=False).exists()
+            )
+            self.assertMatchesPython(
+                sent_time,
+                Habit.objects.values_list(
+                    "id", "period", "date_time", "date_time_next_sent"
+                ),
+            )
+
+    def test_reschedule_returning(self):
+        sent_time = SENT_TIMES[0]
+        habits = Habit.objects.filter(period=Habit.PERIOD_EVERY_DAY)
+
+        rows = Habit.reschedule(
+            habits.filter(date_time__lt=F("date_time_next_sent"))
+            | habits.filter(date_time_next_sent__isnull=True),
+            sent_time,
+            returning=("id", "period", "date_time", "date_time_next_sent"),
+        )
+
+        self.assertEqual(len(rows), len(DATE_TIMES))
+        self.assertMatchesPython(sent_time, rows)
+        # Остальные привычки не тронуты
+        self.assertFalse(
+            Habit.objects.exclude(period=Habit.PERIOD_EVERY_DAY)
+            .filter(date_time_next_sent__isnull=False)
+            .exists()
+        )
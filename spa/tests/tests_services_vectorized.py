@@ -0,0 +1,106 @@
+import os
+import time
+from datetime import datetime, timezone as dt_timezone
+from unittest import skipUnless
+
+import numpy as np
+from hypothesis import given, settings, strategies as st
+from hypothesis.extra.django import SimpleTestCase
+from rest_framework.test import APITestCase
+
+from spa.services import (
+    get_next_day_date,
+    get_next_week_date,
+    get_next_hour_date,
+    get_next_minute_date,
+)
+from spa.services_vectorized import (
+    from_datetime64,
+    get_next_day_dates,
+    get_next_hour_dates,
+    get_next_minute_dates,
+    get_next_week_dates,
+    to_datetime64,
+)
+
+# python manage.py test - запуск тестов
+# python manage.py test spa.tests.tests_services_vectorized - запуск конкретного файла
+# coverage run --source='.' manage.py test - запуск проверки покрытия
+# coverage report -m - получение отчета с пропущенными строками
+
+FUNCTIONS = (
+    (get_next_minute_date, get_next_minute_dates),
+    (get_next_hour_date, get_next_hour_dates),
+    (get_next_day_date, get_next_day_dates),
+    (get_next_week_date, get_next_week_dates),
+)
+
+utc_datetimes = st.datetimes(
+    min_value=datetime(1900, 1, 1),
+    max_value=datetime(2100, 1, 1),
+    timezones=st.just(dt_timezone.utc),
+)
+
+
+# Hypothesis требует свои варианты тестовых классов Django,
+# БД этим тестам не нужна
+class VectorizedServicesTestCase(SimpleTestCase):
+    """Данные тесты описывают векторные версии функций spa.services:
+    результат должен совпадать со скалярными функциями поэлементно"""
+
+    @settings(max_examples=300, deadline=None)
+    @given(st.lists(utc_datetimes, min_size=1, max_size=50), utc_datetimes)
+    def test_equivalence(self, date_times_start_sent, now_time):
+        starts = to_datetime64(date_times_start_sent)
+        for scalar, vectorized in FUNCTIONS:
+            self.assertEqual(
+                from_datetime64(vectorized(starts, now_time)),
+                [
+                    scalar(date_time_start_sent, now_time)
+                    for date_time_start_sent in date_times_start_sent
+                ],
+                scalar.__name__,
+            )
+
+    def test_numpy_now(self):
+        starts = to_datetime64([datetime(2024, 5, 28, 16, 15, 34)])
+        now_time = np.datetime64("2024-06-15T13:10:01")
+        self.assertEqual(
+            get_next_day_dates(starts, now_time)[0],
+            np.datetime64("2024-06-15T16:15:00"),
+        )
+
+
+@skipUnless(os.getenv("RUN_BENCHMARKS"), "RUN_BENCHMARKS не задан")
+class VectorizedServicesBenchmark(APITestCase):
+    """Сравнение скорости скалярных и векторных функций
+    (RUN_BENCHMARKS=1 BENCHMARK_ROWS=1000000 python manage.py test
+    spa.tests.tests_services_vectorized.VectorizedServicesBenchmark)"""
+
+    def test_speedup(self):
+        rows = int(os.getenv("BENCHMARK_ROWS", 1_000_000))
+        now_time = datetime(2024, 1, 14, 3, 21, 34, tzinfo=dt_timezone.utc)
+        rng = np.random.default_rng(0)
+        starts = np.datetime64("2000-01-01T00:00:00", "us") + rng.integers(
+            0, 30 * 365 * 24 * 60 * 60 * 10**6, rows
+        ).astype("timedelta64[us]")
+        date_times_start_sent = from_datetime64(starts)
+
+        for scalar, vectorized in FUNCTIONS:
+            start = time.perf_counter()
+            expected = [
+                scalar(date_time_start_sent, now_time)
+                for date_time_start_sent in date_times_start_sent
+            ]
+            scalar_elapsed = time.perf_counter() - start
+
+            start = time.perf_counter()
+            result = vectorized(starts, now_time)
+            vectorized_elapsed = time.perf_counter() - start
+
+            self.assertEqual(from_datetime64(result), expected)
+            print(
+                f"\n{scalar.__name__}, {rows} строк: "
+                f"{scalar_elapsed:.2f} с -> {vectorized_elapsed:.3f} с "
+                f"(x{scalar_elapsed / vectorized_elapsed:.0f})"
+            )
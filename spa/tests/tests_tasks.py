@@ -0,0 +1,677 @@
+import os
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from unittest import skipUnless
+from unittest.mock import patch
+
+from django.core.cache import cache
+from django.db import connection
+from django.test import TransactionTestCase, skipUnlessDBFeature
+from django.utils import timezone
+from freezegun import freeze_time
+from rest_framework.test import APITestCase
+
+from spa.models import Habit, Place, Action, NotificationOutbox
+from config.celery import app as celery_app
+from spa.tasks import (
+    claim_chunks,
+    deliver_notifications,
+    enqueue_due_habits,
+    get_due_habits,
+    get_notification_shards,
+    purge_notifications,
+    send_user_notification_in_telegram,
+)
+from users.models import TelegramChat, User
+from users.services_telegram import TelegramClient, TelegramSendResult
+
+# python manage.py test - запуск тестов
+# python manage.py test spa.tests.tests_tasks - запуск конкретного файла
+# coverage run --source='.' manage.py test - запуск проверки покрытия
+# coverage report -m - получение отчета с пропущенными строками
+
+
+def send_message(chat_id, text):
+    return TelegramSendResult(chat_id=chat_id, ok=True)
+
+
+@freeze_time("2024-01-14 03:21:34", tz_offset=0)
+@patch.object(TelegramClient, "send_message", side_effect=send_message)
+class SendUserNotificationTestCase(APITestCase):
+    """Данные тесты описывают рассылку оповещений о привычках"""
+
+    def setUp(self) -> None:
+        cache.clear()
+        self.user = User.objects.create(
+            email="user@my.ru", tg_chat_id=1, tg_coalesce_notifications=False
+        )
+        self.place = Place.objects.create(name="Дом")
+        self.action = Action.objects.create(name="Пробежка")
+
+    def add_habits(
+        self, count, period=Habit.PERIOD_EVERY_DAY, render=True, **kwargs
+    ):
+        habits = [
+            Habit(
+                user=self.user,
+                place=self.place,
+                action=self.action,
+                date_time=timezone.datetime(
+                    1997, 10, 19, 12, 0, tzinfo=timezone.timezone.utc
+                ),
+                period=period,
+                reward="Бургер",
+                date_time_next_sent=timezone.datetime(
+                    2024, 1, 14, 3, 21, tzinfo=timezone.timezone.utc
+                ),
+                **kwargs,
+            )
+            for _ in range(count)
+        ]
+        # bulk_create не вызывает save(), текст оповещения собираем сами
+        if render:
+            for habit in habits:
+                habit.notification_message = (
+                    habit.render_notification_message()
+                )
+        return Habit.objects.bulk_create(habits)
+
+    def enqueue(self):
+        now_time = timezone.now().replace(second=0, microsecond=0)
+        return enqueue_due_habits(get_due_habits(now_time), now_time)
+
+    def send(self):
+        result = self.enqueue()
+        deliver_notifications()
+        return result
+
+    def test_reschedule_every_period(self, mock_send):
+        expected = {
+            Habit.PERIOD_EVERY_MINUTE: timezone.datetime(
+                2024, 1, 14, 3, 22, tzinfo=timezone.timezone.utc
+            ),
+            Habit.PERIOD_EVERY_HOUR: timezone.datetime(
+                2024, 1, 14, 4, 0, tzinfo=timezone.timezone.utc
+            ),
+            Habit.PERIOD_EVERY_DAY: timezone.datetime(
+                2024, 1, 14, 12, 0, tzinfo=timezone.timezone.utc
+            ),
+            Habit.PERIOD_EVERY_WEEK: timezone.datetime(
+                2024, 1, 14, 12, 0, tzinfo=timezone.timezone.utc
+            ),
+        }
+        for period in expected:
+            self.add_habits(1, period=period)
+
+        result = self.send()
+
+        self.assertEqual(result["queued"], len(expected))
+        self.assertEqual(result["rescheduled"], len(expected))
+        self.assertEqual(mock_send.call_count, len(expected))
+        for habit in Habit.objects.all():
+            self.assertEqual(habit.date_time_next_sent, expected[habit.period])
+
+    def test_reschedule_first_occurrence(self, mock_send):
+        # Первое оповещение совпадает с началом привычки
+        self.add_habits(1, period=Habit.PERIOD_EVERY_MINUTE)
+        Habit.objects.update(
+            date_time=timezone.datetime(
+                2024, 1, 14, 3, 21, tzinfo=timezone.timezone.utc
+            )
+        )
+
+        self.send()
+
+        self.assertEqual(
+            Habit.objects.get().date_time_next_sent,
+            timezone.datetime(
+                2024, 1, 14, 3, 22, tzinfo=timezone.timezone.utc
+            ),
+        )
+
+    def test_skip_disabled(self, mock_send):
+        # Время оповещения осталось от периода до отключения
+        self.add_habits(1, period=Habit.PERIOD_DISABLE)
+
+        self.send()
+
+        mock_send.assert_not_called()
+        self.assertFalse(NotificationOutbox.objects.exists())
+
+    def test_reschedule_in_batches(self, mock_send):
+        habits = self.add_habits(10)
+
+        # 10 привычек при пачке в 4 строки - 3 UPDATE-запроса
+        with self.assertNumQueries(3):
+            rescheduled = Habit.bulk_reschedule(
+                habits, timezone.now(), batch_size=4
+            )
+
+        self.assertEqual(rescheduled, 10)
+        self.assertFalse(
+            Habit.objects.filter(
+                date_time_next_sent__lte=timezone.now()
+            ).exists()
+        )
+
+    def test_constant_query_count(self, mock_send):
+        related_habit = Habit.objects.create(
+            user=self.user,
+            place=self.place,
+            action=self.action,
+            date_time=timezone.now(),
+            is_pleasant=True,
+        )
+
+        # Захват, выборка одним JOIN-запросом, а в транзакции (в тесте -
+        # точка сохранения) один INSERT в очередь и один UPDATE на порцию,
+        # независимо от количества привычек в порции
+        for count in (2, 20):
+            self.add_habits(count, related_habit=related_habit)
+            with self.assertNumQueries(6):
+                result = self.enqueue()
+            self.assertEqual(result["rescheduled"], count)
+        deliver_notifications()
+
+        message = mock_send.call_args.args[1]
+        self.assertIn(f"Место: {self.place.name}.", message)
+        self.assertIn(f"награды {related_habit.title}!", message)
+
+    def test_render_missing_messages(self, mock_send):
+        self.add_habits(3, render=False)
+
+        # + выборка для сборки текста и один UPDATE на порцию
+        with self.assertNumQueries(8):
+            self.enqueue()
+        deliver_notifications()
+
+        self.assertEqual(mock_send.call_count, 3)
+        self.assertIn("Место: Дом.", mock_send.call_args.args[1])
+        self.assertFalse(
+            Habit.objects.filter(notification_message="").exists()
+        )
+
+    def test_resolve_chat_ids(self, mock_send):
+        self.user.tg_chat_id = 0
+        self.user.tg_name = "OldSumerian"
+        self.user.save()
+        TelegramChat.objects.create(username="oldsumerian", chat_id=111)
+        self.add_habits(3)
+
+        # + 1 запрос к индексу чатов и 1 UPDATE пользователей на порцию
+        with self.assertNumQueries(8):
+            result = self.enqueue()
+        deliver_notifications()
+
+        self.assertEqual(result["queued"], 3)
+        self.assertEqual(
+            {call.args[0] for call in mock_send.call_args_list}, {111}
+        )
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.tg_chat_id, 111)
+
+    def test_skip_users_without_telegram(self, mock_send):
+        self.add_habits(1)
+        self.user = User.objects.create(email="user1@my.ru")
+        self.add_habits(2)
+
+        # Пользователь без чата и без имени в Telegram в выборку не попадает
+        result = self.send()
+
+        self.assertEqual(result["rescheduled"], 1)
+        self.assertEqual(
+            Habit.objects.filter(
+                user=self.user, date_time_next_sent__lte=timezone.now()
+            ).count(),
+            2,
+        )
+
+    @patch("spa.tasks.HABIT_NOTIFICATION_CHUNK_SIZE", 4)
+    def test_chunked_iteration(self, mock_send):
+        self.add_habits(10)
+
+        # По 6 запросов на каждую из 3 порций по 4 привычки
+        with self.assertNumQueries(18):
+            result = self.enqueue()
+        deliver_notifications()
+
+        self.assertEqual(result["rescheduled"], 10)
+        self.assertEqual(mock_send.call_count, 10)
+
+    def test_shards(self, mock_send):
+        users = [
+            User.objects.create(email=f"user{i}@my.ru", tg_chat_id=1)
+            for i in range(4)
+        ]
+        for user in users:
+            self.user = user
+            self.add_habits(3)
+        user_id_min, user_id_max = users[0].pk, users[-1].pk
+
+        # 12 привычек по 5 в шарде - 3 шарда, покрывающие всех пользователей
+        shards = get_notification_shards(timezone.now(), 5)
+        self.assertEqual(len(shards), 3)
+        self.assertEqual(shards[0][0], user_id_min)
+        self.assertEqual(shards[-1][1], user_id_max)
+        for (_, prev_to), (next_from, _) in zip(shards, shards[1:]):
+            self.assertEqual(next_from, prev_to + 1)
+
+        # Шардов не больше, чем пользователей в диапазоне
+        self.assertEqual(len(get_notification_shards(timezone.now(), 1)), 4)
+
+    def test_shards_empty(self, mock_send):
+        self.assertEqual(get_notification_shards(timezone.now(), 5), [])
+
+    @patch("spa.tasks.HABIT_NOTIFICATION_SHARD_SIZE", 2)
+    def test_coordinator(self, mock_send):
+        # Шарды и итоговый колбэк выполняются синхронно, без брокера
+        celery_app.conf.task_always_eager = True
+        self.addCleanup(setattr, celery_app.conf, "task_always_eager", False)
+
+        for i in range(3):
+            self.user = User.objects.create(
+                email=f"user{i}@my.ru", tg_chat_id=i + 1
+            )
+            self.add_habits(2)
+
+        # Доставка запускается после фиксации транзакции
+        with patch("builtins.print") as mock_print:
+            with self.captureOnCommitCallbacks(execute=True):
+                result = send_user_notification_in_telegram()
+
+        self.assertEqual(result["shards"], 3)
+        # Оповещения каждого пользователя объединены в одно сообщение
+        self.assertEqual(mock_send.call_count, 3)
+        printed = [call.args[0] for call in mock_print.call_args_list]
+        self.assertTrue(
+            any("перенесено привычек: 6" in line for line in printed)
+        )
+        self.assertFalse(
+            Habit.objects.filter(
+                date_time_next_sent__lte=timezone.now()
+            ).exists()
+        )
+
+
+@freeze_time("2024-01-14 03:21:34", tz_offset=0)
+class NotificationOutboxTestCase(APITestCase):
+    """Данные тесты описывают очередь оповещений и их доставку"""
+
+    def setUp(self) -> None:
+        cache.clear()
+        user = User.objects.create(email="user@my.ru", tg_chat_id=1)
+        self.habit = Habit.objects.create(
+            user=user,
+            place=Place.objects.create(name="Дом"),
+            action=Action.objects.create(name="Пробежка"),
+            date_time=timezone.datetime(
+                1997, 10, 19, 12, 0, tzinfo=timezone.timezone.utc
+            ),
+            period=Habit.PERIOD_EVERY_DAY,
+            reward="Бургер",
+            date_time_next_sent=timezone.datetime(
+                2024, 1, 14, 3, 21, tzinfo=timezone.timezone.utc
+            ),
+        )
+
+    def enqueue(self):
+        now_time = timezone.now().replace(second=0, microsecond=0)
+        return enqueue_due_habits(get_due_habits(now_time), now_time)
+
+    def deliver(self, result):
+        with patch.object(
+            TelegramClient, "send_message", return_value=result
+        ) as mock_send:
+            totals = deliver_notifications()
+        return totals, mock_send
+
+    def test_enqueue_and_reschedule_atomically(self):
+        with patch.object(
+            Habit, "bulk_reschedule", side_effect=RuntimeError
+        ), self.assertRaises(RuntimeError):
+            self.enqueue()
+
+        # Перенос не удался - оповещение в очередь тоже не попало
+        self.assertFalse(NotificationOutbox.objects.exists())
+
+        Habit.objects.update(claimed_until=None)
+        result = self.enqueue()
+
+        self.assertEqual(result["queued"], 1)
+        notification = NotificationOutbox.objects.get()
+        self.assertEqual(notification.habit, self.habit)
+        self.assertEqual(
+            notification.occurrence, self.habit.date_time_next_sent
+        )
+        self.assertEqual(
+            notification.status, NotificationOutbox.STATUS_PENDING
+        )
+
+    def test_deduplicate_occurrence(self):
+        self.enqueue()
+        # То же оповещение, например, после ручного отката расписания
+        Habit.objects.update(
+            date_time_next_sent=self.habit.date_time_next_sent
+        )
+        self.enqueue()
+
+        self.assertEqual(NotificationOutbox.objects.count(), 1)
+
+    def test_deliver(self):
+        self.enqueue()
+
+        totals, mock_send = self.deliver(
+            TelegramSendResult(chat_id=1, ok=True)
+        )
+
+        self.assertEqual(
+            totals, {"messages": 1, "sent": 1, "retried": 0, "failed": 0}
+        )
+        mock_send.assert_called_once_with(
+            1, Habit.objects.get().notification_message
+        )
+        notification = NotificationOutbox.objects.get()
+        self.assertEqual(notification.status, NotificationOutbox.STATUS_SENT)
+        self.assertEqual(notification.sent_at, timezone.now())
+
+        # Доставленное оповещение повторно не отправляется
+        _, mock_send = self.deliver(TelegramSendResult(chat_id=1, ok=True))
+        mock_send.assert_not_called()
+
+    def test_retry_after(self):
+        self.enqueue()
+
+        totals, _ = self.deliver(
+            TelegramSendResult(chat_id=1, ok=False, retry_after=5)
+        )
+
+        self.assertEqual(totals["retried"], 1)
+        notification = NotificationOutbox.objects.get()
+        self.assertEqual(
+            notification.status, NotificationOutbox.STATUS_PENDING
+        )
+        self.assertEqual(notification.attempts, 0)
+        self.assertEqual(
+            notification.available_at,
+            timezone.now() + timezone.timedelta(seconds=5),
+        )
+
+    @patch("spa.tasks.NOTIFICATION_MAX_ATTEMPTS", 2)
+    def test_give_up_after_max_attempts(self):
+        self.enqueue()
+        failure = TelegramSendResult(chat_id=1, ok=False, status_code=400)
+
+        with freeze_time("2024-01-14 03:21:34") as frozen_time:
+            totals, _ = self.deliver(failure)
+            self.assertEqual(totals["retried"], 1)
+
+            # До истечения интервала повтора оповещение не берётся
+            _, mock_send = self.deliver(failure)
+            mock_send.assert_not_called()
+
+            frozen_time.tick(timezone.timedelta(minutes=1))
+            totals, _ = self.deliver(failure)
+
+        self.assertEqual(totals["failed"], 1)
+        notification = NotificationOutbox.objects.get()
+        self.assertEqual(notification.status, NotificationOutbox.STATUS_FAILED)
+        self.assertEqual(notification.attempts, 2)
+
+    @patch("spa.tasks.NOTIFICATION_PURGE_BATCH_SIZE", 1)
+    def test_purge(self):
+        self.add_simultaneous_habits()
+        self.add_simultaneous_habits()
+        self.enqueue()
+        ids = list(
+            NotificationOutbox.objects.order_by("id").values_list(
+                "id", flat=True
+            )
+        )
+        NotificationOutbox.objects.filter(id__in=ids[:2]).update(
+            status=NotificationOutbox.STATUS_SENT
+        )
+        NotificationOutbox.objects.filter(id__in=ids[2:4]).update(
+            status=NotificationOutbox.STATUS_FAILED
+        )
+        # Устарели все, кроме одного доставленного
+        NotificationOutbox.objects.exclude(id=ids[1]).update(
+            created_at=timezone.now() - timezone.timedelta(days=8)
+        )
+
+        self.assertEqual(purge_notifications(), 3)
+
+        # Ожидающие доставки и свежие оповещения остаются
+        self.assertEqual(
+            list(
+                NotificationOutbox.objects.order_by("id").values_list(
+                    "id", flat=True
+                )
+            ),
+            [ids[1], ids[4]],
+        )
+
+    def add_simultaneous_habits(self):
+        for reward in ("Кофе", "Книга"):
+            self.habit.pk = None
+            self.habit.reward = reward
+            self.habit.save()
+
+    def test_coalesce(self):
+        self.add_simultaneous_habits()
+        self.enqueue()
+
+        totals, mock_send = self.deliver(
+            TelegramSendResult(chat_id=1, ok=True)
+        )
+
+        self.assertEqual(totals["messages"], 1)
+        self.assertEqual(totals["sent"], 3)
+        text = mock_send.call_args.args[1]
+        self.assertTrue(text.startswith("Пора выполнять привычки (3)!\n\n"))
+        for reward in ("Бургер", "Кофе", "Книга"):
+            self.assertIn(f"А в качестве награды {reward}!", text)
+        self.assertFalse(
+            NotificationOutbox.objects.exclude(
+                status=NotificationOutbox.STATUS_SENT
+            ).exists()
+        )
+
+    def test_coalesce_disabled(self):
+        self.add_simultaneous_habits()
+        User.objects.update(tg_coalesce_notifications=False)
+        self.enqueue()
+        # Настройка копируется в очередь, доставка её не присоединяет
+        User.objects.update(tg_coalesce_notifications=True)
+
+        totals, mock_send = self.deliver(
+            TelegramSendResult(chat_id=1, ok=True)
+        )
+
+        self.assertEqual(totals["messages"], 3)
+        self.assertEqual(mock_send.call_count, 3)
+
+    @patch("spa.tasks.TELEGRAM_MESSAGE_MAX_LENGTH", 150)
+    def test_split_long_message(self):
+        self.add_simultaneous_habits()
+        self.enqueue()
+        results = iter(
+            [
+                TelegramSendResult(chat_id=1, ok=True),
+                TelegramSendResult(chat_id=1, ok=False, status_code=500),
+                TelegramSendResult(chat_id=1, ok=True),
+            ]
+        )
+
+        with patch.object(
+            TelegramClient,
+            "send_message",
+            side_effect=lambda *_: next(results),
+        ) as mock_send:
+            totals = deliver_notifications()
+
+        # Каждая часть не длиннее лимита, блоки оповещений не разорваны
+        texts = [call.args[1] for call in mock_send.call_args_list]
+        self.assertEqual(totals["messages"], len(texts))
+        self.assertGreater(len(texts), 1)
+        for text in texts:
+            self.assertLessEqual(len(text), 150)
+        self.assertEqual(sum(text.count("Место:") for text in texts), 3)
+
+        # Одна из частей не доставлена - повторяются только оповещения
+        # из неё, доставленные части заново не отправляются
+        self.assertEqual(totals["sent"], 2)
+        self.assertEqual(totals["retried"], 1)
+        failed = NotificationOutbox.objects.get(
+            status=NotificationOutbox.STATUS_PENDING
+        )
+        self.assertIn(failed.message.split("\n", 1)[1], texts[1])
+
+        with freeze_time(failed.available_at):
+            totals, mock_send = self.deliver(
+                TelegramSendResult(chat_id=1, ok=True)
+            )
+
+        self.assertEqual(totals["sent"], 1)
+        mock_send.assert_called_once_with(1, failed.message)
+
+
+class ConcurrentClaimTestCase(TransactionTestCase):
+    """Данные тесты описывают параллельные запуски рассылки:
+    каждая привычка должна быть отправлена ровно один раз"""
+
+    def setUp(self) -> None:
+        cache.clear()
+        self.user = User.objects.create(
+            email="user@my.ru", tg_chat_id=1, tg_coalesce_notifications=False
+        )
+        place = Place.objects.create(name="Дом")
+        action = Action.objects.create(name="Пробежка")
+        self.habits = Habit.objects.bulk_create(
+            Habit(
+                user=self.user,
+                place=place,
+                action=action,
+                date_time=timezone.datetime(
+                    1997, 10, 19, 12, 0, tzinfo=timezone.timezone.utc
+                ),
+                period=Habit.PERIOD_EVERY_DAY,
+                reward=f"награда {i}",
+                date_time_next_sent=timezone.now()
+                - timezone.timedelta(hours=1),
+            )
+            for i in range(40)
+        )
+
+    def test_interleaved_claims(self):
+        # Запуски захватывают порции по очереди, ещё ничего не перенеся
+        claimers = [
+            claim_chunks(get_due_habits(timezone.now()), 3) for _ in range(4)
+        ]
+        claimed = Counter()
+        while claimers:
+            for claimer in list(claimers):
+                habits = next(claimer, None)
+                if habits is None:
+                    claimers.remove(claimer)
+                else:
+                    claimed.update(habit.pk for habit in habits)
+
+        self.assertEqual(set(claimed), {habit.pk for habit in self.habits})
+        self.assertEqual(set(claimed.values()), {1})
+
+    def run_concurrently(self, target, count=4):
+        def run():
+            try:
+                target()
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=run) for _ in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    # SQLite не допускает параллельной записи из нескольких соединений
+    @skipUnlessDBFeature("has_select_for_update_skip_locked")
+    @patch("spa.tasks.HABIT_NOTIFICATION_CHUNK_SIZE", 3)
+    @patch("spa.tasks.NOTIFICATION_DELIVERY_BATCH_SIZE", 3)
+    @patch("spa.tasks.deliver_notifications.delay")
+    def test_concurrent_claimers(self, mock_delay):
+        rescheduled = Counter()
+        sent = Counter()
+        lock = threading.Lock()
+
+        def enqueue():
+            now_time = timezone.now()
+            result = enqueue_due_habits(get_due_habits(now_time), now_time)
+            with lock:
+                rescheduled["total"] += result["rescheduled"]
+
+        def send_message(chat_id, text):
+            with lock:
+                sent[text] += 1
+            return TelegramSendResult(chat_id=chat_id, ok=True)
+
+        # Параллельные запуски рассылки, затем параллельные воркеры доставки
+        self.run_concurrently(enqueue)
+        with patch.object(
+            TelegramClient, "send_message", side_effect=send_message
+        ):
+            self.run_concurrently(deliver_notifications)
+
+        self.assertEqual(rescheduled["total"], len(self.habits))
+        self.assertEqual(len(sent), len(self.habits))
+        self.assertEqual(set(sent.values()), {1})
+        self.assertFalse(
+            Habit.objects.filter(
+                date_time_next_sent__lte=timezone.now()
+            ).exists()
+        )
+
+
+@skipUnless(os.getenv("RUN_BENCHMARKS"), "RUN_BENCHMARKS не задан")
+@patch.object(TelegramClient, "send_message", new=staticmethod(send_message))
+class SendUserNotificationBenchmark(APITestCase):
+    """Замер пикового потребления памяти рассылкой
+    (RUN_BENCHMARKS=1 BENCHMARK_ROWS=1000000 python manage.py test
+    spa.tests.tests_tasks.SendUserNotificationBenchmark)"""
+
+    def test_peak_memory(self):
+        rows = int(os.getenv("BENCHMARK_ROWS", 1_000_000))
+        user = User.objects.create(email="user@my.ru", tg_chat_id=1)
+        place = Place.objects.create(name="Дом")
+        action = Action.objects.create(name="Пробежка")
+        Habit.objects.bulk_create(
+            (
+                Habit(
+                    user=user,
+                    place=place,
+                    action=action,
+                    date_time=timezone.datetime(
+                        1997, 10, 19, 12, 0, tzinfo=timezone.timezone.utc
+                    ),
+                    period=Habit.PERIOD_EVERY_DAY,
+                    date_time_next_sent=timezone.now()
+                    - timezone.timedelta(hours=1),
+                )
+                for _ in range(rows)
+            ),
+            batch_size=10_000,
+        )
+
+        tracemalloc.start()
+        start = time.perf_counter()
+        now_time = timezone.now()
+        enqueue_due_habits(get_due_habits(now_time), now_time)
+        deliver_notifications()
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        print(
+            f"\n{rows} привычек: {elapsed:.1f} с, "
+            f"пик памяти {peak / 2**20:.1f} МиБ"
+        )
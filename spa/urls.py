@@ -6,6 +6,8 @@ from spa.views import (
     PlaceViewSet,
     ActionViewSet,
     HabitCreateAPIView,
+    HabitBulkAPIView,
+    HabitExportAPIView,
     HabitListAPIView,
     HabitRetrieveAPIView,
     HabitUpdateAPIView,
@@ -25,6 +27,12 @@ urlpatterns = (
         path(
             "habit/create/", HabitCreateAPIView.as_view(), name="habit-create"
         ),
+        path("habit/bulk/", HabitBulkAPIView.as_view(), name="habit-bulk"),
+        path(
+            "habit/export/",
+            HabitExportAPIView.as_view(),
+            name="habit-export",
+        ),
         path(
             "habit/list/my/", HabitListAPIView.as_view(), name="habit-list-my"
         ),
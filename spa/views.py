@@ -1,13 +1,36 @@
+from django.http import StreamingHttpResponse
 from rest_framework import generics, viewsets
+from rest_framework.exceptions import ValidationError
 from rest_framework.permissions import IsAuthenticated
-
+from rest_framework.response import Response
+
+from config.settings import HABIT_BULK_MAX_SIZE
+from spa.export import (
+    EXPORT_CONTENT_TYPES,
+    EXPORT_FORMAT_NDJSON,
+    export_habits,
+)
+from spa.mixins import (
+    ConditionalListMixin,
+    ConditionalObjectMixin,
+    ValuesListMixin,
+)
 from spa.models import Habit, Place, Action
-from spa.paginators import CustomPagePagination
-from spa.serializers import HabitSerializer, PlaceSerializer, ActionSerializer
+from spa.paginators import HabitListPagination
+from spa.public_feed import public_feed_cache
+from spa.schedule_index import schedule_index
+from spa.serializers import (
+    HabitSerializer,
+    PlaceSerializer,
+    ActionSerializer,
+    habit_values_serializer,
+)
 from users.permissions import IsOwner
 
 
-class PlaceViewSet(viewsets.ModelViewSet):
+class PlaceViewSet(
+    ConditionalObjectMixin, ConditionalListMixin, viewsets.ModelViewSet
+):
     """Место выполнения привычки"""
 
     serializer_class = PlaceSerializer
@@ -25,7 +48,9 @@ class PlaceViewSet(viewsets.ModelViewSet):
         return super().get_permissions()
 
 
-class ActionViewSet(viewsets.ModelViewSet):
+class ActionViewSet(
+    ConditionalObjectMixin, ConditionalListMixin, viewsets.ModelViewSet
+):
     """Действия привычки"""
 
     serializer_class = ActionSerializer
@@ -51,16 +76,73 @@ class HabitCreateAPIView(generics.CreateAPIView):
 
     def perform_create(self, serializer):
         obj = serializer.save(user=self.request.user)
-        obj.set_next_execution_time()
-        obj.save()
+        schedule_index.add([obj])
+
 
+class HabitBulkAPIView(generics.GenericAPIView):
+    """Создание и изменение списка привычек одним запросом
+    (см. spa.serializers.HabitListSerializer)"""
 
-class HabitListAPIView(generics.ListAPIView):
+    serializer_class = HabitSerializer
+    permission_classes = [IsAuthenticated]
+    queryset = Habit.objects.all()
+
+    def get_queryset(self):
+        # изменять можно только свои привычки
+        return self.queryset.filter(user=self.request.user)
+
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(
+            self.get_queryset(),
+            data=request.data,
+            many=True,
+            max_length=HABIT_BULK_MAX_SIZE,
+        )
+        serializer.is_valid(raise_exception=True)
+        habits = serializer.save(user=self.request.user)
+        schedule_index.add(habits)
+        return Response(serializer.data)
+
+
+class HabitExportAPIView(generics.GenericAPIView):
+    """Выгрузка своих привычек целиком: ?export_format=ndjson или csv
+    (параметр format занят DRF под выбор рендерера)"""
+
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, *args, **kwargs):
+        export_format = request.query_params.get(
+            "export_format", EXPORT_FORMAT_NDJSON
+        )
+        if export_format not in EXPORT_CONTENT_TYPES:
+            raise ValidationError(
+                {
+                    "export_format": [
+                        f"Формат может быть только из списка: "
+                        f"{', '.join(EXPORT_CONTENT_TYPES)}"
+                    ]
+                }
+            )
+
+        response = StreamingHttpResponse(
+            export_habits(request.user, export_format),
+            content_type=EXPORT_CONTENT_TYPES[export_format],
+        )
+        response["Content-Disposition"] = (
+            f'attachment; filename="habits.{export_format}"'
+        )
+        return response
+
+
+class HabitListAPIView(
+    ConditionalListMixin, ValuesListMixin, generics.ListAPIView
+):
     """Просмотр своих привычек"""
 
     serializer_class = HabitSerializer
+    values_serializer = habit_values_serializer
     permission_classes = [IsAuthenticated, IsOwner]
-    pagination_class = CustomPagePagination
+    pagination_class = HabitListPagination
     queryset = Habit.objects.all().order_by("id")
 
     def get_queryset(self):
@@ -68,16 +150,27 @@ class HabitListAPIView(generics.ListAPIView):
         return self.queryset.filter(user=self.request.user)
 
 
-class HabitPublicListAPIView(generics.ListAPIView):
+class HabitPublicListAPIView(ValuesListMixin, generics.ListAPIView):
     """Просмотр всех публичных привычек"""
 
     serializer_class = HabitSerializer
+    values_serializer = habit_values_serializer
     permission_classes = [IsAuthenticated]
-    pagination_class = CustomPagePagination
+    pagination_class = HabitListPagination
     queryset = Habit.objects.all().filter(is_public=True).order_by("id")
 
+    def list(self, request, *args, **kwargs):
+        # Лента одинакова для всех пользователей, поэтому страница
+        # кэшируется целиком (см. spa.public_feed)
+        build = super().list
+        page = public_feed_cache.get_or_build(
+            request.build_absolute_uri(),
+            lambda: build(request, *args, **kwargs).data,
+        )
+        return Response(page)
 
-class HabitRetrieveAPIView(generics.RetrieveAPIView):
+
+class HabitRetrieveAPIView(ConditionalObjectMixin, generics.RetrieveAPIView):
     """Просмотр конкретной привычки"""
 
     serializer_class = HabitSerializer
@@ -85,7 +178,7 @@ class HabitRetrieveAPIView(generics.RetrieveAPIView):
     permission_classes = [IsAuthenticated, IsOwner]
 
 
-class HabitUpdateAPIView(generics.UpdateAPIView):
+class HabitUpdateAPIView(ConditionalObjectMixin, generics.UpdateAPIView):
     """Обновление привычки"""
 
     serializer_class = HabitSerializer
@@ -94,8 +187,7 @@ class HabitUpdateAPIView(generics.UpdateAPIView):
 
     def perform_update(self, serializer):
         habit = serializer.save()
-        habit.set_next_execution_time()
-        habit.save()
+        schedule_index.add([habit])
 
 
 class HabitDeleteAPIView(generics.DestroyAPIView):
@@ -103,3 +195,8 @@ class HabitDeleteAPIView(generics.DestroyAPIView):
 
     queryset = Habit.objects.all()
     permission_classes = [IsAuthenticated, IsOwner]
+
+    def perform_destroy(self, instance):
+        habit_id = instance.pk
+        instance.delete()
+        schedule_index.remove([habit_id])
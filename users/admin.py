@@ -1,5 +1,6 @@
 from django.contrib import admin
 
-from users.models import User
+from users.models import User, TelegramChat
 
 admin.site.register(User)
+admin.site.register(TelegramChat)
@@ -0,0 +1,26 @@
+from http import HTTPStatus
+
+from django.core.management import BaseCommand, CommandError
+
+from config.settings import TELEGRAM_WEBHOOK_SECRET
+from users.services_telegram import telegram_client
+
+
+# Пример: python manage.py set_telegram_webhook
+# https://example.com/users/telegram/webhook/
+class Command(BaseCommand):
+    help = "Устанавливает webhook бота с секретом TELEGRAM_WEBHOOK_SECRET"
+
+    def add_arguments(self, parser):
+        parser.add_argument("url")
+
+    def handle(self, *args, **kwargs):
+        if not TELEGRAM_WEBHOOK_SECRET:
+            raise CommandError("Не задан TELEGRAM_WEBHOOK_SECRET")
+
+        response = telegram_client.set_webhook(
+            kwargs["url"], TELEGRAM_WEBHOOK_SECRET
+        )
+        if response.status_code != HTTPStatus.OK:
+            raise CommandError(f"Error: {response.status_code}")
+        self.stdout.write("Webhook установлен")
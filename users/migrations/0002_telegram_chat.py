@@ -0,0 +1,57 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("users", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="TelegramChat",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "username",
+                    models.CharField(
+                        max_length=150, unique=True, verbose_name="Имя в Telegram"
+                    ),
+                ),
+                ("chat_id", models.BigIntegerField(verbose_name="Chat ID")),
+            ],
+            options={
+                "verbose_name": "Чат Telegram",
+                "verbose_name_plural": "Чаты Telegram",
+            },
+        ),
+        migrations.CreateModel(
+            name="TelegramUpdatesOffset",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("offset", models.BigIntegerField(default=0, verbose_name="Смещение")),
+            ],
+            options={
+                "verbose_name": "Смещение обновлений Telegram",
+                "verbose_name_plural": "Смещения обновлений Telegram",
+            },
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("users", "0002_telegram_chat"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="user",
+            name="tg_coalesce_notifications",
+            field=models.BooleanField(
+                default=True, verbose_name="Объединять одновременные оповещения"
+            ),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("users", "0003_user_tg_coalesce_notifications"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="user",
+            name="tg_chat_id",
+            field=models.BigIntegerField(default=0, verbose_name="Chat ID"),
+        ),
+    ]
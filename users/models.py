@@ -49,7 +49,12 @@ class User(AbstractUser):
         max_length=150, verbose_name="Имя в Telegram", default=""
     )
 
-    tg_chat_id = models.IntegerField(verbose_name="Chat ID", default=0)
+    tg_chat_id = models.BigIntegerField(verbose_name="Chat ID", default=0)
+
+    # Несколько оповещений на одно и то же время приходят одним сообщением
+    tg_coalesce_notifications = models.BooleanField(
+        verbose_name="Объединять одновременные оповещения", default=True
+    )
 
     USERNAME_FIELD = "email"
     REQUIRED_FIELDS = []
@@ -60,3 +65,30 @@ class User(AbstractUser):
 
     def __str__(self):
         return self.email
+
+
+class TelegramChat(models.Model):
+    """Индекс "имя пользователя в Telegram -> ID чата",
+    наполняемый из обновлений бота"""
+
+    username = models.CharField(
+        max_length=150, unique=True, verbose_name="Имя в Telegram"
+    )
+    chat_id = models.BigIntegerField(verbose_name="Chat ID")
+
+    class Meta:
+        verbose_name = "Чат Telegram"
+        verbose_name_plural = "Чаты Telegram"
+
+    def __str__(self):
+        return f"{self.username}: {self.chat_id}"
+
+
+class TelegramUpdatesOffset(models.Model):
+    """Смещение getUpdates: ID последнего обработанного обновления + 1"""
+
+    offset = models.BigIntegerField(default=0, verbose_name="Смещение")
+
+    class Meta:
+        verbose_name = "Смещение обновлений Telegram"
+        verbose_name_plural = "Смещения обновлений Telegram"
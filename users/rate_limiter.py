@@ -0,0 +1,166 @@
+"""
+Ограничение частоты отправки сообщений в Telegram
+(https://core.telegram.org/bots/faq#my-bot-is-hitting-limits-how-do-i-avoid-this):
+не более ~30 сообщений в секунду на бота и ~1 сообщения в секунду в чат.
+
+Используется алгоритм token bucket. Состояние хранится в Redis,
+чтобы лимит был общим для всех воркеров, а при отсутствии Redis -
+в памяти текущего процесса.
+"""
+
+import math
+import threading
+import time
+
+import redis
+
+from config.settings import (
+    TELEGRAM_CHAT_RATE,
+    TELEGRAM_FLOOD_THRESHOLD,
+    TELEGRAM_FLOOD_WINDOW,
+    TELEGRAM_GLOBAL_RATE,
+    TELEGRAM_RATE_LIMIT_MAX_WAIT,
+    TELEGRAM_RATE_LIMIT_REDIS_URL,
+)
+
+# Пополняет корзину по прошедшему времени и пытается забрать токен.
+# Возвращает время ожидания (строкой) до появления токена, 0 - токен взят.
+TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local penalty = tonumber(ARGV[3])
+local now_time = redis.call("TIME")
+local now = tonumber(now_time[1]) + tonumber(now_time[2]) / 1000000
+
+local bucket = redis.call("HMGET", KEYS[1], "tokens", "ts")
+local tokens = tonumber(bucket[1]) or capacity
+local ts = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+
+local wait = 0
+if penalty > 0 then
+    tokens = math.min(tokens, -penalty * rate)
+elseif tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = (1 - tokens) / rate
+end
+
+redis.call("HSET", KEYS[1], "tokens", tokens, "ts", now)
+redis.call("EXPIRE", KEYS[1], math.ceil((capacity - tokens) / rate) + 1)
+return tostring(wait)
+"""
+
+
+class InMemoryTokenBucket:
+    """Token bucket в памяти процесса"""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def take(self, key, penalty=0):
+        """Забирает токен из корзины key. Возвращает время ожидания
+        до появления токена, 0 - токен взят. penalty - штраф в секундах,
+        на который корзина опустошается (ответ 429 с retry_after).
+        Штрафы не суммируются: повторный штраф лишь продлевает
+        ожидание до penalty секунд от текущего момента."""
+        with self.lock:
+            now = time.monotonic()
+            tokens, ts = self.buckets.get(key, (self.capacity, now))
+            tokens = min(self.capacity, tokens + (now - ts) * self.rate)
+
+            wait = 0
+            if penalty > 0:
+                tokens = min(tokens, -penalty * self.rate)
+            elif tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / self.rate
+
+            if tokens >= self.capacity:
+                # Полная корзина ничем не отличается от отсутствующей
+                self.buckets.pop(key, None)
+            else:
+                self.buckets[key] = (tokens, now)
+            return wait
+
+
+class RedisTokenBucket:
+    """Token bucket в Redis, общий для всех процессов"""
+
+    def __init__(self, client, rate, capacity=None, prefix="tg_rate"):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.prefix = prefix
+        self.script = client.register_script(TOKEN_BUCKET_SCRIPT)
+
+    def take(self, key, penalty=0):
+        return float(
+            self.script(
+                keys=[f"{self.prefix}:{key}"],
+                args=[self.rate, self.capacity, penalty],
+            )
+        )
+
+
+class TelegramRateLimiter:
+    """Глобальный лимит на бота и отдельный лимит на каждый чат"""
+
+    def __init__(
+        self,
+        redis_url=TELEGRAM_RATE_LIMIT_REDIS_URL,
+        global_rate=TELEGRAM_GLOBAL_RATE,
+        chat_rate=TELEGRAM_CHAT_RATE,
+        max_wait=TELEGRAM_RATE_LIMIT_MAX_WAIT,
+        flood_threshold=TELEGRAM_FLOOD_THRESHOLD,
+        flood_window=TELEGRAM_FLOOD_WINDOW,
+        redis_client=None,
+    ):
+        self.max_wait = max_wait
+
+        if redis_client is None and redis_url:
+            redis_client = redis.Redis.from_url(redis_url)
+
+        # Ответы 429: не больше flood_threshold за flood_window секунд
+        flood_rate = flood_threshold / flood_window
+        if redis_client is not None:
+            self.global_bucket = RedisTokenBucket(redis_client, global_rate)
+            self.chat_bucket = RedisTokenBucket(
+                redis_client, chat_rate, capacity=1
+            )
+            self.flood_bucket = RedisTokenBucket(
+                redis_client, flood_rate, capacity=flood_threshold
+            )
+        else:
+            self.global_bucket = InMemoryTokenBucket(global_rate)
+            self.chat_bucket = InMemoryTokenBucket(chat_rate, capacity=1)
+            self.flood_bucket = InMemoryTokenBucket(
+                flood_rate, capacity=flood_threshold
+            )
+
+    def acquire(self, chat_id):
+        """Ждёт, пока отправка в чат будет разрешена обоими лимитами.
+        Возвращает 0, если отправлять можно, иначе - через сколько секунд
+        стоит повторить (если ждать пришлось бы дольше max_wait)."""
+        deadline = time.monotonic() + self.max_wait
+        for bucket, key in (
+            (self.chat_bucket, f"chat:{chat_id}"),
+            (self.global_bucket, "global"),
+        ):
+            while wait := bucket.take(key):
+                if time.monotonic() + wait > deadline:
+                    return math.ceil(wait)
+                time.sleep(wait)
+        return 0
+
+    def penalize(self, chat_id, retry_after):
+        """Telegram ответил 429: в чат ничего не отправляем ближайшие
+        retry_after секунд. Если такие ответы идут из многих чатов
+        подряд, превышен общий лимит бота, и на retry_after секунд
+        приостанавливаются отправки во все чаты"""
+        self.chat_bucket.take(f"chat:{chat_id}", penalty=retry_after)
+        if self.flood_bucket.take("flood"):
+            self.global_bucket.take("global", penalty=retry_after)
@@ -1,63 +1,300 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from http import HTTPStatus
 
 import requests
+from django.core.cache import cache
+from requests.adapters import HTTPAdapter
 
-from config.settings import TELEGRAM_API_URL, TELEGRAM_BOT_TOKEN
-from users.models import User
+from config.settings import (
+    TELEGRAM_API_URL,
+    TELEGRAM_BOT_TOKEN,
+    TELEGRAM_CHAT_ID_MISS_BACKOFF,
+    TELEGRAM_CHAT_ID_MISS_MAX_BACKOFF,
+    TELEGRAM_CHAT_ID_MISS_TTL,
+    TELEGRAM_MAX_WORKERS,
+    TELEGRAM_POOL_SIZE,
+    TELEGRAM_TIMEOUT,
+)
+from users.models import TelegramChat, TelegramUpdatesOffset, User
+from users.rate_limiter import TelegramRateLimiter
 
 
-def get_chat_id(username):
+@dataclass
+class TelegramSendResult:
+    """Результат отправки одного сообщения"""
+
+    chat_id: int
+    ok: bool
+    status_code: int | None = None
+    # Через сколько секунд повторить отправку, если упёрлись в лимиты
+    retry_after: int | None = None
+
+
+class TelegramClient:
     """
-    Возвращает ID чата по имени пользователя в Telegram.
+    Клиент Telegram Bot API. Все запросы идут через одну сессию
+    с пулом keep-alive соединений, пачки сообщений отправляются
+    параллельно ограниченным пулом потоков с учётом лимитов Telegram.
     """
-    response = requests.get(
-        f"{TELEGRAM_API_URL}/bot{TELEGRAM_BOT_TOKEN}/getUpdates",
-    )
 
-    if response.status_code == HTTPStatus.OK:
-        chat_data = response.json()
-        if chat_data["result"]:
-            for chat in chat_data["result"]:
-                if chat["message"]["from"]["username"] == username:
-                    return chat["message"]["chat"]["id"]
-            print("Чат с данным пользователем не существует")
-            return 0
-        else:
-            print("Чат пуст")
-            return 0
-    else:
-        print(f"Error: {response.status_code}")
+    def __init__(
+        self,
+        api_url=TELEGRAM_API_URL,
+        bot_token=TELEGRAM_BOT_TOKEN,
+        pool_size=TELEGRAM_POOL_SIZE,
+        max_workers=TELEGRAM_MAX_WORKERS,
+        timeout=TELEGRAM_TIMEOUT,
+        rate_limiter=None,
+    ):
+        self.base_url = f"{api_url}/bot{bot_token}"
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.rate_limiter = rate_limiter or TelegramRateLimiter()
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def get_updates(self, **params):
+        return self.session.get(
+            f"{self.base_url}/getUpdates", params=params, timeout=self.timeout
+        )
+
+    def set_webhook(self, url, secret_token):
+        return self.session.post(
+            f"{self.base_url}/setWebhook",
+            json={"url": url, "secret_token": secret_token},
+            timeout=self.timeout,
+        )
+
+    def send_message(self, chat_id, text) -> TelegramSendResult:
+        """
+        Отправляет сообщение в чат с указанным ID чата.
+        """
+        if not chat_id:
+            return TelegramSendResult(chat_id=chat_id, ok=False)
+
+        retry_after = self.rate_limiter.acquire(chat_id)
+        if retry_after:
+            return TelegramSendResult(
+                chat_id=chat_id, ok=False, retry_after=retry_after
+            )
+
+        try:
+            response = self.session.post(
+                f"{self.base_url}/sendMessage",
+                json={"chat_id": chat_id, "text": text},
+                timeout=self.timeout,
+            )
+        except requests.RequestException as error:
+            print(f"Error: {error}")
+            return TelegramSendResult(chat_id=chat_id, ok=False)
+
+        if response.status_code == HTTPStatus.TOO_MANY_REQUESTS:
+            # {"ok": false, "error_code": 429,
+            #  "parameters": {"retry_after": 5}, ...}
+            try:
+                retry_after = response.json()["parameters"]["retry_after"]
+            except (ValueError, KeyError, TypeError):
+                retry_after = 1
+            self.rate_limiter.penalize(chat_id, retry_after)
+            return TelegramSendResult(
+                chat_id=chat_id,
+                ok=False,
+                status_code=response.status_code,
+                retry_after=retry_after,
+            )
+
+        return TelegramSendResult(
+            chat_id=chat_id,
+            ok=response.status_code == HTTPStatus.OK,
+            status_code=response.status_code,
+        )
+
+    def send_messages(self, messages) -> list[TelegramSendResult]:
+        """
+        Отправляет пачку сообщений [(chat_id, text), ...] параллельно.
+        Результаты возвращаются в том же порядке, что и сообщения.
+        """
+        messages = list(messages)
+        if not messages:
+            return []
+
+        with ThreadPoolExecutor(
+            max_workers=min(self.max_workers, len(messages))
+        ) as executor:
+            return list(
+                executor.map(
+                    lambda message: self.send_message(*message), messages
+                )
+            )
+
+
+telegram_client = TelegramClient()
+
+
+def normalize_tg_name(tg_name):
+    # Имена в Telegram регистронезависимы, "@" пользователи пишут по-разному
+    return tg_name.strip().lstrip("@").lower()
+
+
+def get_chat_id_miss_key(tg_name):
+    return f"tg_chat_id_miss:{normalize_tg_name(tg_name)}"
+
+
+def invalidate_chat_id_misses(tg_names):
+    """Забывает неудачные поиски ID чата, например, когда пользователь
+    написал боту или сменил имя в Telegram"""
+    cache.delete_many([get_chat_id_miss_key(tg_name) for tg_name in tg_names])
+
+
+def get_update_chat(update):
+    """
+    Возвращает пару (имя пользователя, ID чата) из обновления бота
+    или None, если в нём нет сообщения от пользователя с именем.
+    Поднимает ValueError, если обновление не того формата, что
+    присылает Telegram (например, тело формы вместо JSON).
+    """
+    if not isinstance(update, dict):
+        raise ValueError("Обновление должно быть объектом")
+    message = update.get("message") or update.get("edited_message")
+    if not message:
+        return None
+    if not isinstance(message, dict):
+        raise ValueError("Сообщение должно быть объектом")
+    sender = message.get("from") or {}
+    chat = message.get("chat") or {}
+    if not isinstance(sender, dict) or not isinstance(chat, dict):
+        raise ValueError("Отправитель и чат должны быть объектами")
+
+    username = sender.get("username")
+    chat_id = chat.get("id")
+    if not username or not chat_id:
+        return None
+    if not isinstance(username, str) or type(chat_id) is not int:
+        raise ValueError("Неверное имя пользователя или ID чата")
+    return username, chat_id
+
+
+def save_telegram_chats(updates):
+    """
+    Сохраняет пары (имя пользователя, ID чата) из обновлений бота
+    (из getUpdates или webhook) одним upsert-запросом. Обновления
+    не того формата пропускаются.
+    Возвращает количество сохранённых чатов.
+    """
+    chats = {}
+    for update in updates:
+        try:
+            chat = get_update_chat(update)
+        except ValueError:
+            continue
+        if chat:
+            username, chat_id = chat
+            chats[normalize_tg_name(username)] = chat_id
+
+    if not chats:
         return 0
 
+    TelegramChat.objects.bulk_create(
+        [
+            TelegramChat(username=username, chat_id=chat_id)
+            for username, chat_id in chats.items()
+        ],
+        update_conflicts=True,
+        unique_fields=["username"],
+        update_fields=["chat_id"],
+    )
+    invalidate_chat_id_misses(chats)
+    return len(chats)
 
-def update_chat_id(user: User):
-    # Если чат ид не нулевой, то ничего не делаем
-    if user.tg_chat_id:
-        return
 
-    # Получаем ID чата из Telegram
-    chat_id = get_chat_id(user.tg_name)
-    if chat_id:
-        user.tg_chat_id = chat_id
-        user.save()
+def ingest_telegram_updates(limit=100):
+    """
+    Забирает из getUpdates только новые обновления, начиная с сохранённого
+    смещения, и складывает ID чатов в индекс TelegramChat.
+    Возвращает количество обработанных обновлений.
+    """
+    state, _ = TelegramUpdatesOffset.objects.get_or_create(pk=1)
+
+    processed = 0
+    while True:
+        response = telegram_client.get_updates(
+            offset=state.offset, limit=limit, timeout=0
+        )
+        if response.status_code != HTTPStatus.OK:
+            print(f"Error: {response.status_code}")
+            break
+
+        updates = response.json()["result"]
+        if not updates:
+            break
 
+        save_telegram_chats(updates)
+        processed += len(updates)
 
-def sent_notification_in_telegram(message, chat_id) -> bool:
+        # Подтверждаем обработанные обновления: Telegram их больше не вернёт
+        state.offset = updates[-1]["update_id"] + 1
+        state.save(update_fields=["offset"])
+
+        if len(updates) < limit:
+            break
+
+    return processed
+
+
+def update_chat_ids(users):
     """
-    Отправляет сообщение в чат с указанным ID чата.
+    Заполняет ID чатов пользователям без него одним индексным запросом
+    к TelegramChat, без обращения к Telegram. Имена, которые недавно
+    не нашлись, повторно ищутся не раньше, чем истечёт их backoff.
     """
-    if not chat_id:
-        print("Chat id не указан")
-        return False
+    users = [user for user in users if not user.tg_chat_id and user.tg_name]
+    if not users:
+        return
+
+    now = time.time()
+    misses = cache.get_many(
+        {get_chat_id_miss_key(user.tg_name) for user in users}
+    )
+
+    def is_backed_off(user):
+        miss = misses.get(get_chat_id_miss_key(user.tg_name))
+        return miss is not None and miss["retry_at"] > now
+
+    users = [user for user in users if not is_backed_off(user)]
+    if not users:
+        return
 
-    response = requests.post(
-        f"{TELEGRAM_API_URL}/bot{TELEGRAM_BOT_TOKEN}/sendMessage",
-        params={"chat_id": chat_id, "text": message},
+    chat_ids = dict(
+        TelegramChat.objects.filter(
+            username__in={normalize_tg_name(user.tg_name) for user in users}
+        ).values_list("username", "chat_id")
     )
 
-    if response.status_code == HTTPStatus.OK:
-        print("Сообщение успешно отправлено")
-        return True
-    else:
-        print(f"Error: {response.status_code}")
-        return False
+    resolved = {}
+    new_misses = {}
+    for user in users:
+        chat_id = chat_ids.get(normalize_tg_name(user.tg_name))
+        if chat_id:
+            user.tg_chat_id = chat_id
+            resolved[user.pk] = user
+        else:
+            key = get_chat_id_miss_key(user.tg_name)
+            attempts = misses.get(key, {}).get("attempts", 0) + 1
+            new_misses[key] = {
+                "attempts": attempts,
+                "retry_at": now
+                + min(
+                    TELEGRAM_CHAT_ID_MISS_BACKOFF * 2 ** (attempts - 1),
+                    TELEGRAM_CHAT_ID_MISS_MAX_BACKOFF,
+                ),
+            }
+
+    if resolved:
+        User.objects.bulk_update(resolved.values(), ["tg_chat_id"])
+    if new_misses:
+        cache.set_many(new_misses, timeout=TELEGRAM_CHAT_ID_MISS_TTL)
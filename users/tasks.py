@@ -0,0 +1,13 @@
+from celery import shared_task
+
+from config.settings import TELEGRAM_WEBHOOK_SECRET
+from users.services_telegram import ingest_telegram_updates
+
+
+@shared_task
+def poll_telegram_updates():
+    """Периодически забирает новые обновления бота, пока не настроен
+    webhook (при установленном webhook'е getUpdates недоступен)"""
+    if TELEGRAM_WEBHOOK_SECRET:
+        return 0
+    return ingest_telegram_updates()
@@ -0,0 +1,119 @@
+import fakeredis
+import responses
+from rest_framework.test import APITestCase
+
+from config.settings import TELEGRAM_API_URL, TELEGRAM_BOT_TOKEN
+from users.rate_limiter import (
+    InMemoryTokenBucket,
+    RedisTokenBucket,
+    TelegramRateLimiter,
+)
+from users.services_telegram import TelegramClient
+
+# python manage.py test - запуск тестов
+# python manage.py test users.tests.tests_rate_limiter - запуск конкретного файла
+# coverage run --source='.' manage.py test - запуск проверки покрытия
+# coverage report -m - получение отчета с пропущенными строками
+
+
+class TokenBucketTestCase(APITestCase):
+    """Данные тесты описывают корзины токенов в памяти и в Redis"""
+
+    def get_buckets(self, rate, capacity=None):
+        return (
+            InMemoryTokenBucket(rate, capacity),
+            RedisTokenBucket(fakeredis.FakeRedis(), rate, capacity),
+        )
+
+    def test_take(self):
+        for bucket in self.get_buckets(30):
+            with self.subTest(bucket=type(bucket).__name__):
+                for _ in range(30):
+                    self.assertEqual(bucket.take("global"), 0)
+
+                # Корзина пуста - ждать примерно 1/30 секунды
+                wait = bucket.take("global")
+                self.assertGreater(wait, 0)
+                self.assertLessEqual(wait, 1 / 30)
+
+                # У другого ключа своя корзина
+                self.assertEqual(bucket.take("other"), 0)
+
+    def test_penalty(self):
+        for bucket in self.get_buckets(1, capacity=1):
+            with self.subTest(bucket=type(bucket).__name__):
+                bucket.take("chat:1", penalty=5)
+                wait = bucket.take("chat:1")
+                self.assertGreater(wait, 5)
+                self.assertLessEqual(wait, 6)
+
+                # Штрафы не суммируются
+                for _ in range(20):
+                    bucket.take("chat:1", penalty=5)
+                self.assertLessEqual(bucket.take("chat:1"), 6)
+
+    def test_redis_shared_between_processes(self):
+        server = fakeredis.FakeServer()
+        first = RedisTokenBucket(fakeredis.FakeRedis(server=server), 1)
+        second = RedisTokenBucket(fakeredis.FakeRedis(server=server), 1)
+
+        self.assertEqual(first.take("chat:1"), 0)
+        self.assertGreater(second.take("chat:1"), 0)
+
+
+class TelegramRateLimiterTestCase(APITestCase):
+    """Данные тесты описывают лимиты на отправку сообщений в Telegram"""
+
+    def setUp(self) -> None:
+        self.limiter = TelegramRateLimiter(
+            redis_client=fakeredis.FakeRedis(), max_wait=0
+        )
+        self.client = TelegramClient(rate_limiter=self.limiter)
+        self.url = f"{TELEGRAM_API_URL}/bot{TELEGRAM_BOT_TOKEN}/sendMessage"
+
+    def test_penalize_flood(self):
+        # Ответы 429 из разных чатов: лимит бота превышен
+        for chat_id in range(1, 4):
+            self.limiter.penalize(chat_id, 5)
+            self.assertEqual(self.limiter.acquire(100 + chat_id), 0)
+        for chat_id in range(4, 24):
+            self.limiter.penalize(chat_id, 5)
+
+        # Общая пауза - retry_after, а не сумма штрафов
+        wait = self.limiter.acquire(100)
+        self.assertGreaterEqual(wait, 5)
+        self.assertLessEqual(wait, 6)
+
+    def test_acquire_chat_limit(self):
+        self.assertEqual(self.limiter.acquire(111111111), 0)
+        # Второе сообщение в тот же чат - не раньше, чем через секунду
+        self.assertEqual(self.limiter.acquire(111111111), 1)
+        self.assertEqual(self.limiter.acquire(222222222), 0)
+
+    @responses.activate
+    def test_send_message_too_many_requests(self):
+        body = (
+            '{"ok":false,"error_code":429,'
+            '"description":"Too Many Requests: retry after 5",'
+            '"parameters":{"retry_after":5}}'
+        )
+
+        responses.add(
+            **{
+                "method": responses.POST,
+                "url": self.url,
+                "body": body,
+                "status": 429,
+                "content_type": "application/json",
+            }
+        )
+
+        result = self.client.send_message(111111111, "message")
+
+        self.assertFalse(result.ok)
+        self.assertEqual(result.retry_after, 5)
+        # До истечения retry_after в чат больше не отправляем
+        self.assertGreaterEqual(self.limiter.acquire(111111111), 5)
+        # Другие чаты один ответ 429 не задерживает
+        self.assertEqual(self.limiter.acquire(222222222), 0)
+        self.assertEqual(len(responses.calls), 1)
@@ -1,29 +1,111 @@
+from unittest.mock import patch
+
+from django.core.cache import cache
+from freezegun import freeze_time
+from rest_framework import status
+from rest_framework.reverse import reverse
 from rest_framework.test import APITestCase
 import responses
 
 from config.settings import TELEGRAM_API_URL, TELEGRAM_BOT_TOKEN
-from users.models import User
+from users.models import TelegramChat, TelegramUpdatesOffset, User
 from users.services_telegram import (
-    get_chat_id,
-    sent_notification_in_telegram,
-    update_chat_id,
+    TelegramClient,
+    ingest_telegram_updates,
+    update_chat_ids,
 )
 
 
 class TestCase(APITestCase):
 
+    def setUp(self) -> None:
+        cache.clear()
+
     @responses.activate
-    def test_get_chat_id_OK(self):
-        username = "OldSumerian"
+    def test_update_chat_id_exists(self):
+        user = User.objects.create(
+            email="user@my.ru", tg_name="OldSumerian", tg_chat_id=1
+        )
+        update_chat_ids([user])
+        self.assertEqual(user.tg_chat_id, 1)
+
+    def test_update_chat_id_new_chat_id(self):
+        user = User.objects.create(
+            email="user@my.ru", tg_name="@oldSumerian", tg_chat_id=0
+        )
+        TelegramChat.objects.create(username="oldsumerian", chat_id=111111111)
+
+        # ID чата берётся из индекса, без запросов к Telegram
+        with self.assertNumQueries(2):
+            update_chat_ids([user])
+        self.assertEqual(user.tg_chat_id, 111111111)
+        user.refresh_from_db()
+        self.assertEqual(user.tg_chat_id, 111111111)
+
+    def test_update_chat_id_big(self):
+        # ID чатов Telegram не помещаются в 32 бита
+        user = User.objects.create(email="user@my.ru", tg_name="OldSumerian")
+        TelegramChat.objects.create(username="oldsumerian", chat_id=2**33)
+
+        update_chat_ids([user])
+        user.refresh_from_db()
+        self.assertEqual(user.tg_chat_id, 2**33)
+        self.assertEqual(
+            User._meta.get_field("tg_chat_id").get_internal_type(),
+            "BigIntegerField",
+        )
+
+    def test_update_chat_id_not_found(self):
+        user = User.objects.create(
+            email="user@my.ru", tg_name="OldSumerian", tg_chat_id=0
+        )
+
+        with self.assertNumQueries(1):
+            update_chat_ids([user])
+        self.assertEqual(user.tg_chat_id, 0)
+
+    def test_update_chat_id_miss_backoff(self):
+        user = User.objects.create(
+            email="user@my.ru", tg_name="OldSumerian", tg_chat_id=0
+        )
+
+        with freeze_time("2024-01-14 03:21:00") as frozen_time:
+            with self.assertNumQueries(1):
+                update_chat_ids([user])
+
+            # Неудачный поиск закэширован на TELEGRAM_CHAT_ID_MISS_BACKOFF
+            with self.assertNumQueries(0):
+                update_chat_ids([user])
+
+            frozen_time.tick(61)
+            with self.assertNumQueries(1):
+                update_chat_ids([user])
+
+            # Вторая неудача - интервал удваивается
+            frozen_time.tick(61)
+            with self.assertNumQueries(0):
+                update_chat_ids([user])
+
+            frozen_time.tick(60)
+            TelegramChat.objects.create(
+                username="oldsumerian", chat_id=111111111
+            )
+            with self.assertNumQueries(2):
+                update_chat_ids([user])
+            self.assertEqual(user.tg_chat_id, 111111111)
+
+    @responses.activate
+    def test_ingest_telegram_updates_invalidates_miss(self):
+        user = User.objects.create(
+            email="user@my.ru", tg_name="OldSumerian", tg_chat_id=0
+        )
+        update_chat_ids([user])
 
         body = (
             '{"ok":true,"result":[{"update_id":24152962,"message":'
             '{"message_id":3,"from":{"id":111111111,"is_bot":false,'
-            '"first_name":"Sergey","last_name":"Shemerov","username":'
-            '"OldSumerian","language_code":"ru"},"chat":'
-            '{"id":111111111,"first_name":"Sergey","last_name":'
-            '"Shemerov","username":"OldSumerian","type":"private"},'
-            '"date":1725895346,"text":"sddds"}}]}'
+            '"username":"OldSumerian"},"chat":{"id":111111111,'
+            '"type":"private"},"date":1725895346,"text":"sddds"}}]}'
         )
 
         responses.add(
@@ -35,13 +117,24 @@ class TestCase(APITestCase):
                 "content_type": "application/json",
             }
         )
+        ingest_telegram_updates()
 
-        self.assertEqual(get_chat_id(username), 111111111)
+        # Пользователь написал боту - ищем сразу, не дожидаясь backoff
+        update_chat_ids([user])
+        self.assertEqual(user.tg_chat_id, 111111111)
 
     @responses.activate
-    def test_get_chat_id_empty(self):
-        username = "OldSumerian"
-        body = '{"ok":true,"result":[]}'
+    def test_ingest_telegram_updates(self):
+        body = (
+            '{"ok":true,"result":[{"update_id":24152962,"message":'
+            '{"message_id":3,"from":{"id":111111111,"is_bot":false,'
+            '"first_name":"Sergey","last_name":"Shemerov","username":'
+            '"OldSumerian","language_code":"ru"},"chat":'
+            '{"id":111111111,"first_name":"Sergey","last_name":'
+            '"Shemerov","username":"OldSumerian","type":"private"},'
+            '"date":1725895346,"text":"sddds"}},{"update_id":24152963,'
+            '"my_chat_member":{}}]}'
+        )
 
         responses.add(
             **{
@@ -50,22 +143,31 @@ class TestCase(APITestCase):
                 "body": body,
                 "status": 200,
                 "content_type": "application/json",
+                "match": [
+                    responses.matchers.query_param_matcher(
+                        {"offset": "0", "limit": "100", "timeout": "0"}
+                    )
+                ],
             }
         )
 
-        self.assertEqual(get_chat_id(username), 0)
+        self.assertEqual(ingest_telegram_updates(), 2)
+        self.assertEqual(
+            TelegramChat.objects.get(username="oldsumerian").chat_id,
+            111111111,
+        )
+        # Следующий опрос начнётся после последнего обработанного обновления
+        self.assertEqual(TelegramUpdatesOffset.objects.get().offset, 24152964)
 
     @responses.activate
-    def test_get_chat_id_user_not_found(self):
-        username = "NewUser"
+    def test_ingest_telegram_updates_changed_chat(self):
+        TelegramUpdatesOffset.objects.create(offset=24152962)
+        TelegramChat.objects.create(username="oldsumerian", chat_id=1)
         body = (
             '{"ok":true,"result":[{"update_id":24152962,"message":'
             '{"message_id":3,"from":{"id":111111111,"is_bot":false,'
-            '"first_name":"Ivan","last_name":"Ivanov","username":'
-            '"NewUser","language_code":"ru"},"chat":'
-            '{"id":111111111,"first_name":"Ivan","last_name":'
-            '"Ivanov","username":"NewUser","type":"private"},'
-            '"date":1725895346,"text":"sddds"}}]}'
+            '"username":"OldSumerian"},"chat":{"id":111111111,'
+            '"type":"private"},"date":1725895346,"text":"sddds"}}]}'
         )
 
         responses.add(
@@ -75,31 +177,34 @@ class TestCase(APITestCase):
                 "body": body,
                 "status": 200,
                 "content_type": "application/json",
+                "match": [
+                    responses.matchers.query_param_matcher(
+                        {"offset": "24152962", "limit": "100", "timeout": "0"}
+                    )
+                ],
             }
         )
 
-        self.assertEqual(get_chat_id(username), 0)
+        self.assertEqual(ingest_telegram_updates(), 1)
+        self.assertEqual(TelegramChat.objects.get().chat_id, 111111111)
 
     @responses.activate
-    def test_get_chat_id_not_ok(self):
-        username = "OldSumerian"
-        body = '{"ok":true,"result":[]}'
-
+    def test_ingest_telegram_updates_error(self):
         responses.add(
             **{
                 "method": responses.GET,
                 "url": f"{TELEGRAM_API_URL}/bot{TELEGRAM_BOT_TOKEN}/getUpdates",
-                "body": body,
-                "status": 404,
+                "body": '{"ok":false}',
+                "status": 502,
                 "content_type": "application/json",
             }
         )
 
-        self.assertEqual(get_chat_id(username), 0)
+        self.assertEqual(ingest_telegram_updates(), 0)
+        self.assertEqual(TelegramUpdatesOffset.objects.get().offset, 0)
 
     @responses.activate
-    def test_send_message_OK(self):
-        chat_id = 111111111
+    def test_send_messages(self):
         body = '{"ok":true}'
 
         responses.add(
@@ -109,22 +214,13 @@ class TestCase(APITestCase):
                 "body": body,
                 "status": 200,
                 "content_type": "application/json",
+                "match": [
+                    responses.matchers.json_params_matcher(
+                        {"chat_id": 111111111, "text": "message 1"}
+                    )
+                ],
             }
         )
-
-        self.assertTrue(sent_notification_in_telegram("message", chat_id))
-
-    @responses.activate
-    def test_send_message_no_chat_id(self):
-        chat_id = 0
-
-        self.assertFalse(sent_notification_in_telegram("message", chat_id))
-
-    @responses.activate
-    def test_send_message_fail(self):
-        chat_id = 111111111
-        body = '{"ok":true}'
-
         responses.add(
             **{
                 "method": responses.POST,
@@ -132,44 +228,131 @@ class TestCase(APITestCase):
                 "body": body,
                 "status": 403,
                 "content_type": "application/json",
+                "match": [
+                    responses.matchers.json_params_matcher(
+                        {"chat_id": 222222222, "text": "message 2"}
+                    )
+                ],
             }
         )
 
-        self.assertFalse(sent_notification_in_telegram("message", chat_id))
+        client = TelegramClient(max_workers=2)
+        results = client.send_messages(
+            [
+                (111111111, "message 1"),
+                (222222222, "message 2"),
+                (0, "message 3"),
+            ]
+        )
 
-    @responses.activate
-    def test_update_chat_id_exists(self):
-        user = User.objects.create(
-            email="user@my.ru", tg_name="OldSumerian", tg_chat_id=1
+        self.assertEqual(
+            [(result.chat_id, result.ok) for result in results],
+            [(111111111, True), (222222222, False), (0, False)],
+        )
+        self.assertEqual(results[1].status_code, 403)
+        # Сообщение без chat id в Telegram не отправляется
+        self.assertEqual(len(responses.calls), 2)
+
+    def test_send_messages_empty(self):
+        self.assertEqual(TelegramClient().send_messages([]), [])
+
+
+@patch("users.views.TELEGRAM_WEBHOOK_SECRET", "secret")
+class TelegramWebhookTestCase(APITestCase):
+    """Данные тесты описывают приём обновлений бота через webhook"""
+
+    update = {
+        "update_id": 24152962,
+        "message": {
+            "message_id": 3,
+            "from": {
+                "id": 111111111,
+                "is_bot": False,
+                "first_name": "Sergey",
+                "username": "OldSumerian",
+                "language_code": "ru",
+            },
+            "chat": {
+                "id": 111111111,
+                "first_name": "Sergey",
+                "username": "OldSumerian",
+                "type": "private",
+            },
+            "date": 1725895346,
+            "text": "/start",
+        },
+    }
+
+    def post_update(self, update, secret_token="secret"):
+        return self.client.post(
+            reverse("users:telegram-webhook"),
+            data=update,
+            format="json",
+            headers={"X-Telegram-Bot-Api-Secret-Token": secret_token},
+        )
+
+    def test_webhook(self):
+        # Одна запись в БД на обновление
+        with self.assertNumQueries(1):
+            response = self.post_update(self.update)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            TelegramChat.objects.get(username="oldsumerian").chat_id,
+            111111111,
         )
-        update_chat_id(user)
-        self.assertEqual(user.tg_chat_id, 1)
 
-    @responses.activate
-    def test_update_chat_id_new_chat_id(self):
         user = User.objects.create(
             email="user@my.ru", tg_name="OldSumerian", tg_chat_id=0
         )
+        update_chat_ids([user])
+        self.assertEqual(user.tg_chat_id, 111111111)
 
-        body = (
-            '{"ok":true,"result":[{"update_id":24152962,"message":'
-            '{"message_id":3,"from":{"id":111111111,"is_bot":false,'
-            '"first_name":"Sergey","last_name":"Shemerov","username":'
-            '"OldSumerian","language_code":"ru"},"chat":'
-            '{"id":111111111,"first_name":"Sergey","last_name":'
-            '"Shemerov","username":"OldSumerian","type":"private"},'
-            '"date":1725895346,"text":"sddds"}}]}'
+    def test_webhook_without_message(self):
+        with self.assertNumQueries(0):
+            response = self.post_update(
+                {"update_id": 24152963, "my_chat_member": {}}
+            )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse(TelegramChat.objects.exists())
+
+    def test_webhook_wrong_secret(self):
+        response = self.post_update(self.update, secret_token="wrong")
+
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        self.assertFalse(TelegramChat.objects.exists())
+
+    @patch("users.views.TELEGRAM_WEBHOOK_SECRET", None)
+    def test_webhook_not_configured(self):
+        response = self.post_update(self.update, secret_token="")
+
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_webhook_not_json(self):
+        response = self.client.post(
+            reverse("users:telegram-webhook"),
+            data={"message": "text"},
+            format="multipart",
+            headers={"X-Telegram-Bot-Api-Secret-Token": "secret"},
         )
 
-        responses.add(
-            **{
-                "method": responses.GET,
-                "url": f"{TELEGRAM_API_URL}/bot{TELEGRAM_BOT_TOKEN}/getUpdates",
-                "body": body,
-                "status": 200,
-                "content_type": "application/json",
-            }
+        self.assertEqual(
+            response.status_code, status.HTTP_415_UNSUPPORTED_MEDIA_TYPE
         )
 
-        update_chat_id(user)
-        self.assertEqual(user.tg_chat_id, 111111111)
+    def test_webhook_malformed(self):
+        for update in (
+            ["update"],
+            {"message": "text"},
+            {"message": {"from": "OldSumerian", "chat": {"id": 1}}},
+            {"message": {"from": {"username": "OldSumerian"}, "chat": 1}},
+            {"message": {"from": {"username": 1}, "chat": {"id": 1}}},
+        ):
+            with self.subTest(update=update):
+                response = self.post_update(update)
+
+                self.assertEqual(
+                    response.status_code, status.HTTP_400_BAD_REQUEST
+                )
+        self.assertFalse(TelegramChat.objects.exists())
@@ -1,8 +1,10 @@
+from django.core.cache import cache
 from rest_framework import status
 from rest_framework.reverse import reverse
 from rest_framework.test import APITestCase
 
-from users.models import User
+from users.models import TelegramChat, User
+from users.services_telegram import update_chat_ids
 
 
 # python manage.py test - запуск тестов
@@ -85,6 +87,28 @@ class UserTestCaseAuthenticated(APITestCase):
         user = User.objects.get(pk=self.user.pk)
         self.assertEqual(user.email, data["email"])
 
+    def test_user_update_tg_name(self):
+        cache.clear()
+        self.user.tg_name = "OldName"
+        self.user.tg_chat_id = 1
+        self.user.save()
+
+        # Новое имя раньше искали безуспешно - оно в кэше неудач
+        update_chat_ids([User(tg_name="NewName")])
+        TelegramChat.objects.create(username="newname", chat_id=111111111)
+
+        data = {"tg_name": "NewName"}
+        response = self.client.patch(
+            reverse("users:users-detail", args=(self.user.pk,)), data=data
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        # Прежний ID чата сброшен, а новое имя ищется сразу
+        user = User.objects.get(pk=self.user.pk)
+        self.assertEqual(user.tg_chat_id, 0)
+        update_chat_ids([user])
+        self.assertEqual(user.tg_chat_id, 111111111)
+
     def test_user_update_another(self):
         data = {"email": "new_email1@my.ru"}
         response = self.client.patch(
@@ -7,7 +7,7 @@ from rest_framework_simplejwt.views import (
 )
 
 from users.apps import UsersConfig
-from users.views import UserViewSet
+from users.views import TelegramWebhookAPIView, UserViewSet
 
 app_name = UsersConfig.name
 
@@ -25,4 +25,9 @@ urlpatterns = [
         TokenRefreshView.as_view(permission_classes=(AllowAny,)),
         name="token_refresh",
     ),
+    path(
+        "telegram/webhook/",
+        TelegramWebhookAPIView.as_view(),
+        name="telegram-webhook",
+    ),
 ] + router.urls
@@ -1,12 +1,25 @@
+import hmac
+
+from rest_framework import status
 from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.response import Response
+from rest_framework.views import APIView
 from rest_framework.viewsets import ModelViewSet
 
+from config.parsers import FastJSONParser
+from config.settings import TELEGRAM_WEBHOOK_SECRET
+
 from users.models import User
 from users.permissions import IsSelfProfile
 from users.serializers import (
     UserSerializer,
     UserShortSerializer,
 )
+from users.services_telegram import (
+    get_update_chat,
+    invalidate_chat_id_misses,
+    save_telegram_chats,
+)
 
 
 class UserViewSet(ModelViewSet):
@@ -35,6 +48,19 @@ class UserViewSet(ModelViewSet):
         user.set_password(user.password)
         user.save()
 
+    def perform_update(self, serializer):
+        tg_name = serializer.validated_data.get("tg_name")
+        if tg_name is None or tg_name == serializer.instance.tg_name:
+            serializer.save()
+            return
+
+        # Сменилось имя в Telegram: прежний чат больше не актуален,
+        # а новое имя ищем сразу, не дожидаясь истечения backoff
+        invalidate_chat_id_misses([tg_name])
+        serializer.save(
+            tg_chat_id=serializer.validated_data.get("tg_chat_id", 0)
+        )
+
     def get_permissions(self):
         if self.action == "create":
             self.permission_classes = [
@@ -49,3 +75,31 @@ class UserViewSet(ModelViewSet):
                 IsSelfProfile,
             ]
         return super().get_permissions()
+
+
+class TelegramWebhookAPIView(APIView):
+    """Приём обновлений бота, которые присылает Telegram"""
+
+    authentication_classes = []
+    permission_classes = [AllowAny]
+    # Telegram присылает обновления только в JSON
+    parser_classes = [FastJSONParser]
+
+    def post(self, request):
+        secret_token = request.headers.get(
+            "X-Telegram-Bot-Api-Secret-Token", ""
+        )
+        if not TELEGRAM_WEBHOOK_SECRET or not hmac.compare_digest(
+            secret_token, TELEGRAM_WEBHOOK_SECRET
+        ):
+            return Response(status=status.HTTP_403_FORBIDDEN)
+
+        try:
+            get_update_chat(request.data)
+        except ValueError as exc:
+            return Response(
+                {"detail": str(exc)}, status=status.HTTP_400_BAD_REQUEST
+            )
+
+        save_telegram_chats([request.data])
+        return Response({"ok": True})